@@ -7,26 +7,80 @@ FFmpeg Cloud Native Service
 import os
 import asyncio
 import logging
-from typing import Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
+import time
+import socket
+import functools
+import subprocess
+from typing import Optional, Dict, Any, List
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import redis
-from celery import Celery
+import redis.asyncio as aioredis
+from celery import Celery, group
+from celery.signals import worker_init, worker_process_init
 import ffmpeg
 import uuid
-import json
+import orjson
+import msgspec
+import uvloop
 from datetime import datetime
+from prometheus_client import (
+    CollectorRegistry, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+    generate_latest, multiprocess
+)
+
+# 事件循环替换为uvloop，API进程和worker内的asyncio.run均生效
+uvloop.install()
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Redis配置
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+
+# 连接池参数：限制连接数防止突发批量提交耗尽FD，开启keepalive及早发现失效连接
+# (redis-py建立连接时已默认设置TCP_NODELAY)
+REDIS_POOL_OPTIONS = {
+    "host": REDIS_HOST,
+    "port": REDIS_PORT,
+    "db": 0,
+    "decode_responses": True,
+    "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", 256)),
+    "socket_timeout": 5,
+    "socket_keepalive": True,
+    "socket_keepalive_options": {
+        socket.TCP_KEEPIDLE: 60,
+        socket.TCP_KEEPINTVL: 10,
+        socket.TCP_KEEPCNT: 3
+    },
+    "retry_on_timeout": True
+}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """在每个API进程启动后创建Redis连接池，关闭时释放"""
+    app.state.redis = aioredis.Redis(
+        connection_pool=aioredis.ConnectionPool(**REDIS_POOL_OPTIONS)
+    )
+    try:
+        yield
+    finally:
+        await app.state.redis.close()
+
+def get_redis(request: Request) -> aioredis.Redis:
+    """依赖注入：获取当前进程的异步Redis客户端"""
+    return request.app.state.redis
+
 # 初始化应用
 app = FastAPI(
     title="FFmpeg Cloud Native Service",
     description="基于FFmpeg的云原生视频处理服务",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS配置
@@ -38,14 +92,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Redis配置
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST", "localhost"),
-    port=int(os.getenv("REDIS_PORT", 6379)),
-    db=0,
-    decode_responses=True
+# 请求延迟指标
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP请求处理耗时",
+    ["method", "path", "status"]
 )
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """记录每个请求的处理耗时，按路由模板聚合"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_LATENCY.labels(
+        request.method,
+        route.path if route else request.url.path,
+        response.status_code
+    ).observe(time.perf_counter() - start)
+    return response
+
 # Celery配置
 celery_app = Celery(
     "ffmpeg_service",
@@ -53,8 +119,66 @@ celery_app = Celery(
     backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 )
 
+# worker本身只负责监督FFmpeg子进程，用线程池代替prefork，
+# 单个worker即可同时管理多路转码
+FFMPEG_MAX_INFLIGHT = int(os.getenv("FFMPEG_MAX_INFLIGHT", 16))
+celery_app.conf.update(
+    worker_pool="threads",
+    worker_concurrency=FFMPEG_MAX_INFLIGHT
+)
+
+def _default_x264_threads() -> int:
+    """按容器可用CPU和并发任务数确定每路编码线程数，避免超额订阅"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    return max(1, min(4, cpus // FFMPEG_MAX_INFLIGHT))
+
+# libx264默认按宿主机核数开线程，在受限cgroup里会严重抢占
+X264_THREADS = int(os.getenv("X264_THREADS", 0)) or _default_x264_threads()
+
+@functools.lru_cache(maxsize=1)
+def _detect_video_encoder() -> str:
+    """探测NVENC是否可用：编码器存在不代表有GPU，需要实际编码一帧验证"""
+    try:
+        subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error",
+             "-f", "lavfi", "-i", "color=s=64x64",
+             "-frames:v", "1", "-c:v", "h264_nvenc", "-f", "null", "-"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=10,
+            check=True
+        )
+        logger.info("检测到NVENC，使用h264_nvenc编码")
+        return "h264_nvenc"
+    except (OSError, subprocess.SubprocessError):
+        return "libx264"
+
+def _encoder_options(quality: str) -> Dict[str, Any]:
+    """根据可用编码器生成编码参数"""
+    if _detect_video_encoder() == "h264_nvenc":
+        return {
+            "vcodec": "h264_nvenc",
+            "preset": "p4",
+            "tune": "ull" if quality == "ultrafast" else "ll",
+            "rc": "cbr"
+        }
+    
+    options = {"vcodec": "libx264", "preset": quality, "threads": X264_THREADS}
+    if quality == "ultrafast":
+        options["tune"] = "zerolatency"
+    return options
+
+def now_ms() -> int:
+    """当前时间的毫秒级epoch，任务记录内部统一使用整数时间戳"""
+    return time.time_ns() // 1_000_000
+
+def ms_to_iso(ms: Optional[int]) -> Optional[str]:
+    """毫秒级epoch转ISO字符串，仅在API边界转换"""
+    return datetime.fromtimestamp(ms / 1000).isoformat() if ms is not None else None
+
 # 数据模型
-class VideoProcessingRequest(BaseModel):
+# 提交任务是热路径，请求/响应使用msgspec在C层完成校验和序列化
+class VideoProcessingRequest(msgspec.Struct):
     input_url: str
     output_format: str = "mp4"
     quality: str = "medium"
@@ -62,24 +186,80 @@ class VideoProcessingRequest(BaseModel):
     bitrate: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
 
-class VideoProcessingResponse(BaseModel):
+class VideoProcessingResponse(msgspec.Struct):
     job_id: str
     status: str
     message: str
     created_at: datetime
 
+request_decoder = msgspec.json.Decoder(VideoProcessingRequest)
+batch_request_decoder = msgspec.json.Decoder(List[VideoProcessingRequest])
+response_encoder = msgspec.json.Encoder()
+
+def decode_body(decoder: msgspec.json.Decoder, raw: bytes):
+    """解码请求体，校验失败时返回422"""
+    try:
+        return decoder.decode(raw)
+    except (msgspec.ValidationError, msgspec.DecodeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 class HealthResponse(BaseModel):
     status: str
     timestamp: datetime
     services: Dict[str, str]
 
+class Job(msgspec.Struct):
+    """Redis中的任务记录"""
+    job_id: str
+    request: Dict[str, Any]
+    status: str
+    created_at: int
+    updated_at: int
+    error: Optional[str] = None
+    output_url: Optional[str] = None
+
+# 任务记录以Hash存储，状态变化只写变更字段，TTL通过EXPIRE设置
+JOB_TTL = 3600
+
+def job_to_hash(job: Job) -> Dict[str, Any]:
+    """任务记录转为Redis Hash字段，嵌套的request单独序列化"""
+    fields = {k: v for k, v in msgspec.structs.asdict(job).items() if v is not None}
+    fields["request"] = orjson.dumps(job.request)
+    return fields
+
+def job_from_hash(fields: Dict[str, str]) -> Optional[Job]:
+    """从HGETALL结果还原任务记录，缺少request字段的残缺Hash视为不存在"""
+    if "request" not in fields:
+        return None
+    fields["request"] = orjson.loads(fields["request"])
+    return msgspec.convert(fields, Job, strict=False)
+
+# Celery inspect是广播操作，缓存结果避免每次探针都访问broker
+CELERY_PING_TTL = 5.0
+_celery_ping_cache: Dict[str, Any] = {"value": None, "expires": 0.0}
+_celery_ping_lock = asyncio.Lock()
+
+async def _celery_ping() -> bool:
+    """带TTL缓存的Celery worker探测"""
+    async with _celery_ping_lock:
+        now = time.monotonic()
+        if _celery_ping_cache["value"] is None or now >= _celery_ping_cache["expires"]:
+            replies = await asyncio.to_thread(celery_app.control.inspect().ping)
+            _celery_ping_cache["value"] = bool(replies)
+            _celery_ping_cache["expires"] = now + CELERY_PING_TTL
+        return _celery_ping_cache["value"]
+
 # 健康检查端点
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
+async def health_check(redis_client: aioredis.Redis = Depends(get_redis)):
     """健康检查端点"""
+    redis_ok, celery_ok = await asyncio.gather(
+        redis_client.ping(),
+        _celery_ping()
+    )
     services_status = {
-        "redis": "ok" if redis_client.ping() else "error",
-        "celery": "ok" if celery_app.control.inspect().ping() else "error"
+        "redis": "ok" if redis_ok else "error",
+        "celery": "ok" if celery_ok else "error"
     }
     
     return HealthResponse(
@@ -89,125 +269,191 @@ async def health_check():
     )
 
 @app.get("/ready")
-async def readiness_check():
+async def readiness_check(redis_client: aioredis.Redis = Depends(get_redis)):
     """就绪检查端点"""
     try:
         # 检查Redis连接
-        redis_client.ping()
+        await redis_client.ping()
         return {"status": "ready"}
     except Exception as e:
         logger.error(f"Readiness check failed: {e}")
         raise HTTPException(status_code=503, detail="Service not ready")
 
 # 视频处理端点
-@app.post("/process", response_model=VideoProcessingResponse)
+@app.post("/process")
 async def process_video(
-    request: VideoProcessingRequest,
-    background_tasks: BackgroundTasks
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    redis_client: aioredis.Redis = Depends(get_redis)
 ):
     """提交视频处理任务"""
+    request = decode_body(request_decoder, await http_request.body())
+    request_data = msgspec.structs.asdict(request)
     job_id = str(uuid.uuid4())
+    created_at = now_ms()
     
     # 创建任务记录
-    task_data = {
-        "job_id": job_id,
-        "request": request.dict(),
-        "status": "pending",
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat()
-    }
+    job = Job(
+        job_id=job_id,
+        request=request_data,
+        status="pending",
+        created_at=created_at,
+        updated_at=created_at
+    )
     
     # 保存到Redis
-    redis_client.setex(f"job:{job_id}", 3600, json.dumps(task_data))
+    key = f"job:{job_id}"
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(key, mapping=job_to_hash(job))
+    pipe.expire(key, JOB_TTL)
+    await pipe.execute()
     
     # 提交到Celery队列
-    process_video_task.delay(job_id, request.dict())
+    process_video_task.delay(job_id, request_data)
     
-    return VideoProcessingResponse(
+    response = VideoProcessingResponse(
         job_id=job_id,
         status="accepted",
         message="任务已提交到处理队列",
-        created_at=datetime.now()
+        created_at=datetime.fromtimestamp(created_at / 1000)
     )
+    return Response(content=response_encoder.encode(response), media_type="application/json")
 
 @app.get("/status/{job_id}")
-async def get_job_status(job_id: str):
+async def get_job_status(job_id: str, redis_client: aioredis.Redis = Depends(get_redis)):
     """获取任务状态"""
-    task_data = redis_client.get(f"job:{job_id}")
-    if not task_data:
+    job = job_from_hash(await redis_client.hgetall(f"job:{job_id}"))
+    if job is None:
         raise HTTPException(status_code=404, detail="任务未找到")
     
-    return json.loads(task_data)
+    task = msgspec.structs.asdict(job)
+    task["created_at"] = ms_to_iso(job.created_at)
+    task["updated_at"] = ms_to_iso(job.updated_at)
+    return task
 
 @app.get("/download/{job_id}")
-async def download_result(job_id: str):
+async def download_result(job_id: str, redis_client: aioredis.Redis = Depends(get_redis)):
     """下载处理结果"""
-    task_data = redis_client.get(f"job:{job_id}")
-    if not task_data:
+    job = job_from_hash(await redis_client.hgetall(f"job:{job_id}"))
+    if job is None:
         raise HTTPException(status_code=404, detail="任务未找到")
     
-    task = json.loads(task_data)
-    if task["status"] != "completed":
+    if job.status != "completed":
         raise HTTPException(status_code=400, detail="任务尚未完成")
     
     # 返回下载链接
-    return {"download_url": task.get("output_url")}
+    return {"download_url": job.output_url}
 
 # 批处理端点
 @app.post("/batch/process")
-async def process_batch_videos(requests: list[VideoProcessingRequest]):
+async def process_batch_videos(
+    http_request: Request,
+    redis_client: aioredis.Redis = Depends(get_redis)
+):
     """批量处理视频"""
+    requests = decode_body(batch_request_decoder, await http_request.body())
     job_ids = []
+    signatures = []
     
+    # 所有任务记录合并为一次Redis往返
+    pipe = redis_client.pipeline(transaction=False)
     for request in requests:
         job_id = str(uuid.uuid4())
         job_ids.append(job_id)
+        created_at = now_ms()
+        request_data = msgspec.structs.asdict(request)
         
-        task_data = {
-            "job_id": job_id,
-            "request": request.dict(),
-            "status": "pending",
-            "created_at": datetime.now().isoformat()
-        }
+        job = Job(
+            job_id=job_id,
+            request=request_data,
+            status="pending",
+            created_at=created_at,
+            updated_at=created_at
+        )
         
-        redis_client.setex(f"job:{job_id}", 3600, json.dumps(task_data))
-        process_video_task.delay(job_id, request.dict())
+        key = f"job:{job_id}"
+        pipe.hset(key, mapping=job_to_hash(job))
+        pipe.expire(key, JOB_TTL)
+        signatures.append(process_video_task.s(job_id, request_data))
+    await pipe.execute()
+    
+    # group在同一个broker连接上批量投递任务
+    if signatures:
+        group(signatures).apply_async()
     
     return {"job_ids": job_ids, "message": "批量任务已提交"}
 
+# 服务端更新任务字段：仅在记录仍存在时写入并续期，过期后迟到的更新不会重建残缺Hash
+UPDATE_JOB_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return nil end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# worker侧的Redis客户端在worker进程启动后创建，不在模块导入时连接
+worker_redis_client: Optional[redis.Redis] = None
+update_job = None
+
+@worker_init.connect
+@worker_process_init.connect
+def _init_worker_redis(**kwargs):
+    """worker启动(prefork时为每个子进程)后初始化Redis连接池"""
+    global worker_redis_client, update_job
+    worker_redis_client = redis.Redis(
+        connection_pool=redis.ConnectionPool(**REDIS_POOL_OPTIONS)
+    )
+    update_job = worker_redis_client.register_script(UPDATE_JOB_SCRIPT)
+
+async def _run_ffmpeg(args: list):
+    """异步执行FFmpeg命令，等待期间不占用解释器"""
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise ffmpeg.Error(args[0], stdout, stderr)
+
+def _update_job(job_id: str, **fields):
+    """原子更新任务记录中变化的字段，记录已过期时不写入"""
+    fields["updated_at"] = now_ms()
+    args = [JOB_TTL]
+    for name, value in fields.items():
+        args += [name, value]
+    update_job(keys=[f"job:{job_id}"], args=args)
+
 # Celery任务
 @celery_app.task(bind=True, max_retries=3)
 def process_video_task(self, job_id: str, request_data: dict):
     """处理视频转换任务"""
     try:
         # 更新任务状态
-        task_data = json.loads(redis_client.get(f"job:{job_id}"))
-        task_data["status"] = "processing"
-        task_data["updated_at"] = datetime.now().isoformat()
-        redis_client.setex(f"job:{job_id}", 3600, json.dumps(task_data))
+        _update_job(job_id, status="processing")
         
         # 处理视频
         output_path = f"/data/output/{job_id}.{request_data['output_format']}"
         
         # FFmpeg处理逻辑
-        (
+        encode_options = _encoder_options(request_data.get("quality", "medium"))
+        
+        args = (
             ffmpeg
             .input(request_data["input_url"])
             .output(
                 output_path,
-                vcodec="libx264",
                 acodec="aac",
-                preset=request_data.get("quality", "medium"),
+                **encode_options,
                 **{k: v for k, v in request_data.items() if k in ["resolution", "bitrate"] and v}
             )
-            .run(overwrite_output=True)
+            .overwrite_output()
+            .compile()
         )
+        asyncio.run(_run_ffmpeg(args))
         
         # 更新任务状态为完成
-        task_data["status"] = "completed"
-        task_data["output_url"] = f"/download/{job_id}"
-        task_data["updated_at"] = datetime.now().isoformat()
-        redis_client.setex(f"job:{job_id}", 3600, json.dumps(task_data))
+        _update_job(job_id, status="completed", output_url=f"/download/{job_id}")
         
         logger.info(f"Job {job_id} completed successfully")
         
@@ -215,11 +461,7 @@ def process_video_task(self, job_id: str, request_data: dict):
         logger.error(f"Job {job_id} failed: {exc}")
         
         # 更新任务状态为失败
-        task_data = json.loads(redis_client.get(f"job:{job_id}"))
-        task_data["status"] = "failed"
-        task_data["error"] = str(exc)
-        task_data["updated_at"] = datetime.now().isoformat()
-        redis_client.setex(f"job:{job_id}", 3600, json.dumps(task_data))
+        _update_job(job_id, status="failed", error=str(exc))
         
         # 重试机制
         raise self.retry(exc=exc, countdown=60)
@@ -228,9 +470,14 @@ def process_video_task(self, job_id: str, request_data: dict):
 @app.get("/metrics")
 async def get_metrics():
     """获取Prometheus指标"""
-    from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    # 多进程部署时聚合PROMETHEUS_MULTIPROC_DIR下所有worker的指标
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8080, loop="uvloop")
\ No newline at end of file
@@ -5,17 +5,29 @@ HLS低延迟优化器
 """
 
 import os
+import functools
 import asyncio
 import logging
 import time
+import subprocess
 from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
+import numpy as np
+from numba import njit
 import m3u8
 import ffmpeg
 import json
 from datetime import datetime, timedelta
 
+# MPEG-TS固定包长和PTS时钟频率
+TS_PACKET_SIZE = 188
+TS_CLOCK_RATE = 90000
+
+# HLS分片使用fMP4(CMAF)，比MPEG-TS少了188字节包头和PAT/PMT开销
+SEGMENT_EXTENSION = ".m4s"
+
 @dataclass
 class HLSSegment:
     """HLS分片信息"""
@@ -24,6 +36,144 @@ class HLSSegment:
     byte_range: Optional[Tuple[int, int]] = None
     discontinuity: bool = False
 
+@functools.lru_cache(maxsize=1)
+def detect_h264_encoder() -> str:
+    """探测NVENC是否可用，不可用时回退到libx264"""
+    try:
+        subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error",
+             "-f", "lavfi", "-i", "color=s=64x64",
+             "-frames:v", "1", "-c:v", "h264_nvenc", "-f", "null", "-"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=10,
+            check=True
+        )
+        return "h264_nvenc"
+    except (OSError, subprocess.SubprocessError):
+        return "libx264"
+
+def h264_encoder_options(low_latency: bool = False) -> Dict:
+    """生成H.264编码参数，优先使用NVENC"""
+    if detect_h264_encoder() == "h264_nvenc":
+        return {
+            "vcodec": "h264_nvenc",
+            "preset": "p4",
+            "tune": "ull" if low_latency else "ll",
+            "rc": "cbr"
+        }
+    if low_latency:
+        return {"vcodec": "libx264", "preset": "ultrafast", "tune": "zerolatency"}
+    return {"vcodec": "libx264", "preset": "veryfast"}
+
+@functools.lru_cache(maxsize=32)
+def _master_playlist_cached(quality_key: Tuple[Tuple[str, str, str], ...]) -> str:
+    """按(名称, 码率, 分辨率)生成主播放列表，输出只取决于输入，可以缓存"""
+    playlist_lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:6",
+        "#EXT-X-TARGETDURATION:2",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+        "#EXT-X-ALLOW-CACHE:YES",
+        "#EXT-X-START:TIME-OFFSET=0",
+        ""
+    ]
+    
+    for name, bitrate, resolution in quality_key:
+        playlist_lines.extend([
+            f"#EXT-X-STREAM-INF:BANDWIDTH={bitrate},"
+            f"RESOLUTION={resolution},"
+            f"CODECS=\"avc1.640028,mp4a.40.2\"",
+            f"{name}.m3u8"
+        ])
+    
+    return "\n".join(playlist_lines)
+
+# argv模板中的路径占位符，运行时替换为实际输入文件和输出目录
+INPUT_PLACEHOLDER = "__IN__"
+OUTPUT_PLACEHOLDER = "__OUT__"
+
+def _render_args(template: Tuple[str, ...], input_file: str, output_dir: Path) -> List[str]:
+    """将argv模板中的占位符替换为实际路径"""
+    output_dir = str(output_dir)
+    return [
+        input_file if arg == INPUT_PLACEHOLDER else arg.replace(OUTPUT_PLACEHOLDER, output_dir)
+        for arg in template
+    ]
+
+@functools.lru_cache(maxsize=32)
+def _vod_args_template(quality_key: Tuple[Tuple[str, str, str], ...],
+                       segment_duration: float) -> Tuple[str, ...]:
+    """预先生成多码率VOD转码的FFmpeg参数，同一组预设只构建一次图"""
+    # 解码和解复用只做一次，split后分别缩放编码
+    stream = ffmpeg.input(INPUT_PLACEHOLDER)
+    branches = stream.video.filter_multi_output('split', len(quality_key))
+    # 音频以可选流映射(-map 0:a?)，纯视频输入时不会因缺少音频流而失败
+    audio = stream['a?']
+    
+    encoder_options = h264_encoder_options()
+    outputs = []
+    for index, (name, bitrate, resolution) in enumerate(quality_key):
+        output_prefix = Path(OUTPUT_PLACEHOLDER) / name
+        width, height = resolution.split('x')
+        outputs.append(
+            ffmpeg.output(
+                branches[index].filter('scale', width, height),
+                audio,
+                str(output_prefix.with_suffix('.m3u8')),
+                acodec="aac",
+                b=bitrate,
+                **encoder_options,
+                hls_time=segment_duration,
+                hls_playlist_type="vod",
+                hls_flags="independent_segments",
+                hls_segment_type="fmp4",
+                hls_fmp4_init_filename=f"{name}_init.mp4",
+                hls_segment_filename=f"{output_prefix}_%03d{SEGMENT_EXTENSION}"
+            )
+        )
+    
+    return tuple(
+        ffmpeg
+        .merge_outputs(*outputs)
+        .global_args('-filter_complex_threads', str(os.cpu_count() or 1))
+        .overwrite_output()
+        .get_args()
+    )
+
+@functools.lru_cache(maxsize=32)
+def _llhls_args_template(quality_key: Tuple[str, str, str],
+                         segment_duration: float,
+                         part_duration: float,
+                         target_latency: float) -> Tuple[str, ...]:
+    """预先生成LL-HLS转码的FFmpeg参数"""
+    name, bitrate, resolution = quality_key
+    output_prefix = Path(OUTPUT_PLACEHOLDER) / name
+    
+    return tuple(
+        ffmpeg
+        .input(INPUT_PLACEHOLDER)
+        .output(
+            str(output_prefix.with_suffix('.m3u8')),
+            acodec="aac",
+            b=bitrate,
+            s=resolution,
+            **h264_encoder_options(low_latency=True),
+            hls_time=segment_duration,
+            hls_playlist_type="event",
+            hls_flags="independent_segments+program_date_time",
+            hls_segment_type="fmp4",
+            hls_fmp4_init_filename=f"{name}_init.mp4",
+            hls_segment_filename=f"{output_prefix}_%03d{SEGMENT_EXTENSION}",
+            hls_part_size=part_duration,
+            hls_playlist_duration=target_latency
+        )
+        .overwrite_output()
+        .get_args()
+    )
+
 class HLSLowLatencyOptimizer:
     """HLS低延迟优化器"""
     
@@ -70,15 +220,12 @@ class HLSLowLatencyOptimizer:
             output_dir.name
         )
         
-        # 为每个质量级别创建媒体播放列表
-        results = {}
-        for quality in quality_levels:
-            result = self._create_media_playlist(
-                input_file,
-                output_dir,
-                quality
-            )
-            results[quality["name"]] = result
+        # 一次解码生成所有质量级别的媒体播放列表
+        results = self._create_media_playlists(
+            input_file,
+            output_dir,
+            quality_levels
+        )
         
         # 保存主播放列表
         master_path = output_dir / "master.m3u8"
@@ -99,96 +246,66 @@ class HLSLowLatencyOptimizer:
                                quality_levels: List[Dict], 
                                base_name: str) -> str:
         """创建主播放列表"""
-        playlist_lines = [
-            "#EXTM3U",
-            "#EXT-X-VERSION:6",
-            "#EXT-X-TARGETDURATION:2",
-            "#EXT-X-MEDIA-SEQUENCE:0",
-            "#EXT-X-PLAYLIST-TYPE:VOD",
-            "#EXT-X-INDEPENDENT-SEGMENTS",
-            "#EXT-X-ALLOW-CACHE:YES",
-            "#EXT-X-START:TIME-OFFSET=0",
-            ""
-        ]
-        
-        for quality in quality_levels:
-            playlist_lines.extend([
-                f"#EXT-X-STREAM-INF:BANDWIDTH={quality['bitrate']},"
-                f"RESOLUTION={quality['resolution']},"
-                f"CODECS=\"avc1.640028,mp4a.40.2\"",
-                f"{quality['name']}.m3u8"
-            ])
-        
-        return "\n".join(playlist_lines)
+        quality_key = tuple(
+            (quality['name'], quality['bitrate'], quality['resolution'])
+            for quality in quality_levels
+        )
+        return _master_playlist_cached(quality_key)
     
     def _create_media_playlist(self, 
                               input_file: str,
                               output_dir: Path,
                               quality: Dict) -> Dict:
         """创建媒体播放列表"""
-        
-        output_prefix = output_dir / quality["name"]
-        playlist_path = output_prefix.with_suffix('.m3u8')
-        
-        # 使用FFmpeg进行分片和转码
-        command = [
-            'ffmpeg',
-            '-i', input_file,
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            '-b:v', quality['bitrate'],
-            '-s', quality['resolution'],
-            '-preset', 'veryfast',
-            '-hls_time', str(self.segment_duration),
-            '-hls_playlist_type', 'vod',
-            '-hls_flags', 'independent_segments',
-            '-hls_segment_filename', f'{output_prefix}_%03d.ts',
-            str(playlist_path)
-        ]
+        return self._create_media_playlists(
+            input_file, output_dir, [quality]
+        )[quality["name"]]
+    
+    def _create_media_playlists(self, 
+                               input_file: str,
+                               output_dir: Path,
+                               quality_levels: List[Dict]) -> Dict:
+        """单次解码，通过split滤镜为每个质量级别输出媒体播放列表"""
         
         start_time = time.time()
         
+        quality_key = tuple(
+            (quality['name'], quality['bitrate'], quality['resolution'])
+            for quality in quality_levels
+        )
+        
         try:
             # 执行FFmpeg命令
-            (
-                ffmpeg
-                .input(input_file)
-                .output(
-                    str(playlist_path),
-                    vcodec="libx264",
-                    acodec="aac",
-                    b=quality['bitrate'],
-                    s=quality['resolution'],
-                    preset="veryfast",
-                    hls_time=self.segment_duration,
-                    hls_playlist_type="vod",
-                    hls_flags="independent_segments",
-                    hls_segment_filename=f"{output_prefix}_%03d.ts"
-                )
-                .overwrite_output()
-                .run()
+            args = _render_args(
+                _vod_args_template(quality_key, self.segment_duration),
+                input_file,
+                output_dir
             )
+            subprocess.run(["ffmpeg", *args], check=True)
             
-            encoding_time = time.time() - start_time
+        except Exception as e:
+            logging.error(f"HLS优化失败: {e}")
+            return {quality["name"]: {"error": str(e)} for quality in quality_levels}
+        
+        encoding_time = time.time() - start_time
+        
+        results = {}
+        for quality in quality_levels:
+            playlist_path = (output_dir / quality["name"]).with_suffix('.m3u8')
             
             # 优化播放列表
             self._optimize_playlist(str(playlist_path))
             
             # 统计信息
-            segments = self._count_segments(output_dir, quality["name"])
-            
-            return {
+            segments, total_size = self._scan_segments(output_dir, quality["name"])
+            results[quality["name"]] = {
                 "playlist_path": str(playlist_path),
                 "segments_count": segments,
                 "encoding_time": encoding_time,
-                "average_segment_size": self._calculate_average_segment_size(
-                    output_dir, quality["name"]
-                )
+                "average_segment_size": total_size / segments if segments else 0.0
             }
-            
-        except Exception as e:
-            logging.error(f"HLS优化失败: {e}")
-            return {"error": str(e)}
+        
+        return results
     
     def _optimize_playlist(self, playlist_path: str):
         """优化播放列表"""
@@ -206,20 +323,29 @@ class HLSLowLatencyOptimizer:
         except Exception as e:
             logging.error(f"播放列表优化失败: {e}")
     
+    def _scan_segments(self, output_dir: Path, prefix: str) -> Tuple[int, int]:
+        """单次遍历目录，统计分片数量和总大小"""
+        count = 0
+        total_size = 0
+        head = f"{prefix}_"
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith(head) and name.endswith(SEGMENT_EXTENSION):
+                    count += 1
+                    total_size += entry.stat().st_size
+        return count, total_size
+    
     def _count_segments(self, output_dir: Path, prefix: str) -> int:
         """计算分片数量"""
-        return len(list(output_dir.glob(f"{prefix}_*.ts")))
+        return self._scan_segments(output_dir, prefix)[0]
     
     def _calculate_average_segment_size(self, 
                                        output_dir: Path, 
                                        prefix: str) -> float:
         """计算平均分片大小"""
-        segments = list(output_dir.glob(f"{prefix}_*.ts"))
-        if not segments:
-            return 0.0
-        
-        total_size = sum(seg.stat().st_size for seg in segments)
-        return total_size / len(segments)
+        count, total_size = self._scan_segments(output_dir, prefix)
+        return total_size / count if count else 0.0
 
 class LLHLSOptimizer(HLSLowLatencyOptimizer):
     """低延迟HLS优化器 (LL-HLS)"""
@@ -248,49 +374,21 @@ class LLHLSOptimizer(HLSLowLatencyOptimizer):
         output_prefix = output_dir / quality["name"]
         playlist_path = output_prefix.with_suffix('.m3u8')
         
-        # 使用FFmpeg创建LL-HLS
-        command = [
-            'ffmpeg',
-            '-i', input_file,
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            '-b:v', quality['bitrate'],
-            '-s', quality['resolution'],
-            '-preset', 'ultrafast',
-            '-tune', 'zerolatency',
-            '-hls_time', str(self.segment_duration),
-            '-hls_playlist_type', 'event',
-            '-hls_flags', 'independent_segments+program_date_time',
-            '-hls_segment_type', 'mpegts',
-            '-hls_part_size', str(self.part_duration),
-            '-hls_playlist_duration', str(self.target_latency),
-            f'{output_prefix}_%03d.ts'
-        ]
-        
         try:
             start_time = time.time()
             
-            (
-                ffmpeg
-                .input(input_file)
-                .output(
-                    str(playlist_path),
-                    vcodec="libx264",
-                    acodec="aac",
-                    b=quality['bitrate'],
-                    s=quality['resolution'],
-                    preset="ultrafast",
-                    tune="zerolatency",
-                    hls_time=self.segment_duration,
-                    hls_playlist_type="event",
-                    hls_flags="independent_segments+program_date_time",
-                    hls_segment_type="mpegts",
-                    hls_part_size=self.part_duration,
-                    hls_playlist_duration=self.target_latency
-                )
-                .overwrite_output()
-                .run()
+            # 使用FFmpeg创建LL-HLS
+            args = _render_args(
+                _llhls_args_template(
+                    (quality['name'], quality['bitrate'], quality['resolution']),
+                    self.segment_duration,
+                    self.part_duration,
+                    self.target_latency
+                ),
+                input_file,
+                output_dir
             )
+            subprocess.run(["ffmpeg", *args], check=True)
             
             encoding_time = time.time() - start_time
             
@@ -326,6 +424,39 @@ class LLHLSOptimizer(HLSLowLatencyOptimizer):
         except Exception as e:
             logging.error(f"添加LL-HLS标签失败: {e}")
 
+@njit(cache=True)
+def _hls_stats(durations: np.ndarray, sizes: np.ndarray):
+    """单次遍历计算分片时长均值/方差和平均码率，sizes<0表示分片缺失"""
+    n = durations.shape[0]
+    total_duration = 0.0
+    total_size = 0.0
+    present = 0
+    bitrate_sum = 0.0
+    bitrate_count = 0
+    
+    for i in range(n):
+        duration = durations[i]
+        total_duration += duration
+        if sizes[i] >= 0:
+            total_size += sizes[i]
+            present += 1
+            if duration > 0:
+                bitrate_sum += sizes[i] * 8 / duration
+                bitrate_count += 1
+    
+    if n == 0:
+        return 0.0, 0.0, 0, 0.0, 0.0, 0.0
+    
+    mean_duration = total_duration / n
+    var_duration = 0.0
+    for i in range(n):
+        diff = durations[i] - mean_duration
+        var_duration += diff * diff
+    var_duration /= n
+    
+    mean_bitrate = bitrate_sum / bitrate_count if bitrate_count > 0 else 0.0
+    return total_duration, total_size, present, mean_duration, var_duration, mean_bitrate
+
 class HLSAnalyzer:
     """HLS分析器"""
     
@@ -343,35 +474,36 @@ class HLSAnalyzer:
             playlist = m3u8.load(playlist_path)
             
             segments = playlist.segments
-            total_duration = sum(segment.duration for segment in segments)
             
-            # 计算统计信息
-            durations = [segment.duration for segment in segments]
-            bitrates = []
-            
-            # 分析分片文件
+            # 分析分片文件，一次scandir拿到目录内所有文件大小
             playlist_dir = Path(playlist_path).parent
-            segment_sizes = []
+            with os.scandir(playlist_dir) as entries:
+                dir_sizes = {entry.name: entry.stat().st_size for entry in entries if entry.is_file()}
             
-            for segment in segments:
-                segment_path = playlist_dir / segment.uri
-                if segment_path.exists():
-                    size = segment_path.stat().st_size
-                    segment_sizes.append(size)
-                    
-                    # 计算码率
-                    if segment.duration > 0:
-                        bitrate = (size * 8) / segment.duration
-                        bitrates.append(bitrate)
+            # 时长和大小按列存放，缺失的分片大小记为-1
+            durations = np.empty(len(segments), dtype=np.float64)
+            sizes = np.empty(len(segments), dtype=np.float64)
+            for index, segment in enumerate(segments):
+                durations[index] = segment.duration
+                size = dir_sizes.get(segment.uri)
+                if size is None:
+                    segment_path = playlist_dir / segment.uri
+                    size = segment_path.stat().st_size if segment_path.exists() else -1
+                sizes[index] = size
+            
+            (total_duration, total_size, present,
+             mean_duration, var_duration, mean_bitrate) = _hls_stats(durations, sizes)
             
             analysis = {
                 "total_segments": len(segments),
                 "total_duration": total_duration,
-                "average_segment_duration": np.mean(durations) if durations else 0,
-                "segment_duration_variance": np.var(durations) if durations else 0,
-                "average_bitrate": np.mean(bitrates) / 1000 if bitrates else 0,  # kbps
-                "total_size_mb": sum(segment_sizes) / (1024 * 1024),
-                "efficiency_score": self._calculate_efficiency(segments, segment_sizes)
+                "average_segment_duration": mean_duration,
+                "segment_duration_variance": var_duration,
+                "average_bitrate": mean_bitrate / 1000,  # kbps
+                "total_size_mb": total_size / (1024 * 1024),
+                "efficiency_score": self._calculate_efficiency(
+                    total_duration, total_size, present
+                )
             }
             
             return analysis
@@ -380,16 +512,90 @@ class HLSAnalyzer:
             logging.error(f"HLS分析失败: {e}")
             return {"error": str(e)}
     
-    def _calculate_efficiency(self, segments: List, segment_sizes: List) -> float:
-        """计算HLS效率分数"""
-        if not segments or not segment_sizes:
-            return 0.0
+    def analyze_playlists(self, playlist_paths: List[str]) -> Dict[str, Dict]:
+        """并发分析多个质量级别的播放列表"""
+        if not playlist_paths:
+            return {}
         
-        # 基于分片大小和时长的效率计算
-        total_duration = sum(segment.duration for segment in segments)
-        total_size = sum(segment_sizes)
+        with ThreadPoolExecutor(max_workers=len(playlist_paths)) as executor:
+            results = list(executor.map(self.analyze_playlist, playlist_paths))
         
-        if total_duration == 0:
+        return dict(zip(playlist_paths, results))
+    
+    def analyze_inline(self, input_file: str, chunk_packets: int = 1024) -> Dict:
+        """直接解析FFmpeg输出的TS流，不落盘分析码率和时长"""
+        try:
+            process = (
+                ffmpeg
+                .input(input_file)
+                .output('pipe:', format='mpegts', c='copy')
+                .run_async(pipe_stdout=True)
+            )
+            
+            total_bytes = 0
+            pes_packets = 0
+            first_pts = None
+            last_pts = None
+            pending = b""
+            
+            while True:
+                chunk = process.stdout.read(TS_PACKET_SIZE * chunk_packets)
+                if not chunk:
+                    break
+                total_bytes += len(chunk)
+                
+                data = pending + chunk
+                usable = len(data) - len(data) % TS_PACKET_SIZE
+                view = memoryview(data)
+                
+                for offset in range(0, usable, TS_PACKET_SIZE):
+                    packet = view[offset:offset + TS_PACKET_SIZE]
+                    # 只关心带payload_unit_start的包，即PES起始
+                    if packet[0] != 0x47 or not packet[1] & 0x40:
+                        continue
+                    adaptation = (packet[3] >> 4) & 0x3
+                    if not adaptation & 0x1:
+                        continue
+                    pos = 4
+                    if adaptation & 0x2:
+                        pos += 1 + packet[4]
+                    if pos + 14 > TS_PACKET_SIZE or packet[pos:pos + 3] != b"\x00\x00\x01":
+                        continue
+                    # 只统计视频PES
+                    if not 0xE0 <= packet[pos + 3] <= 0xEF:
+                        continue
+                    pes_packets += 1
+                    
+                    if packet[pos + 7] & 0x80:
+                        p = packet[pos + 9:pos + 14]
+                        pts = (((p[0] >> 1) & 0x07) << 30) | (p[1] << 22) | \
+                              ((p[2] >> 1) << 15) | (p[3] << 7) | (p[4] >> 1)
+                        first_pts = pts if first_pts is None else min(first_pts, pts)
+                        last_pts = pts if last_pts is None else max(last_pts, pts)
+                
+                pending = bytes(view[usable:])
+            
+            process.wait()
+            
+            total_duration = (last_pts - first_pts) / TS_CLOCK_RATE if first_pts is not None else 0
+            
+            return {
+                "total_duration": total_duration,
+                "video_pes_packets": pes_packets,
+                "average_bitrate": (total_bytes * 8) / total_duration / 1000 if total_duration > 0 else 0,  # kbps
+                "total_size_mb": total_bytes / (1024 * 1024)
+            }
+            
+        except Exception as e:
+            logging.error(f"HLS流分析失败: {e}")
+            return {"error": str(e)}
+    
+    def _calculate_efficiency(self, 
+                              total_duration: float, 
+                              total_size: float, 
+                              present_segments: int) -> float:
+        """计算HLS效率分数"""
+        if present_segments == 0 or total_duration == 0:
             return 0.0
         
         # 计算效率分数 (0-100)
@@ -6,12 +6,17 @@ RTMP协议优化器
 
 import asyncio
 import logging
+import os
 import time
+import json
 from typing import Dict, Optional, Tuple
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+from enum import IntEnum
 import numpy as np
+from numba import njit
 from collections import deque
 import threading
+from concurrent.futures import ProcessPoolExecutor
 
 @dataclass
 class RTMPStats:
@@ -25,121 +30,207 @@ class RTMPStats:
     packet_loss_rate: float = 0.0
     buffer_level: int = 0
     
+class NetworkState(IntEnum):
+    """网络状态，JIT内核直接返回整数值"""
+    STABLE = 0
+    CONGESTED = 1
+    UNSTABLE = 2
+    DEGRADED = 3
+
+class BufferState(IntEnum):
+    """缓冲区状态"""
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+class CongestionState(IntEnum):
+    """拥塞控制状态"""
+    SLOW_START = 0
+    CONGESTION_AVOIDANCE = 1
+    FAST_RECOVERY = 2
+
+# 按值索引的成员表，热路径上用元组索引代替枚举构造
+_NETWORK_STATES = tuple(NetworkState)
+
+STATE_STABLE = int(NetworkState.STABLE)
+STATE_CONGESTED = int(NetworkState.CONGESTED)
+STATE_UNSTABLE = int(NetworkState.UNSTABLE)
+STATE_DEGRADED = int(NetworkState.DEGRADED)
+
+@dataclass(slots=True)
+class OptimizationLog:
+    """单次优化的日志记录，状态以整数存储，生成报告时再格式化"""
+    timestamp: float
+    optimal_bitrate: int
+    congestion_window: int
+    buffer_size: float
+    buffer_utilization: float
+    buffer_state: int
+    network_state: int
+    congestion_state: int
+    
+    def to_dict(self) -> Dict:
+        """转换为可序列化的字典"""
+        record = asdict(self)
+        record["buffer_state"] = BufferState(self.buffer_state).name.lower()
+        record["network_state"] = NetworkState(self.network_state).name.lower()
+        record["congestion_state"] = CongestionState(self.congestion_state).name.lower()
+        return record
+
+# 以(丢包<<2)|(抖动<<1)|吞吐下降为索引的状态表，优先级 拥塞>抖动>下降>稳定
+_STATE_TABLE = np.array([
+    STATE_STABLE, STATE_DEGRADED, STATE_UNSTABLE, STATE_UNSTABLE,
+    STATE_CONGESTED, STATE_CONGESTED, STATE_CONGESTED, STATE_CONGESTED
+], dtype=np.int64)
+
+# 各状态下的降码率系数
+_REDUCTION_FACTORS = np.array([1.0, 0.5, 0.8, 0.7], dtype=np.float64)
+
+# 增量和在sums数组中的位置
+_LOSS_SUM10, _RTT_SUM10, _RTT_SQSUM10, _THR_SUM5, _THR_SUM10, _THR_SUM_PREV10 = range(6)
+
+@njit(cache=True, fastmath=True)
+def _update_bitrate(loss, rtt, throughput, sums, head, count,
+                    new_loss, new_rtt, new_throughput,
+                    state, current_bitrate, target_bitrate,
+                    min_bitrate, max_bitrate, gamma_q):
+    """写入一个样本并完成拥塞检测和码率调整
+    
+    返回 (head, count, state, current_bitrate, target_bitrate)
+    """
+    size = loss.shape[0]
+    
+    # 写入前扣除即将滑出各窗口的样本
+    if count >= 5:
+        sums[_THR_SUM5] -= throughput[(head - 5) % size]
+    if count >= 10:
+        old = (head - 10) % size
+        sums[_LOSS_SUM10] -= loss[old]
+        sums[_RTT_SUM10] -= rtt[old]
+        sums[_RTT_SQSUM10] -= rtt[old] * rtt[old]
+        sums[_THR_SUM10] -= throughput[old]
+        sums[_THR_SUM_PREV10] += throughput[old]
+    if count >= 20:
+        sums[_THR_SUM_PREV10] -= throughput[(head - 20) % size]
+    
+    loss[head] = new_loss
+    rtt[head] = new_rtt
+    throughput[head] = new_throughput
+    sums[_LOSS_SUM10] += new_loss
+    sums[_RTT_SUM10] += new_rtt
+    sums[_RTT_SQSUM10] += new_rtt * new_rtt
+    sums[_THR_SUM5] += new_throughput
+    sums[_THR_SUM10] += new_throughput
+    
+    head = (head + 1) % size
+    count = min(count + 1, size)
+    
+    # 检测网络拥塞：三个条件同时求值后查表，避免不可预测的分支
+    if count >= 10:
+        rtt_mean = sums[_RTT_SUM10] / 10
+        rtt_variance = max(sums[_RTT_SQSUM10] / 10 - rtt_mean * rtt_mean, 0.0)
+        
+        high_loss = int(sums[_LOSS_SUM10] / 10 > 0.05)  # 5%丢包率
+        high_jitter = int(rtt_variance > 100)  # 100ms抖动
+        degraded = int(count >= 20) & int(sums[_THR_SUM10] < sums[_THR_SUM_PREV10] * 0.8)
+        state = _STATE_TABLE[(high_loss << 2) | (high_jitter << 1) | degraded]
+    
+    # 调整码率
+    if state != STATE_STABLE:
+        # 拥塞时降低码率
+        target_bitrate = max(min_bitrate, int(current_bitrate * _REDUCTION_FACTORS[state]))
+    elif sums[_THR_SUM5] / min(count, 5) > current_bitrate * 1.2:
+        # 网络良好时尝试提升码率
+        target_bitrate = min(max_bitrate, int(current_bitrate * 1.1))
+    
+    # 平滑过渡：Q16定点EWMA，纯整数运算，长时间运行无浮点舍入漂移
+    current_bitrate = (gamma_q * current_bitrate + (65536 - gamma_q) * target_bitrate) >> 16
+    
+    return head, count, state, current_bitrate, target_bitrate
+
 class RTMPAdaptiveBitrate:
     """RTMP自适应码率控制器"""
     
+    # 环形缓冲区容量，需不小于吞吐量对比所需的20个样本
+    WINDOW_SIZE = 100
+    
     def __init__(self, initial_bitrate: int = 3000000):
         self.current_bitrate = initial_bitrate
         self.target_bitrate = initial_bitrate
         self.min_bitrate = 500000
         self.max_bitrate = 8000000
         
-        # 滑动窗口统计
-        self.stats_window = deque(maxlen=100)
-        self.throughput_history = deque(maxlen=50)
+        # 滑动窗口统计：按字段分列存储(SoA)的环形缓冲区，
+        # 不再保存RTMPStats对象，避免逐个对象取属性
+        self._loss = np.zeros(self.WINDOW_SIZE, dtype=np.float64)
+        self._rtt = np.zeros(self.WINDOW_SIZE, dtype=np.float64)
+        self._throughput = np.zeros(self.WINDOW_SIZE, dtype=np.float64)
+        self._bytes_sent = np.zeros(self.WINDOW_SIZE, dtype=np.float64)
+        self._buffer_level = np.zeros(self.WINDOW_SIZE, dtype=np.float64)
+        self._head = 0
+        self._count = 0
+        
+        # 最近5/10/20个样本的增量和，每次更新O(1)
+        self._sums = np.zeros(6, dtype=np.float64)
         
         # 控制参数
         self.alpha = 0.1  # 平滑因子
         self.beta = 0.2   # 调整幅度
         self.gamma = 0.8  # 保守因子
+        self.gamma_q = int(self.gamma * 65536)  # Q16定点形式
         
         # 网络状态
-        self.network_state = "stable"
+        self.network_state = STATE_STABLE
         self.congestion_detected = False
         
+        # 只保护写入路径；current_bitrate和network_state都是单个int，
+        # 在GIL下读取一次属性即为原子操作，读取方无需加锁
         self.lock = threading.Lock()
     
     def update_network_stats(self, stats: RTMPStats):
         """更新网络统计信息"""
-        with self.lock:
-            self.stats_window.append(stats)
-            self.throughput_history.append(stats.throughput_bps)
-            
-            # 检测网络拥塞
-            self._detect_congestion()
-            
-            # 调整码率
-            self._adjust_bitrate()
-    
-    def _detect_congestion(self):
-        """检测网络拥塞"""
-        if len(self.stats_window) < 10:
-            return
-            
-        # 计算最近10个样本的统计信息
-        recent_stats = list(self.stats_window)[-10:]
-        
-        # 丢包率检测
-        avg_loss = np.mean([s.packet_loss_rate for s in recent_stats])
-        if avg_loss > 0.05:  # 5%丢包率
-            self.congestion_detected = True
-            self.network_state = "congested"
-            return
-        
-        # RTT抖动检测
-        rtt_values = [s.rtt_ms for s in recent_stats]
-        rtt_variance = np.var(rtt_values)
-        if rtt_variance > 100:  # 100ms抖动
-            self.congestion_detected = True
-            self.network_state = "unstable"
-            return
-        
-        # 吞吐量下降检测
-        if len(self.throughput_history) >= 20:
-            recent_throughput = np.mean(list(self.throughput_history)[-10:])
-            historical_throughput = np.mean(list(self.throughput_history)[-20:-10])
-            
-            if recent_throughput < historical_throughput * 0.8:
-                self.congestion_detected = True
-                self.network_state = "degraded"
-                return
-        
-        self.congestion_detected = False
-        self.network_state = "stable"
-    
-    def _adjust_bitrate(self):
-        """调整码率"""
-        if not self.throughput_history:
-            return
-            
-        # 计算平滑吞吐量
-        smoothed_throughput = np.mean(list(self.throughput_history)[-5:])
+        # 在加锁前把dataclass字段取成局部变量，缩短临界区
+        loss = float(stats.packet_loss_rate)
+        rtt = float(stats.rtt_ms)
+        throughput = float(stats.throughput_bps)
+        bytes_sent = stats.bytes_sent
+        buffer_level = stats.buffer_level
         
-        if self.congestion_detected:
-            # 拥塞时降低码率
-            reduction_factor = 0.7
-            if self.network_state == "congested":
-                reduction_factor = 0.5
-            elif self.network_state == "unstable":
-                reduction_factor = 0.8
+        with self.lock:
+            head = self._head
+            self._bytes_sent[head] = bytes_sent
+            self._buffer_level[head] = buffer_level
             
-            self.target_bitrate = max(
-                self.min_bitrate,
-                int(self.current_bitrate * reduction_factor)
+            # 拥塞检测和码率调整在同一个JIT内核中完成
+            (self._head, self._count, self.network_state,
+             self.current_bitrate, self.target_bitrate) = _update_bitrate(
+                self._loss, self._rtt, self._throughput, self._sums,
+                head, self._count,
+                loss, rtt, throughput,
+                self.network_state, self.current_bitrate, self.target_bitrate,
+                self.min_bitrate, self.max_bitrate, self.gamma_q
             )
-        else:
-            # 网络良好时尝试提升码率
-            if smoothed_throughput > self.current_bitrate * 1.2:
-                increase_factor = 1.1
-                self.target_bitrate = min(
-                    self.max_bitrate,
-                    int(self.current_bitrate * increase_factor)
-                )
-        
-        # 平滑过渡
-        self.current_bitrate = int(
-            self.gamma * self.current_bitrate + (1 - self.gamma) * self.target_bitrate
-        )
+            self.congestion_detected = self.network_state != STATE_STABLE
+    
+    def get_window(self) -> Dict[str, np.ndarray]:
+        """按时间顺序返回窗口内各字段的列数据"""
+        with self.lock:
+            order = (np.arange(self._count) + self._head - self._count) % self.WINDOW_SIZE
+            return {
+                "packet_loss_rate": self._loss[order],
+                "rtt_ms": self._rtt[order],
+                "throughput_bps": self._throughput[order],
+                "bytes_sent": self._bytes_sent[order],
+                "buffer_level": self._buffer_level[order]
+            }
     
     def get_optimal_bitrate(self) -> int:
         """获取最优码率"""
-        with self.lock:
-            return self.current_bitrate
+        return self.current_bitrate
     
-    def get_network_state(self) -> str:
+    def get_network_state(self) -> NetworkState:
         """获取网络状态"""
-        with self.lock:
-            return self.network_state
+        return _NETWORK_STATES[self.network_state]
 
 class RTMPBufferManager:
     """RTMP缓冲区管理器"""
@@ -151,25 +242,41 @@ class RTMPBufferManager:
         self.buffer_threshold_high = int(max_buffer_size * 0.8)
         
         # 缓冲区状态
-        self.buffer_state = "normal"
+        self.buffer_state = BufferState.NORMAL
         self.drop_count = 0
         
-        # 统计信息
-        self.buffer_utilization = []
-        self.dropped_packets = []
+        # 统计信息：只保留最近10个水位和运行和，内存O(1)
+        self.buffer_utilization = np.zeros(10, dtype=np.float64)
+        self._util_head = 0
+        self._util_count = 0
+        self._util_sum = 0.0
+        self.dropped_packets = deque(maxlen=256)
+        
+        # 统计结果字典只分配一次，每次查询原地更新
+        self._stats = {
+            "current_size": 0,
+            "max_size": max_buffer_size,
+            "state": "normal",
+            "utilization": 0,
+            "drop_count": 0
+        }
     
     def update_buffer_level(self, level: int):
         """更新缓冲区水位"""
         self.current_buffer_size = level
-        self.buffer_utilization.append(level)
+        head = self._util_head
+        self._util_sum += level - self.buffer_utilization[head]
+        self.buffer_utilization[head] = level
+        self._util_head = (head + 1) % 10
+        self._util_count = min(self._util_count + 1, 10)
         
         # 缓冲区状态管理
         if level <= self.buffer_threshold_low:
-            self.buffer_state = "low"
+            self.buffer_state = BufferState.LOW
         elif level >= self.buffer_threshold_high:
-            self.buffer_state = "high"
+            self.buffer_state = BufferState.HIGH
         else:
-            self.buffer_state = "normal"
+            self.buffer_state = BufferState.NORMAL
     
     def should_drop_packets(self) -> bool:
         """判断是否应该丢包"""
@@ -179,15 +286,22 @@ class RTMPBufferManager:
             return True
         return False
     
+    def get_utilization(self) -> float:
+        """最近10个水位的均值"""
+        return self._util_sum / self._util_count if self._util_count else 0
+    
     def get_buffer_stats(self) -> Dict:
-        """获取缓冲区统计"""
-        return {
-            "current_size": self.current_buffer_size,
-            "max_size": self.max_buffer_size,
-            "state": self.buffer_state,
-            "utilization": np.mean(self.buffer_utilization[-10:]) if self.buffer_utilization else 0,
-            "drop_count": self.drop_count
-        }
+        """获取缓冲区统计（返回同一个原地更新的字典，需要快照时请自行复制）"""
+        stats = self._stats
+        stats["current_size"] = self.current_buffer_size
+        stats["state"] = self.buffer_state.name.lower()
+        stats["utilization"] = self.get_utilization()
+        stats["drop_count"] = self.drop_count
+        return stats
+
+# 拥塞避免阶段每个ACK的窗口增量1/cwnd，按整数窗口预先查表，所有控制器共享
+_RECIPROCAL_TABLE_SIZE = 65536
+_RECIPROCAL_TABLE = (1.0 / np.arange(1, _RECIPROCAL_TABLE_SIZE + 1, dtype=np.float64)).tolist()
 
 class RTMPCongestionController:
     """RTMP拥塞控制器"""
@@ -196,7 +310,7 @@ class RTMPCongestionController:
         self.congestion_window = 1000  # 初始拥塞窗口
         self.slow_start_threshold = 10000
         self.duplicate_acks = 0
-        self.state = "slow_start"  # slow_start, congestion_avoidance, fast_recovery
+        self.state = CongestionState.SLOW_START
         
         # 统计信息
         self.rtt_samples = deque(maxlen=100)
@@ -208,31 +322,35 @@ class RTMPCongestionController:
             # 超时丢包
             self.slow_start_threshold = max(self.congestion_window // 2, 2)
             self.congestion_window = 1
-            self.state = "slow_start"
+            self.state = CongestionState.SLOW_START
             self.retransmissions += 1
         else:
             # 快速重传
             self.slow_start_threshold = max(self.congestion_window // 2, 2)
             self.congestion_window = self.slow_start_threshold + 3
-            self.state = "fast_recovery"
+            self.state = CongestionState.FAST_RECOVERY
     
     def on_ack_received(self, bytes_acked: int):
         """处理ACK接收"""
-        if self.state == "slow_start":
+        if self.state == CongestionState.SLOW_START:
             self.congestion_window += 1
             if self.congestion_window >= self.slow_start_threshold:
-                self.state = "congestion_avoidance"
-        elif self.state == "congestion_avoidance":
-            self.congestion_window += 1 / self.congestion_window
-        elif self.state == "fast_recovery":
+                self.state = CongestionState.CONGESTION_AVOIDANCE
+        elif self.state == CongestionState.CONGESTION_AVOIDANCE:
+            cwnd = self.congestion_window
+            if cwnd < _RECIPROCAL_TABLE_SIZE:
+                self.congestion_window = cwnd + _RECIPROCAL_TABLE[int(cwnd) - 1]
+            else:
+                self.congestion_window = cwnd + 1 / cwnd
+        elif self.state == CongestionState.FAST_RECOVERY:
             self.congestion_window = self.slow_start_threshold
-            self.state = "congestion_avoidance"
+            self.state = CongestionState.CONGESTION_AVOIDANCE
     
     def get_congestion_window(self) -> int:
         """获取当前拥塞窗口"""
         return int(self.congestion_window)
     
-    def get_state(self) -> str:
+    def get_state(self) -> CongestionState:
         """获取控制器状态"""
         return self.state
 
@@ -247,32 +365,33 @@ class RTMPOptimizer:
         # 统计信息
         self.start_time = time.time()
         self.total_bytes_sent = 0
-        self.optimization_logs = []
+        # 只保留最近的日志，总数单独计数
+        self.optimization_logs = deque(maxlen=256)
+        self.log_count = 0
     
-    def optimize(self, stats: RTMPStats) -> Dict:
+    def optimize(self, stats: RTMPStats) -> OptimizationLog:
         """执行RTMP优化"""
         # 更新自适应码率
         self.adaptive_bitrate.update_network_stats(stats)
         
         # 更新缓冲区管理
-        self.buffer_manager.update_buffer_level(stats.buffer_level)
-        
-        # 获取优化建议
-        optimal_bitrate = self.adaptive_bitrate.get_optimal_bitrate()
-        congestion_window = self.congestion_controller.get_congestion_window()
-        buffer_stats = self.buffer_manager.get_buffer_stats()
+        buffer_manager = self.buffer_manager
+        buffer_manager.update_buffer_level(stats.buffer_level)
         
-        # 生成优化日志
-        optimization_log = {
-            "timestamp": time.time(),
-            "optimal_bitrate": optimal_bitrate,
-            "congestion_window": congestion_window,
-            "buffer_stats": buffer_stats,
-            "network_state": self.adaptive_bitrate.get_network_state(),
-            "congestion_state": self.congestion_controller.get_state()
-        }
+        # 生成优化日志，热路径上不构造字典
+        optimization_log = OptimizationLog(
+            timestamp=time.time(),
+            optimal_bitrate=self.adaptive_bitrate.get_optimal_bitrate(),
+            congestion_window=self.congestion_controller.get_congestion_window(),
+            buffer_size=buffer_manager.current_buffer_size,
+            buffer_utilization=buffer_manager.get_utilization(),
+            buffer_state=buffer_manager.buffer_state,
+            network_state=self.adaptive_bitrate.network_state,
+            congestion_state=self.congestion_controller.state
+        )
         
         self.optimization_logs.append(optimization_log)
+        self.log_count += 1
         
         return optimization_log
     
@@ -284,39 +403,74 @@ class RTMPOptimizer:
             "runtime_seconds": runtime,
             "total_bytes_sent": self.total_bytes_sent,
             "final_bitrate": self.adaptive_bitrate.get_optimal_bitrate(),
-            "network_state": self.adaptive_bitrate.get_network_state(),
-            "buffer_stats": self.buffer_manager.get_buffer_stats(),
-            "optimization_logs_count": len(self.optimization_logs),
-            "recent_logs": self.optimization_logs[-10:] if self.optimization_logs else []
+            "network_state": self.adaptive_bitrate.get_network_state().name.lower(),
+            "buffer_stats": dict(self.buffer_manager.get_buffer_stats()),
+            "optimization_logs_count": self.log_count,
+            "recent_logs": [log.to_dict() for log in list(self.optimization_logs)[-10:]]
         }
 
 # 使用示例
-if __name__ == "__main__":
-    # 创建RTMP优化器
-    optimizer = RTMPOptimizer(initial_bitrate=3000000)
+def _simulated_stats(steps: int = 50, phase: float = 0.0):
+    """模拟网络变化：一次性生成整段序列，循环内只做索引"""
+    t = np.arange(steps) + phase
+    sin_01 = np.sin(t * 0.1)
+    rtt_series = 50 + 10 * sin_01
+    throughput_series = 2500000 + 500000 * np.sin(t * 0.2)
+    loss_series = np.maximum(0, 0.01 * np.sin(t * 0.3))
+    buffer_series = 100 + 50 * sin_01
     
-    # 模拟网络状态更新
-    for i in range(50):
-        # 模拟网络变化
-        stats = RTMPStats(
+    for i in range(steps):
+        yield RTMPStats(
             bytes_sent=1000000 + i * 10000,
             bytes_received=500000 + i * 5000,
             packets_sent=1000 + i,
             packets_received=950 + i,
-            rtt_ms=50 + 10 * np.sin(i * 0.1),
-            throughput_bps=2500000 + 500000 * np.sin(i * 0.2),
-            packet_loss_rate=max(0, 0.01 * np.sin(i * 0.3)),
-            buffer_level=100 + 50 * np.sin(i * 0.1)
+            rtt_ms=rtt_series[i],
+            throughput_bps=throughput_series[i],
+            packet_loss_rate=loss_series[i],
+            buffer_level=buffer_series[i]
         )
-        
+
+def run_one_session(session_id: int, steps: int = 50) -> Tuple[int, float, Dict]:
+    """模拟一个独立会话，返回(进程号, 耗时, 最终报告)"""
+    start = time.perf_counter()
+    optimizer = RTMPOptimizer(initial_bitrate=3000000)
+    for stats in _simulated_stats(steps, phase=session_id * 0.37):
+        optimizer.optimize(stats)
+    report = optimizer.get_optimization_report()
+    return os.getpid(), time.perf_counter() - start, report
+
+if __name__ == "__main__":
+    # 创建RTMP优化器
+    optimizer = RTMPOptimizer(initial_bitrate=3000000)
+    
+    # 模拟网络状态更新
+    for i, stats in enumerate(_simulated_stats(50)):
         # 执行优化
         result = optimizer.optimize(stats)
         
         if i % 10 == 0:
-            print(f"Step {i}: Bitrate={result['optimal_bitrate']}, "
-                  f"State={result['network_state']}")
+            print(f"Step {i}: Bitrate={result.optimal_bitrate}, "
+                  f"State={NetworkState(result.network_state).name.lower()}")
     
     # 获取优化报告
     report = optimizer.get_optimization_report()
     print("\nOptimization Report:")
-    print(json.dumps(report, indent=2))
\ No newline at end of file
+    print(json.dumps(report, indent=2))
+    
+    # 多进程并发模拟大量会话，按进程汇总耗时并计算变异系数(CV)
+    num_sessions = 1000
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = list(executor.map(run_one_session, range(num_sessions), chunksize=16))
+    
+    worker_times = {}
+    for pid, elapsed, _ in results:
+        worker_times[pid] = worker_times.get(pid, 0.0) + elapsed
+    times = np.array(list(worker_times.values()))
+    cv = times.std() / times.mean() if times.mean() > 0 else 0.0
+    
+    print(f"\nSessions: {num_sessions}, Workers: {len(worker_times)}, "
+          f"Mean session time: {np.mean([r[1] for r in results]) * 1000:.3f}ms, "
+          f"Worker time CV: {cv:.3f}")
+    if cv > 0.2:
+        print("Warning: worker时间分布不均(CV>0.2)，存在争用或负载倾斜")
@@ -5,12 +5,98 @@ Android FFmpeg集成实现
 """
 
 import os
+import sys
+import copy
+import functools
 import subprocess
 import platform
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 import json
 import logging
+from collections import deque
+
+def run_streaming(cmd: List[str], cwd=None, tail_lines: int = 50,
+                  close_fds: bool = True) -> Tuple[int, str]:
+    """逐行转发子进程输出到日志，仅保留末尾若干行用于错误报告
+    
+    close_fds=False且不指定cwd时，CPython会改用posix_spawn启动子进程，
+    省去大内存父进程fork的页表复制开销
+    """
+    tail = deque(maxlen=tail_lines)
+    proc = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        close_fds=close_fds,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1
+    )
+    with proc.stdout:
+        for line in proc.stdout:
+            line = line.rstrip()
+            logging.info(line)
+            tail.append(line)
+    return proc.wait(), "\n".join(tail)
+
+def _detect_hw_codec_api() -> Optional[str]:
+    """本机可用的硬件编解码接口：Apple平台为VideoToolbox，Android为MediaCodec，
+    其余主机(如Linux构建机)没有可用接口，返回None"""
+    if platform.system() == "Darwin":
+        return "videotoolbox"
+    if hasattr(sys, "getandroidapilevel") or "ANDROID_ROOT" in os.environ:
+        return "mediacodec"
+    return None
+
+HW_CODEC_API = _detect_hw_codec_api()
+
+# 逻辑编码格式 -> FFmpeg硬件编码器名
+HW_ENCODERS = {
+    "mediacodec": {
+        "h264": "h264_mediacodec",
+        "h265": "hevc_mediacodec",
+        "vp8": "vp8_mediacodec",
+        "vp9": "vp9_mediacodec"
+    },
+    "videotoolbox": {
+        "h264": "h264_videotoolbox",
+        "h265": "hevc_videotoolbox"
+    }
+}
+
+# NDK工具链（静态配置）
+_TOOLCHAINS = {
+    "arm64-v8a": {
+        "arch": "aarch64",
+        "cpu": "armv8-a",
+        "cross_prefix": "aarch64-linux-android",
+        "toolchain": "aarch64-linux-android",
+        "extra_cflags": "-march=armv8-a -mtune=cortex-a53"
+    },
+    "armeabi-v7a": {
+        "arch": "arm",
+        "cpu": "armv7-a",
+        "cross_prefix": "armv7a-linux-androideabi",
+        "toolchain": "arm-linux-androideabi",
+        "extra_cflags": "-march=armv7-a -mtune=cortex-a8 -mfloat-abi=softfp -mfpu=neon"
+    },
+    "x86_64": {
+        "arch": "x86_64",
+        "cpu": "x86_64",
+        "cross_prefix": "x86_64-linux-android",
+        "toolchain": "x86_64-linux-android",
+        "extra_cflags": "-march=x86-64 -msse4.2 -mpopcnt"
+    },
+    "x86": {
+        "arch": "x86",
+        "cpu": "i686",
+        "cross_prefix": "i686-linux-android",
+        "toolchain": "i686-linux-android",
+        "extra_cflags": "-march=i686 -mtune=intel -mssse3 -mfpmath=sse"
+    }
+}
 
 class AndroidFFmpegBuilder:
     """Android FFmpeg构建器"""
@@ -19,54 +105,28 @@ class AndroidFFmpegBuilder:
         self.ndk_path = Path(ndk_path)
         self.ffmpeg_source = Path(ffmpeg_source)
         self.build_dir = Path("build")
-        self.toolchains = self._detect_toolchains()
-        
-    def _detect_toolchains(self) -> Dict:
-        """检测NDK工具链"""
-        toolchains = {
-            "arm64-v8a": {
-                "arch": "aarch64",
-                "cpu": "armv8-a",
-                "cross_prefix": "aarch64-linux-android",
-                "toolchain": "aarch64-linux-android",
-                "extra_cflags": "-march=armv8-a -mtune=cortex-a53"
-            },
-            "armeabi-v7a": {
-                "arch": "arm",
-                "cpu": "armv7-a",
-                "cross_prefix": "armv7a-linux-androideabi",
-                "toolchain": "arm-linux-androideabi",
-                "extra_cflags": "-march=armv7-a -mtune=cortex-a8 -mfloat-abi=softfp -mfpu=neon"
-            },
-            "x86_64": {
-                "arch": "x86_64",
-                "cpu": "x86_64",
-                "cross_prefix": "x86_64-linux-android",
-                "toolchain": "x86_64-linux-android",
-                "extra_cflags": "-march=x86-64 -msse4.2 -mpopcnt"
-            },
-            "x86": {
-                "arch": "x86",
-                "cpu": "i686",
-                "cross_prefix": "i686-linux-android",
-                "toolchain": "i686-linux-android",
-                "extra_cflags": "-march=i686 -mtune=intel -mssse3 -mfpmath=sse"
-            }
-        }
-        return toolchains
+        self.toolchains = _TOOLCHAINS
+        self._build_configs: Dict[Tuple[str, int], Dict] = {}
     
     def configure_build(self, arch: str, api_level: int = 21) -> Dict:
-        """配置构建参数"""
+        """配置构建参数（按架构与API级别缓存在实例上，每次返回副本）"""
         if arch not in self.toolchains:
             raise ValueError(f"不支持的架构: {arch}")
         
-        toolchain = self.toolchains[arch]
-        ndk_version = self._get_ndk_version()
-        
-        # 构建路径
-        build_dir = self.build_dir / arch
+        # 构建路径（绝对路径：configure在构建目录内执行，各架构互不干扰）
+        build_dir = (self.build_dir / arch).resolve()
         build_dir.mkdir(parents=True, exist_ok=True)
         
+        key = (arch, api_level)
+        if key not in self._build_configs:
+            self._build_configs[key] = self._make_build_config(arch, api_level, build_dir)
+        config = self._build_configs[key]
+        return {**config, "config_args": list(config["config_args"])}
+    
+    def _make_build_config(self, arch: str, api_level: int, build_dir: Path) -> Dict:
+        """生成交叉编译的configure参数"""
+        toolchain = self.toolchains[arch]
+        
         # 工具链路径
         toolchain_path = self.ndk_path / "toolchains" / "llvm" / "prebuilt"
         if platform.system() == "Darwin":
@@ -112,8 +172,9 @@ class AndroidFFmpegBuilder:
             "api_level": api_level
         }
     
-    def _get_ndk_version(self) -> str:
-        """获取NDK版本"""
+    @functools.cached_property
+    def ndk_version(self) -> str:
+        """获取NDK版本（只读取一次source.properties）"""
         ndk_properties = self.ndk_path / "source.properties"
         if ndk_properties.exists():
             with open(ndk_properties) as f:
@@ -122,57 +183,69 @@ class AndroidFFmpegBuilder:
                         return line.split("=")[1].strip()
         return "unknown"
     
-    def build_ffmpeg(self, arch: str, api_level: int = 21) -> bool:
+    def build_ffmpeg(self, arch: str, api_level: int = 21,
+                     jobs: Optional[int] = None) -> bool:
         """构建FFmpeg"""
         try:
             config = self.configure_build(arch, api_level)
+            build_dir = config["build_dir"]
+            jobs = jobs or os.cpu_count() or 8
             
-            # 配置FFmpeg
-            configure_cmd = ["./configure"] + config["config_args"]
+            # 配置FFmpeg：源码树外构建，源码目录保持只读，可多架构并行
+            configure_cmd = [str(self.ffmpeg_source.resolve() / "configure")] + config["config_args"]
             
             # 运行配置
-            result = subprocess.run(
-                configure_cmd,
-                cwd=self.ffmpeg_source,
-                capture_output=True,
-                text=True
-            )
+            returncode, output = run_streaming(configure_cmd, cwd=build_dir)
             
-            if result.returncode != 0:
-                logging.error(f"配置失败: {result.stderr}")
+            if returncode != 0:
+                logging.error(f"配置失败: {output}")
                 return False
             
             # 编译
-            make_result = subprocess.run(
-                ["make", "-j8"],
-                cwd=self.ffmpeg_source,
-                capture_output=True,
-                text=True
-            )
+            returncode, output = run_streaming(["make", f"-j{jobs}"], cwd=build_dir)
             
-            if make_result.returncode != 0:
-                logging.error(f"编译失败: {make_result.stderr}")
+            if returncode != 0:
+                logging.error(f"编译失败: {output}")
                 return False
             
             # 安装
-            install_result = subprocess.run(
-                ["make", "install"],
-                cwd=self.ffmpeg_source,
-                capture_output=True,
-                text=True
-            )
+            returncode, _ = run_streaming(["make", "install"], cwd=build_dir)
             
-            return install_result.returncode == 0
+            return returncode == 0
             
         except Exception as e:
             logging.error(f"构建失败: {e}")
             return False
+    
+    def build_all(self, api_level: int = 21,
+                  archs: Optional[List[str]] = None) -> Dict[str, bool]:
+        """并行构建多个架构，CPU核心在各架构间平分"""
+        archs = archs or list(self.toolchains)
+        jobs = max(1, (os.cpu_count() or 8) // len(archs))
+        
+        with ProcessPoolExecutor(max_workers=len(archs)) as executor:
+            futures = {
+                arch: executor.submit(self.build_ffmpeg, arch, api_level, jobs)
+                for arch in archs
+            }
+            return {arch: future.result() for arch, future in futures.items()}
 
 class AndroidHardwareDetector:
     """Android硬件能力检测器"""
     
     def __init__(self):
         self.hardware_profiles = self._load_hardware_profiles()
+        self._keyword_index = self._build_keyword_index(self.hardware_profiles)
+        self._config_cache: Dict[Tuple[str, str], Dict] = {}
+    
+    @staticmethod
+    def _build_keyword_index(profiles: Dict) -> List[Tuple[str, Dict]]:
+        """展开为去重的(关键字, 配置)列表，保持原有的配置优先级"""
+        index = {}
+        for profile_name, profile in profiles.items():
+            for keyword in profile_name.split("_"):
+                index.setdefault(keyword, profile)
+        return list(index.items())
     
     def _load_hardware_profiles(self) -> Dict:
         """加载硬件配置文件"""
@@ -183,7 +256,8 @@ class AndroidHardwareDetector:
                 "max_resolution": "4K",
                 "hw_encoders": ["h264", "h265", "vp8", "vp9"],
                 "hw_decoders": ["h264", "h265", "vp8", "vp9", "av1"],
-                "performance": "high"
+                "performance": "high",
+                "cpu_cores": 8
             },
             "snapdragon_865": {
                 "cpu": "arm64-v8a",
@@ -191,7 +265,8 @@ class AndroidHardwareDetector:
                 "max_resolution": "4K",
                 "hw_encoders": ["h264", "h265", "vp8"],
                 "hw_decoders": ["h264", "h265", "vp8", "vp9"],
-                "performance": "high"
+                "performance": "high",
+                "cpu_cores": 8
             },
             "mediatek_dimensity_1200": {
                 "cpu": "arm64-v8a",
@@ -199,7 +274,8 @@ class AndroidHardwareDetector:
                 "max_resolution": "4K",
                 "hw_encoders": ["h264", "h265"],
                 "hw_decoders": ["h264", "h265", "vp9"],
-                "performance": "medium"
+                "performance": "medium",
+                "cpu_cores": 8
             },
             "generic": {
                 "cpu": "arm64-v8a",
@@ -207,7 +283,8 @@ class AndroidHardwareDetector:
                 "max_resolution": "1080p",
                 "hw_encoders": ["h264"],
                 "hw_decoders": ["h264", "h265"],
-                "performance": "low"
+                "performance": "low",
+                "cpu_cores": 4
             }
         }
     
@@ -216,54 +293,89 @@ class AndroidHardwareDetector:
         device_model = device_model.lower()
         
         # 匹配硬件配置
-        for profile_name, profile in self.hardware_profiles.items():
-            if any(keyword in device_model for keyword in profile_name.split("_")):
+        for keyword, profile in self._keyword_index:
+            if keyword in device_model:
                 return profile
         
         return self.hardware_profiles["generic"]
     
     def get_optimal_config(self, device_model: str, 
                           operation_type: str = "encode") -> Dict:
-        """获取最优配置"""
-        capabilities = self.detect_device_capabilities(device_model)
+        """获取最优配置（按设备型号与操作类型缓存在实例上，返回深拷贝，调用方可随意修改）"""
+        key = (device_model, operation_type)
+        if key not in self._config_cache:
+            capabilities = self.detect_device_capabilities(device_model)
+            
+            if operation_type == "encode":
+                config = self._get_encode_config(capabilities)
+            elif operation_type == "decode":
+                config = self._get_decode_config(capabilities)
+            else:
+                config = capabilities
+            self._config_cache[key] = copy.deepcopy(config)
         
-        if operation_type == "encode":
-            return self._get_encode_config(capabilities)
-        elif operation_type == "decode":
-            return self._get_decode_config(capabilities)
-        else:
-            return capabilities
+        return copy.deepcopy(self._config_cache[key])
     
     def _get_encode_config(self, capabilities: Dict) -> Dict:
         """获取编码配置"""
         config = {
             "codec": "h264",  # 默认使用H.264
+            "encoder": "libx264",
             "preset": "medium",
             "tune": "zerolatency",
             "profile": "baseline",
             "level": "3.1"
         }
         
-        if "h265" in capabilities.get("hw_encoders", []):
-            config["codec"] = "h265"
-            config["profile"] = "main"
-            config["level"] = "4.1"
+        # 优先使用硬件编码器(H.265优先)：仅当本机有硬件编码接口且设备报告支持该格式；
+        # preset/tune/x264参数对其无效
+        if HW_CODEC_API is not None:
+            for codec in ("h265", "h264"):
+                hw_encoder = HW_ENCODERS[HW_CODEC_API].get(codec)
+                if hw_encoder and codec in capabilities.get("hw_encoders", []):
+                    config["codec"] = codec
+                    config["encoder"] = hw_encoder
+                    config["hardware"] = True
+                    if codec == "h265":
+                        config["profile"] = "main"
+                        config["level"] = "4.1"
+                    if HW_CODEC_API == "mediacodec":
+                        config["codec_args"] = ("-bitrate_mode", "cbr")
+                    else:
+                        config["codec_args"] = ("-realtime", "1", "-profile:v", config["profile"])
+                    return config
         
-        # 根据性能等级调整参数
+        # 软件编码回退到libx264，根据性能等级调整参数
         performance = capabilities.get("performance", "medium")
         if performance == "high":
             config["preset"] = "fast"
         elif performance == "low":
             config["preset"] = "ultrafast"
         
+        # 帧内切片并行，降低单帧编码延迟：zerolatency已开启sliced-threads并关闭
+        # rc-lookahead和B帧，这里只需按核心数设置线程，不再用x264-params覆盖
+        cores = capabilities.get("cpu_cores", 8)
+        config["hardware"] = False
+        config["threads"] = cores
+        config["codec_args"] = (
+            "-preset", config["preset"],
+            "-tune", config["tune"],
+            "-profile:v", config["profile"],
+            "-level", config["level"],
+            "-threads", str(cores)
+        )
+        
         return config
     
     def _get_decode_config(self, capabilities: Dict) -> Dict:
         """获取解码配置"""
+        # 本机没有硬件解码接口时使用软件解码
         config = {
-            "hw_decoder": True,
+            "hw_decoder": HW_CODEC_API is not None,
             "supported_codecs": capabilities.get("hw_decoders", ["h264"]),
-            "max_resolution": capabilities.get("max_resolution", "1080p")
+            "max_resolution": capabilities.get("max_resolution", "1080p"),
+            "hwaccel_args": ("-hwaccel", HW_CODEC_API,
+                             "-hwaccel_output_format", HW_CODEC_API) if HW_CODEC_API else ()
         }
         
         return config
@@ -274,6 +386,7 @@ class AndroidFFmpegWrapper:
     def __init__(self, ffmpeg_path: str):
         self.ffmpeg_path = Path(ffmpeg_path)
         self.hardware_detector = AndroidHardwareDetector()
+        self._encode_templates: Dict[Tuple[str, str], Tuple[Dict, Tuple[str, ...]]] = {}
     
     def encode_video(self, 
                     input_file: str,
@@ -282,47 +395,53 @@ class AndroidFFmpegWrapper:
                     target_resolution: str = "720p") -> Dict:
         """编码视频"""
         
-        # 检测设备能力
-        config = self.hardware_detector.get_optimal_config(device_model, "encode")
+        # 检测设备能力并取得预编译的参数模板
+        config, encode_args = self._encode_template(device_model, target_resolution)
         
-        # 构建FFmpeg命令
-        command = [
-            str(self.ffmpeg_path),
-            '-i', input_file,
-            '-c:v', config["codec"],
-            '-preset', config["preset"],
-            '-tune', config["tune"],
-            '-profile:v', config["profile"],
-            '-level', config["level"],
-            '-s', self._get_resolution(target_resolution),
-            '-b:v', self._get_bitrate(target_resolution, config["codec"]),
-            '-c:a', 'aac',
-            '-b:a', '128k',
-            '-f', 'mp4',
-            output_file
-        ]
+        # 构建FFmpeg命令：只替换输入输出文件
+        command = [str(self.ffmpeg_path), '-i', input_file, *encode_args, output_file]
         
-        try:
-            result = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
+        # Python创建的文件描述符默认不可继承，无需close_fds
+        returncode, output = run_streaming(command, close_fds=False)
+        
+        if returncode == 0:
             return {
                 "success": True,
                 "command": " ".join(command),
-                "output": result.stdout,
+                "output": output,
                 "config": config
             }
-            
-        except subprocess.CalledProcessError as e:
-            return {
-                "success": False,
-                "error": e.stderr,
-                "command": " ".join(command)
-            }
+        
+        return {
+            "success": False,
+            "error": output,
+            "command": " ".join(command)
+        }
+    
+    def _encode_template(self, device_model: str,
+                         target_resolution: str) -> Tuple[Dict, Tuple[str, ...]]:
+        """输入与输出之间的固定参数，按设备型号与分辨率缓存在实例上，配置以副本返回"""
+        key = (device_model, target_resolution)
+        if key not in self._encode_templates:
+            self._encode_templates[key] = self._build_encode_template(device_model, target_resolution)
+        config, encode_args = self._encode_templates[key]
+        return copy.deepcopy(config), encode_args
+    
+    def _build_encode_template(self, device_model: str,
+                               target_resolution: str) -> Tuple[Dict, Tuple[str, ...]]:
+        """生成编码参数模板"""
+        config = self.hardware_detector.get_optimal_config(device_model, "encode")
+        encode_args = (
+            '-c:v', config["encoder"],
+            *config["codec_args"],
+            '-s', self._get_resolution(target_resolution),
+            '-b:v', self._get_bitrate(target_resolution, config["codec"]),
+            '-c:a', 'aac',
+            '-b:a', '128k',
+            '-movflags', '+faststart',
+            '-f', 'mp4'
+        )
+        return config, encode_args
     
     def _get_resolution(self, target: str) -> str:
         """获取分辨率"""
@@ -364,6 +483,10 @@ if __name__ == "__main__":
     success = builder.build_ffmpeg("arm64-v8a", 29)
     print(f"构建结果: {success}")
     
+    # 并行构建全部架构
+    results = builder.build_all(29)
+    print(f"全架构构建结果: {results}")
+    
     # 检测设备能力
     detector = AndroidHardwareDetector()
     capabilities = detector.detect_device_capabilities("samsung_s21")
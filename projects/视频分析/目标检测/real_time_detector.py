@@ -5,17 +5,25 @@
 """
 
 import cv2
+import copy
+import functools
 import numpy as np
 import logging
+import platform
 import time
 from typing import List, Dict, Tuple, Optional
 from dataclasses import dataclass
+from collections import deque
 import json
 import threading
-from queue import Queue
+from pathlib import Path
+from concurrent.futures import Future
+from queue import Queue, Empty
 import torch
 import torchvision
-from torchvision.models.detection import fasterrcnn_resnet50_fpn, ssdlite320_mobilenet_v3_large
+from scipy.optimize import linear_sum_assignment
+from torchvision.models.detection import fasterrcnn_resnet50_fpn, ssdlite320_mobilenet_v3_large, fcos_resnet50_fpn
+from torchvision.ops import batched_nms
 
 @dataclass
 class DetectionResult:
@@ -26,30 +34,401 @@ class DetectionResult:
     class_name: str
     timestamp: float
 
+@functools.lru_cache(maxsize=128)
+def _label_size(label: str) -> Tuple[int, int]:
+    """标签文字尺寸，按"类别: 置信度"文本缓存（置信度已按两位小数分桶）"""
+    return cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
+
 class FrameBuffer:
     """帧缓冲区管理"""
     
     def __init__(self, max_size: int = 30):
         self.max_size = max_size
-        self.buffer = []
+        # 定长deque两端操作O(1)，超出容量自动淘汰最旧帧
+        self.buffer = deque(maxlen=max_size)
         self.lock = threading.Lock()
     
     def add_frame(self, frame: np.ndarray, timestamp: float):
         """添加帧到缓冲区"""
         with self.lock:
             self.buffer.append({"frame": frame, "timestamp": timestamp})
-            if len(self.buffer) > self.max_size:
-                self.buffer.pop(0)
     
     def get_latest_frame(self) -> Optional[Dict]:
-        """获取最新帧"""
-        with self.lock:
-            return self.buffer[-1] if self.buffer else None
+        """获取最新帧（GIL下deque单次索引是原子的，读取无需加锁）"""
+        try:
+            return self.buffer[-1]
+        except IndexError:
+            return None
     
     def get_frame_count(self) -> int:
         """获取帧数量"""
-        with self.lock:
-            return len(self.buffer)
+        return len(self.buffer)
+
+class BatchScheduler:
+    """动态批处理调度器
+    
+    攒够batch_size帧或最早一帧等待超过max_latency_ms后，合并为一次模型前向
+    """
+    
+    def __init__(self, detector: "RealTimeDetector",
+                 batch_size: int = 8,
+                 max_latency_ms: float = 10.0):
+        self.detector = detector
+        self.batch_size = batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.queue = Queue()
+        self.worker = None
+    
+    def start(self):
+        """启动批处理线程"""
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+    
+    def stop(self):
+        """处理完已提交的帧后停止"""
+        self.queue.put(None)
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+    
+    def submit(self, frame: np.ndarray) -> Future:
+        """提交一帧，返回检测结果的Future"""
+        future = Future()
+        self.queue.put((frame, future))
+        return future
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            
+            # 收集一批：数量或等待时间先到者为准
+            batch = [item]
+            deadline = time.time() + self.max_latency
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            frames = [frame for frame, _ in batch]
+            try:
+                results = self.detector.predict_batch(frames)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), detections in zip(batch, results):
+                future.set_result(detections)
+
+class TensorRTDetectorBackend:
+    """TensorRT推理后端
+    
+    首次使用时把torchvision检测模型导出为ONNX并构建TensorRT引擎
+    （Ampere及以上用BF16，其余用FP16），引擎按模型、GPU架构和精度缓存为.plan文件。
+    调用接口与torchvision检测模型一致：输入图像列表，返回boxes/scores/labels字典列表
+    """
+    
+    # 输入(3, H, W)的优化范围：最小/典型/最大摄像头分辨率
+    MIN_SHAPE = (3, 240, 320)
+    OPT_SHAPE = (3, 720, 1280)
+    MAX_SHAPE = (3, 1080, 1920)
+    OUTPUT_NAMES = ("boxes", "scores", "labels")
+    
+    def __init__(self, model, model_name: str, cache_dir: str = "trt_cache"):
+        import tensorrt as trt
+        
+        self.trt = trt
+        self.logger = trt.Logger(trt.Logger.WARNING)
+        
+        major, minor = torch.cuda.get_device_capability()
+        self.use_bf16 = major >= 8 and hasattr(trt.BuilderFlag, "BF16")
+        precision = "bf16" if self.use_bf16 else "fp16"
+        
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        plan_path = cache_dir / f"{model_name}_sm{major}{minor}_{precision}.plan"
+        if not plan_path.exists():
+            onnx_path = cache_dir / f"{model_name}.onnx"
+            self._export_onnx(model, onnx_path)
+            plan_path.write_bytes(self._build_engine(onnx_path))
+        
+        runtime = trt.Runtime(self.logger)
+        self.engine = runtime.deserialize_cuda_engine(plan_path.read_bytes())
+        self.context = self.engine.create_execution_context()
+        self.stream = torch.cuda.Stream()
+        
+        # 检测数量依赖数据，输出显存由分配器按需分配并复用
+        self.output_allocator = self._make_output_allocator()
+        for name in self.OUTPUT_NAMES:
+            self.context.set_output_allocator(name, self.output_allocator)
+    
+    def _export_onnx(self, model, onnx_path: Path):
+        """导出ONNX（输入为单张CHW图像，高宽可变）"""
+        dummy = torch.zeros(self.OPT_SHAPE, device=next(model.parameters()).device)
+        torch.onnx.export(
+            model,
+            ([dummy],),
+            str(onnx_path),
+            opset_version=17,
+            input_names=["image"],
+            output_names=list(self.OUTPUT_NAMES),
+            dynamic_axes={
+                "image": {1: "height", 2: "width"},
+                "boxes": {0: "num_detections"},
+                "scores": {0: "num_detections"},
+                "labels": {0: "num_detections"}
+            }
+        )
+    
+    def _build_engine(self, onnx_path: Path) -> bytes:
+        """构建并序列化TensorRT引擎"""
+        trt = self.trt
+        builder = trt.Builder(self.logger)
+        network = builder.create_network(
+            1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH)
+        )
+        parser = trt.OnnxParser(network, self.logger)
+        if not parser.parse(onnx_path.read_bytes()):
+            errors = [str(parser.get_error(i)) for i in range(parser.num_errors)]
+            raise RuntimeError(f"ONNX解析失败: {errors}")
+        
+        config = builder.create_builder_config()
+        config.set_flag(trt.BuilderFlag.BF16 if self.use_bf16 else trt.BuilderFlag.FP16)
+        
+        profile = builder.create_optimization_profile()
+        profile.set_shape("image", self.MIN_SHAPE, self.OPT_SHAPE, self.MAX_SHAPE)
+        config.add_optimization_profile(profile)
+        
+        engine = builder.build_serialized_network(network, config)
+        if engine is None:
+            raise RuntimeError("TensorRT引擎构建失败")
+        return bytes(engine)
+    
+    def _make_output_allocator(self):
+        """创建输出分配器：复用已分配的显存，只在变大时重新分配"""
+        trt = self.trt
+        
+        class OutputAllocator(trt.IOutputAllocator):
+            def __init__(self):
+                super().__init__()
+                self.buffers = {}
+                self.shapes = {}
+            
+            def reallocate_output(self, tensor_name, memory, size, alignment):
+                buffer = self.buffers.get(tensor_name)
+                if buffer is None or buffer.numel() < size:
+                    buffer = torch.empty(max(size, 1), dtype=torch.uint8, device="cuda")
+                    self.buffers[tensor_name] = buffer
+                return buffer.data_ptr()
+            
+            def notify_shape(self, tensor_name, shape):
+                self.shapes[tensor_name] = tuple(shape)
+        
+        return OutputAllocator()
+    
+    def _output_tensor(self, name: str) -> torch.Tensor:
+        """把输出显存按引擎声明的类型和形状解释为tensor"""
+        trt = self.trt
+        dtypes = {
+            trt.float32: torch.float32,
+            trt.float16: torch.float16,
+            trt.int32: torch.int32,
+        }
+        if hasattr(trt, "int64"):
+            dtypes[trt.int64] = torch.int64
+        if hasattr(trt, "bfloat16"):
+            dtypes[trt.bfloat16] = torch.bfloat16
+        
+        dtype = dtypes[self.engine.get_tensor_dtype(name)]
+        shape = self.output_allocator.shapes[name]
+        count = int(np.prod(shape))
+        buffer = self.output_allocator.buffers[name]
+        return buffer.view(dtype)[:count].reshape(shape).clone()
+    
+    def eval(self):
+        return self
+    
+    def __call__(self, images: List[torch.Tensor]) -> List[Dict]:
+        results = []
+        # 输入可能由其他流产生（预处理拷贝流、默认流），推理前等待其完成
+        self.stream.wait_stream(torch.cuda.current_stream())
+        for image in images:
+            image = image.contiguous()
+            with torch.cuda.stream(self.stream):
+                self.context.set_input_shape("image", tuple(image.shape))
+                self.context.set_tensor_address("image", image.data_ptr())
+                self.context.execute_async_v3(self.stream.cuda_stream)
+            self.stream.synchronize()
+            
+            outputs = {name: self._output_tensor(name) for name in self.OUTPUT_NAMES}
+            outputs["boxes"] = outputs["boxes"].float()
+            outputs["scores"] = outputs["scores"].float()
+            outputs["labels"] = outputs["labels"].long()
+            results.append(outputs)
+        return results
+
+class SingleStageDetectorAdapter:
+    """单阶段检测器适配（ultralytics YOLOv8 / RT-DETR）
+    
+    整批图像letterbox到同一画布后做一次真正的(B,3,H,W)前向，
+    调用接口与torchvision检测模型一致：输入CHW图像列表，返回boxes/scores/labels字典列表
+    """
+    
+    WEIGHTS = {"yolov8n": "yolov8n.pt", "rtdetr": "rtdetr-l.pt"}
+    
+    def __init__(self, model_name: str, device: torch.device,
+                 score_threshold: float = 0.25,
+                 iou_threshold: float = 0.45,
+                 max_detections: int = 100,
+                 input_size: int = 640):
+        from ultralytics import YOLO, RTDETR
+        
+        loader = RTDETR if model_name == "rtdetr" else YOLO
+        self.net = loader(self.WEIGHTS[model_name]).model.to(device).eval()
+        self.model_name = model_name
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self.max_detections = max_detections
+        self.input_size = input_size  # 32的倍数，与模型步长对齐
+    
+    def eval(self):
+        return self
+    
+    def parameters(self):
+        return self.net.parameters()
+    
+    def _letterbox(self, images: List[torch.Tensor]) -> Tuple[torch.Tensor, List[float]]:
+        """等比缩放后贴到灰色方形画布左上角，返回批量张量和各图缩放比"""
+        size = self.input_size
+        batch = images[0].new_full((len(images), 3, size, size), 114 / 255.0)
+        scales = []
+        for i, image in enumerate(images):
+            height, width = image.shape[1:]
+            scale = min(size / height, size / width)
+            new_h, new_w = round(height * scale), round(width * scale)
+            resized = torch.nn.functional.interpolate(
+                image[None], size=(new_h, new_w), mode="bilinear", align_corners=False
+            )
+            batch[i, :, :new_h, :new_w] = resized[0]
+            scales.append(scale)
+        return batch, scales
+    
+    def __call__(self, images: List[torch.Tensor]) -> List[Dict]:
+        batch, scales = self._letterbox(images)
+        output = self.net(batch)
+        if isinstance(output, (list, tuple)):
+            output = output[0]
+        
+        # YOLOv8输出(B, 4+nc, A)，框为像素xywh；RT-DETR输出(B, Q, 4+nc)，框为归一化cxcywh
+        if self.model_name == "rtdetr":
+            preds = output.float()
+            box_scale = self.input_size
+        else:
+            preds = output.float().transpose(1, 2)
+            box_scale = 1.0
+        
+        results = []
+        for pred, scale in zip(preds, scales):
+            scores, labels = pred[:, 4:].max(dim=1)
+            keep = scores > self.score_threshold
+            pred, scores, labels = pred[keep], scores[keep], labels[keep]
+            
+            cxcy = pred[:, :2] * box_scale
+            half_wh = pred[:, 2:4] * (box_scale / 2)
+            boxes = torch.cat([cxcy - half_wh, cxcy + half_wh], dim=1)
+            
+            # RT-DETR是一对一匹配，无需NMS
+            if self.model_name == "rtdetr":
+                order = scores.argsort(descending=True)
+            else:
+                order = batched_nms(boxes, scores, labels, self.iou_threshold)
+            order = order[:self.max_detections]
+            
+            results.append({
+                "boxes": boxes[order] / scale,
+                "scores": scores[order],
+                # COCO 80类索引从0开始，class_names第0项为background
+                "labels": labels[order] + 1
+            })
+        return results
+
+def _fold_frozen_bn(module: torch.nn.Module) -> torch.nn.Module:
+    """把FrozenBatchNorm2d折叠进前一个卷积，量化时卷积才能与ReLU融合"""
+    from torch.fx import symbolic_trace
+    from torchvision.ops.misc import FrozenBatchNorm2d
+    
+    graph_module = symbolic_trace(module)
+    modules = dict(graph_module.named_modules())
+    
+    for node in list(graph_module.graph.nodes):
+        if node.op != "call_module" or not isinstance(modules[node.target], FrozenBatchNorm2d):
+            continue
+        conv_node = node.args[0]
+        if (conv_node.op != "call_module"
+                or not isinstance(modules[conv_node.target], torch.nn.Conv2d)
+                or len(conv_node.users) != 1):
+            continue
+        
+        conv, bn = modules[conv_node.target], modules[node.target]
+        scale = bn.weight * torch.rsqrt(bn.running_var + bn.eps)
+        bias = conv.bias.data if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        conv.weight.data.mul_(scale.reshape(-1, 1, 1, 1))
+        conv.bias = torch.nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+        
+        node.replace_all_uses_with(conv_node)
+        graph_module.graph.erase_node(node)
+    
+    graph_module.graph.lint()
+    graph_module.recompile()
+    return graph_module
+
+def quantize_detector(model: torch.nn.Module,
+                      calibration_images: List[torch.Tensor],
+                      engine: Optional[str] = None) -> torch.nn.Module:
+    """检测模型骨干网络INT8训练后静态量化（FX图模式，逐通道权重）
+    
+    只量化骨干网络，FPN、RPN和ROI检测头保持FP32以保证精度；返回量化后的模型副本
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    
+    if engine is None:
+        engine = "qnnpack" if platform.machine().lower() in ("arm64", "aarch64") else "fbgemm"
+    torch.backends.quantized.engine = engine
+    
+    model = copy.deepcopy(model).cpu().eval()
+    
+    # Faster R-CNN的骨干在backbone.body（其后为FPN），SSD直接量化backbone
+    if hasattr(model.backbone, "body"):
+        owner, attr = model.backbone, "body"
+    else:
+        owner, attr = model, "backbone"
+    
+    example = model.transform(calibration_images[:1])[0].tensors
+    prepared = prepare_fx(
+        _fold_frozen_bn(getattr(owner, attr)),
+        get_default_qconfig_mapping(engine),
+        example_inputs=(example,)
+    )
+    
+    # 用真实帧校准激活值范围
+    with torch.no_grad():
+        for image in calibration_images:
+            prepared(model.transform([image.cpu()])[0].tensors)
+    
+    setattr(owner, attr, convert_fx(prepared))
+    return model
 
 class RealTimeDetector:
     """实时目标检测器"""
@@ -57,7 +436,10 @@ class RealTimeDetector:
     def __init__(self, 
                  model_name: str = "faster_rcnn",
                  confidence_threshold: float = 0.5,
-                 device: str = "auto"):
+                 device: str = "auto",
+                 backend: str = "torch",
+                 stats_window: int = 100_000,
+                 compile_model: bool = False):
         
         self.model_name = model_name
         self.confidence_threshold = confidence_threshold
@@ -67,6 +449,17 @@ class RealTimeDetector:
         self.model = self._load_model()
         self.model.eval()
         
+        # TensorRT后端：仅CUDA可用，推理接口与原模型一致
+        if backend == "trt":
+            if self.device.type != "cuda":
+                raise ValueError("TensorRT后端需要CUDA设备")
+            self.model = TensorRTDetectorBackend(self.model, self.model_name)
+        elif backend != "torch":
+            raise ValueError(f"不支持的推理后端: {backend}")
+        
+        # torch.compile需要固定输入尺寸，等第一帧到来后再编译
+        self._compile_pending = compile_model and backend == "torch"
+        
         # COCO类别名称
         self.class_names = [
             'background', 'person', 'bicycle', 'car', 'motorcycle', 'airplane',
@@ -92,12 +485,32 @@ class RealTimeDetector:
         self.fps_counter = 0
         self.total_frames = 0
         self.total_processing_time = 0
-        self.detections = []
+        # 检测统计按列存储(SoA)的定长环形缓冲：只保留最近stats_window个检测，内存恒定
+        self._conf_buf = np.empty(stats_window, dtype=np.float32)
+        self._cls_buf = np.empty(stats_window, dtype=np.int16)
+        self._head = 0
+        self._n = 0
+        self._total_detections = 0
         
         # 线程安全
         self.lock = threading.Lock()
         self.running = False
         
+        # CUDA上启用TF32，并用混合精度推理（Ampere及以上BF16，其余FP16）
+        self._autocast_dtype = None
+        if self.device.type == "cuda":
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
+            torch.set_float32_matmul_precision("high")
+            major, _ = torch.cuda.get_device_capability(self.device)
+            self._autocast_dtype = torch.bfloat16 if major >= 8 else torch.float16
+        
+        # CUDA预处理：页锁定暂存区 + 独立拷贝流，H2D拷贝与上一帧推理重叠
+        self._pinned = None
+        self._staging_buf = None
+        self._copy_done = None
+        self._copy_stream = torch.cuda.Stream() if self.device.type == "cuda" else None
+        
     def _setup_device(self, device: str) -> torch.device:
         """设置计算设备"""
         if device == "auto":
@@ -115,82 +528,180 @@ class RealTimeDetector:
             model = fasterrcnn_resnet50_fpn(pretrained=True)
         elif self.model_name == "ssd":
             model = ssdlite320_mobilenet_v3_large(pretrained=True)
+        elif self.model_name == "fcos":
+            model = fcos_resnet50_fpn(pretrained=True)
+        elif self.model_name in SingleStageDetectorAdapter.WEIGHTS:
+            return SingleStageDetectorAdapter(
+                self.model_name, self.device, score_threshold=self.confidence_threshold
+            )
         else:
             raise ValueError(f"不支持的模型: {self.model_name}")
         
         return model.to(self.device)
     
+    def enable_int8(self,
+                    calibration_frames: List[np.ndarray],
+                    num_threads: Optional[int] = None):
+        """CPU推理切换为INT8骨干网络
+        
+        calibration_frames建议约100帧真实画面；多进程部署时num_threads传1，避免线程争用
+        """
+        if self.device.type != "cpu":
+            raise ValueError("INT8量化推理仅支持CPU设备")
+        
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        
+        calibration_images = [self._preprocess_frame(frame) for frame in calibration_frames]
+        self.model_int8 = quantize_detector(self.model, calibration_images)
+        self.model = self.model_int8
+    
     def predict(self, frame: np.ndarray) -> List[DetectionResult]:
         """执行目标检测"""
+        return self.predict_batch([frame])[0]
+    
+    def predict_batch(self, frames: List[np.ndarray]) -> List[List[DetectionResult]]:
+        """批量目标检测：多帧合并为一次模型前向"""
         start_time = time.time()
         
+        if self._compile_pending:
+            self._compile_for_shape(frames[0].shape[:2])
+        
         # 预处理
-        input_tensor = self._preprocess_frame(frame)
+        input_tensors = [self._preprocess_frame(frame) for frame in frames]
         
-        # 推理
-        with torch.no_grad():
-            predictions = self.model([input_tensor])[0]
+        # 推理：计算流等待拷贝流上的H2D完成
+        if self._copy_stream is not None:
+            torch.cuda.current_stream().wait_stream(self._copy_stream)
+        with torch.inference_mode(), torch.autocast(
+            device_type=self.device.type,
+            dtype=self._autocast_dtype,
+            enabled=self._autocast_dtype is not None
+        ):
+            predictions = self.model(input_tensors)
         
         # 后处理
-        results = self._postprocess_predictions(predictions, frame.shape)
+        batch_results = [
+            self._postprocess_predictions(prediction, frame.shape)
+            for prediction, frame in zip(predictions, frames)
+        ]
         
         # 更新统计
         processing_time = time.time() - start_time
+        confidences = [det.confidence for results in batch_results for det in results]
+        class_ids = [det.class_id for results in batch_results for det in results]
         with self.lock:
-            self.total_frames += 1
+            self.total_frames += len(frames)
             self.total_processing_time += processing_time
-            self.detections.extend(results)
+            self._record_detections(confidences, class_ids)
         
-        return results
+        return batch_results
+    
+    def _record_detections(self, confidences: List[float], class_ids: List[int]):
+        """写入环形统计缓冲，满后覆盖最旧的检测（调用方持有self.lock）"""
+        self._total_detections += len(confidences)
+        capacity = len(self._conf_buf)
+        if len(confidences) > capacity:
+            confidences = confidences[-capacity:]
+            class_ids = class_ids[-capacity:]
+        
+        count = len(confidences)
+        head = self._head
+        first = min(count, capacity - head)
+        self._conf_buf[head:head + first] = confidences[:first]
+        self._cls_buf[head:head + first] = class_ids[:first]
+        self._conf_buf[:count - first] = confidences[first:]
+        self._cls_buf[:count - first] = class_ids[first:]
+        
+        self._head = (head + count) % capacity
+        self._n = min(self._n + count, capacity)
+    
+    def _compile_for_shape(self, frame_size: Tuple[int, int]):
+        """按固定输入尺寸用torch.compile特化模型，编译失败时保留eager模型"""
+        self._compile_pending = False
+        height, width = frame_size
+        dummy = [torch.zeros(3, height, width, device=self.device)]
+        
+        eager_model = self.model
+        try:
+            compiled = torch.compile(eager_model, mode="reduce-overhead", fullgraph=False, dynamic=False)
+            # 编译是惰性的，用一次前向触发并验证
+            with torch.inference_mode():
+                compiled(dummy)
+            self.model = compiled
+        except Exception as e:
+            logging.warning(f"torch.compile失败，使用eager模型: {e}")
+            self.model = eager_model
     
     def _preprocess_frame(self, frame: np.ndarray) -> torch.Tensor:
         """预处理帧"""
-        # 转换颜色空间
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if self._copy_stream is not None:
+            return self._preprocess_frame_cuda(frame)
         
-        # 转换为tensor
-        frame_tensor = torch.from_numpy(frame_rgb).permute(2, 0, 1).float() / 255.0
+        # HWC->CHW时按[2,1,0]取通道完成BGR->RGB，省去单独的颜色转换
+        frame_tensor = torch.from_numpy(frame).permute(2, 0, 1)[[2, 1, 0]].float().div_(255.0)
         
         return frame_tensor.to(self.device)
     
+    def _preprocess_frame_cuda(self, frame: np.ndarray) -> torch.Tensor:
+        """CUDA预处理：BGR帧写入页锁定内存，以uint8异步拷贝到显存，通道交换和归一化在GPU完成"""
+        if self._pinned is None or tuple(self._pinned.shape) != frame.shape:
+            self._pinned = torch.empty(frame.shape, dtype=torch.uint8, pin_memory=True)
+            self._staging_buf = self._pinned.numpy()
+        elif self._copy_done is not None:
+            # 暂存区复用前等待上一次拷贝读完
+            self._copy_done.synchronize()
+        
+        np.copyto(self._staging_buf, frame)
+        
+        with torch.cuda.stream(self._copy_stream):
+            gpu_frame = self._pinned.to(self.device, non_blocking=True)
+            self._copy_done = torch.cuda.Event()
+            self._copy_done.record(self._copy_stream)
+            frame_tensor = gpu_frame.permute(2, 0, 1)[[2, 1, 0]].float().div_(255.0)
+        
+        # 张量在拷贝流上分配、在计算流上使用，告知缓存分配器避免提前复用
+        frame_tensor.record_stream(torch.cuda.current_stream())
+        return frame_tensor
+    
     def _postprocess_predictions(self, 
                                predictions: Dict, 
                                frame_shape: Tuple) -> List[DetectionResult]:
         """后处理预测结果"""
-        boxes = predictions['boxes'].cpu().numpy()
-        scores = predictions['scores'].cpu().numpy()
+        # 混合精度下输出可能是半精度，转回FP32再后处理
+        boxes = predictions['boxes'].float().cpu().numpy()
+        scores = predictions['scores'].float().cpu().numpy()
         labels = predictions['labels'].cpu().numpy()
         
-        results = []
         height, width = frame_shape[:2]
         
-        for box, score, label in zip(boxes, scores, labels):
-            if score > self.confidence_threshold:
-                x1, y1, x2, y2 = box.astype(int)
-                
-                # 确保边界在图像范围内
-                x1 = max(0, min(x1, width))
-                y1 = max(0, min(y1, height))
-                x2 = max(0, min(x2, width))
-                y2 = max(0, min(y2, height))
-                
-                class_name = self.class_names[label] if label < len(self.class_names) else f"class_{label}"
-                
-                results.append(DetectionResult(
-                    bbox=(x1, y1, x2, y2),
-                    confidence=float(score),
-                    class_id=int(label),
-                    class_name=class_name,
-                    timestamp=time.time()
-                ))
+        # 向量化筛选和裁剪，只对保留下来的少量检测构建结果对象
+        keep = scores > self.confidence_threshold
+        boxes = np.clip(boxes[keep].astype(np.int32), 0, [width, height, width, height])
         
-        return results
+        num_classes = len(self.class_names)
+        timestamp = time.time()
+        
+        return [
+            DetectionResult(
+                bbox=tuple(box),
+                confidence=score,
+                class_id=label,
+                class_name=self.class_names[label] if label < num_classes else f"class_{label}",
+                timestamp=timestamp
+            )
+            for box, score, label in zip(boxes.tolist(), scores[keep].tolist(), labels[keep].tolist())
+        ]
     
     def draw_detections(self, 
                        frame: np.ndarray, 
-                       detections: List[DetectionResult]) -> np.ndarray:
-        """绘制检测结果"""
-        result_frame = frame.copy()
+                       detections: List[DetectionResult],
+                       inplace: bool = False) -> np.ndarray:
+        """绘制检测结果
+        
+        inplace=True时直接画在输入帧上，省去整帧拷贝；调用方需不再使用原始画面
+        """
+        result_frame = frame if inplace else frame.copy()
         
         for detection in detections:
             x1, y1, x2, y2 = detection.bbox
@@ -200,7 +711,7 @@ class RealTimeDetector:
             
             # 绘制标签
             label = f"{detection.class_name}: {detection.confidence:.2f}"
-            label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
+            label_size = _label_size(label)
             
             cv2.rectangle(result_frame, 
                         (x1, y1 - label_size[1] - 10), 
@@ -221,9 +732,14 @@ class RealTimeDetector:
     def process_video_file(self, 
                           video_path: str, 
                           output_path: str,
-                          skip_frames: int = 1) -> Dict:
-        """处理视频文件"""
-        cap = cv2.VideoCapture(video_path)
+                          skip_frames: int = 1,
+                          prefetch: int = 16,
+                          use_hw_decode: bool = True) -> Dict:
+        """处理视频文件
+        
+        解码、推理、编码三段流水线：读线程预取帧，主线程推理和绘制，写线程编码输出
+        """
+        cap = self._open_video_capture(video_path, use_hw_decode)
         
         if not cap.isOpened():
             return {"error": "无法打开视频文件"}
@@ -238,41 +754,78 @@ class RealTimeDetector:
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
         out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
         
+        # 有界队列，None为结束标记
+        read_q = Queue(maxsize=prefetch)
+        write_q = Queue(maxsize=prefetch)
+        stop = threading.Event()
+        
+        def reader():
+            while not stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                read_q.put(frame)
+            read_q.put(None)
+        
+        def writer():
+            while True:
+                frame = write_q.get()
+                if frame is None:
+                    break
+                out.write(frame)
+        
+        reader_thread = threading.Thread(target=reader, daemon=True)
+        writer_thread = threading.Thread(target=writer, daemon=True)
+        reader_thread.start()
+        writer_thread.start()
+        
         frame_count = 0
         all_detections = []
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_count % skip_frames == 0:
-                detections = self.predict(frame)
-                result_frame = self.draw_detections(frame, detections)
+        # 模型只在主线程调用
+        try:
+            while True:
+                frame = read_q.get()
+                if frame is None:
+                    break
                 
-                # 收集检测信息
-                frame_detections = {
-                    "frame": frame_count,
-                    "detections": [
-                        {
-                            "bbox": det.bbox,
-                            "confidence": det.confidence,
-                            "class_id": det.class_id,
-                            "class_name": det.class_name
-                        }
-                        for det in detections
-                    ]
-                }
-                all_detections.append(frame_detections)
-            
-            out.write(result_frame)
-            frame_count += 1
+                if frame_count % skip_frames == 0:
+                    detections = self.predict(frame)
+                    result_frame = self.draw_detections(frame, detections, inplace=True)
+                    
+                    # 收集检测信息
+                    frame_detections = {
+                        "frame": frame_count,
+                        "detections": [
+                            {
+                                "bbox": det.bbox,
+                                "confidence": det.confidence,
+                                "class_id": det.class_id,
+                                "class_name": det.class_name
+                            }
+                            for det in detections
+                        ]
+                    }
+                    all_detections.append(frame_detections)
+                
+                write_q.put(result_frame)
+                frame_count += 1
+                
+                if frame_count % 100 == 0:
+                    print(f"处理进度: {frame_count}/{total_frames}")
+        finally:
+            # 提前退出时排空读队列，让读线程结束
+            stop.set()
+            while reader_thread.is_alive():
+                try:
+                    read_q.get(timeout=0.1)
+                except Empty:
+                    pass
+            write_q.put(None)
+            writer_thread.join()
             
-            if frame_count % 100 == 0:
-                print(f"处理进度: {frame_count}/{total_frames}")
-        
-        cap.release()
-        out.release()
+            cap.release()
+            out.release()
         
         return {
             "total_frames": total_frames,
@@ -281,9 +834,26 @@ class RealTimeDetector:
             "average_fps": self.get_average_fps()
         }
     
+    @staticmethod
+    def _open_video_capture(video_path: str, use_hw_decode: bool = True) -> cv2.VideoCapture:
+        """打开视频，优先使用FFmpeg后端的硬件解码（VAAPI/D3D11/QSV等），不可用时回退软件解码"""
+        if use_hw_decode and hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+            cap = cv2.VideoCapture(
+                video_path,
+                cv2.CAP_FFMPEG,
+                [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+            )
+            if cap.isOpened():
+                return cap
+            cap.release()
+        
+        return cv2.VideoCapture(video_path)
+    
     def start_real_time_detection(self, 
                                  video_source: int = 0,
-                                 display: bool = True) -> None:
+                                 display: bool = True,
+                                 batch_size: int = 4,
+                                 max_latency_ms: float = 10.0) -> None:
         """启动实时检测"""
         cap = cv2.VideoCapture(video_source)
         
@@ -292,17 +862,34 @@ class RealTimeDetector:
             return
         
         self.running = True
+        scheduler = BatchScheduler(self, batch_size, max_latency_ms)
+        scheduler.start()
+        
+        # 采集线程提交帧，主线程按顺序取回结果并显示
+        pending = Queue(maxsize=batch_size * 2)
         
-        def detect_loop():
+        def capture_loop():
             while self.running:
                 ret, frame = cap.read()
                 if not ret:
                     break
+                pending.put((frame, scheduler.submit(frame)))
+            pending.put(None)
+        
+        capture_thread = threading.Thread(target=capture_loop, daemon=True)
+        capture_thread.start()
+        
+        def detect_loop() -> bool:
+            while True:
+                item = pending.get()
+                if item is None:
+                    return True
                 
-                detections = self.predict(frame)
+                frame, future = item
+                detections = future.result()
                 
                 if display:
-                    result_frame = self.draw_detections(frame, detections)
+                    result_frame = self.draw_detections(frame, detections, inplace=True)
                     
                     # 显示FPS
                     fps = self.get_average_fps()
@@ -317,9 +904,16 @@ class RealTimeDetector:
                     cv2.imshow("Real-time Detection", result_frame)
                     
                     if cv2.waitKey(1) & 0xFF == ord('q'):
-                        break
+                        return False
         
-        detect_loop()
+        drained = detect_loop()
+        
+        # 停止采集并排空队列，避免采集线程阻塞在put上
+        self.running = False
+        while not drained:
+            drained = pending.get() is None
+        capture_thread.join()
+        scheduler.stop()
         
         cap.release()
         cv2.destroyAllWindows()
@@ -336,29 +930,35 @@ class RealTimeDetector:
             return 1.0 / (self.total_processing_time / self.total_frames)
     
     def get_detection_statistics(self) -> Dict:
-        """获取检测统计"""
+        """获取检测统计
+        
+        total_detections为累计值，类别分布和置信度统计基于最近stats_window个检测的滚动窗口
+        """
         with self.lock:
-            if not self.detections:
+            if self._n == 0:
                 return {"message": "暂无检测数据"}
             
-            # 按类别统计
-            class_counts = {}
-            confidence_scores = []
-            
-            for detection in self.detections:
-                class_name = detection.class_name
-                class_counts[class_name] = class_counts.get(class_name, 0) + 1
-                confidence_scores.append(detection.confidence)
+            # 按类别统计：bincount一次完成计数
+            confidences = self._conf_buf[:self._n]
+            counts = np.bincount(self._cls_buf[:self._n])
+            num_classes = len(self.class_names)
+            class_counts = {
+                self.class_names[class_id] if class_id < num_classes else f"class_{class_id}": int(count)
+                for class_id, count in enumerate(counts.tolist()) if count
+            }
             
-            return {
-                "total_detections": len(self.detections),
+            stats = {
+                "total_detections": self._total_detections,
                 "unique_classes": len(class_counts),
                 "class_distribution": class_counts,
-                "average_confidence": np.mean(confidence_scores),
-                "min_confidence": np.min(confidence_scores),
-                "max_confidence": np.max(confidence_scores),
-                "average_fps": self.get_average_fps()
+                "average_confidence": float(confidences.mean()),
+                "min_confidence": float(confidences.min()),
+                "max_confidence": float(confidences.max())
             }
+        
+        # get_average_fps自己加锁，需在锁外调用
+        stats["average_fps"] = self.get_average_fps()
+        return stats
 
 class DetectionTracker:
     """目标跟踪器"""
@@ -390,8 +990,7 @@ class DetectionTracker:
         detections_centers = [self._get_center(det.bbox) for det in detections]
         
         # 匈牙利算法匹配
-        # 这里简化实现，实际应使用scipy的linear_sum_assignment
-        matched_indices = self._simple_matching(tracks_centers, detections_centers)
+        matched_indices = self._hungarian_matching(tracks_centers, detections_centers)
         
         # 更新跟踪
         updated_tracks = []
@@ -408,8 +1007,9 @@ class DetectionTracker:
                     updated_tracks.append(self.tracks[track_idx])
         
         # 添加新检测
+        matched_detections = {idx for _, idx in matched_indices}
         unmatched_detections = [i for i in range(len(detections)) 
-                              if i not in [idx for _, idx in matched_indices]]
+                              if i not in matched_detections]
         for det_idx in unmatched_detections:
             updated_tracks.append({
                 "id": self.track_id,
@@ -429,35 +1029,28 @@ class DetectionTracker:
         x1, y1, x2, y2 = bbox
         return ((x1 + x2) // 2, (y1 + y2) // 2)
     
-    def _simple_matching(self, 
-                        tracks_centers: List[Tuple[int, int]], 
-                        detections_centers: List[Tuple[int, int]]) -> List[Tuple[int, Optional[int]]]:
-        """简单匹配算法"""
-        matched = []
-        used_detections = set()
+    def _hungarian_matching(self, 
+                            tracks_centers: List[Tuple[int, int]], 
+                            detections_centers: List[Tuple[int, int]]) -> List[Tuple[int, Optional[int]]]:
+        """匈牙利算法匹配：向量化计算距离矩阵，求全局最优分配"""
+        if not detections_centers:
+            return [(i, None) for i in range(len(tracks_centers))]
         
-        for i, track_center in enumerate(tracks_centers):
-            best_match = None
-            best_distance = float('inf')
-            
-            for j, det_center in enumerate(detections_centers):
-                if j in used_detections:
-                    continue
-                
-                distance = np.sqrt((track_center[0] - det_center[0]) ** 2 + 
-                                 (track_center[1] - det_center[1]) ** 2)
-                
-                if distance < self.max_distance and distance < best_distance:
-                    best_distance = distance
-                    best_match = j
-            
-            if best_match is not None:
-                used_detections.add(best_match)
-                matched.append((i, best_match))
-            else:
-                matched.append((i, None))
+        tracks = np.asarray(tracks_centers, dtype=np.float64)
+        dets = np.asarray(detections_centers, dtype=np.float64)
+        cost = np.linalg.norm(tracks[:, None, :] - dets[None, :, :], axis=-1)
+        
+        # 超出最大距离的配对给极大代价，分配后再剔除
+        gated = cost >= self.max_distance
+        cost[gated] = 1e9
+        rows, cols = linear_sum_assignment(cost)
+        
+        assignment = [None] * len(tracks_centers)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            if not gated[row, col]:
+                assignment[row] = col
         
-        return matched
+        return list(enumerate(assignment))
 
 # 使用示例
 if __name__ == "__main__":
@@ -4,15 +4,62 @@ FFmpeg视频编解码优化器
 基于第一性原理：算法选择 + 参数调优 = 质量效率平衡
 """
 
+import os
 import subprocess
-import json
+import functools
 import logging
 import time
-from typing import Dict, List, Optional, Tuple
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import numpy as np
 from pathlib import Path
 
+def _parse_frac(value: str) -> float:
+    """解析ffprobe的分数形式帧率（如"30000/1001"），分母为0时返回0"""
+    num, _, den = value.partition("/")
+    den = int(den or 1)
+    return int(num) / den if den else 0.0
+
+@functools.lru_cache(maxsize=64)
+def _probe_video(input_file: str, mtime_ns: int, size: int) -> Dict:
+    """ffprobe只输出首个视频流的所需字段，按key=value逐行解析，按文件路径、修改时间和大小缓存
+    
+    流时长缺失(N/A)时回退到容器时长；失败时抛出异常，不会被缓存
+    """
+    cmd = [
+        "ffprobe", "-v", "quiet", "-select_streams", "v:0",
+        "-show_entries",
+        "stream=width,height,r_frame_rate,duration,codec_name,bit_rate,pix_fmt:format=duration",
+        "-of", "default=noprint_wrappers=1", input_file
+    ]
+    
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"ffprobe failed: {result.stderr}")
+    
+    # 流字段在前、容器字段在后，保留每个键第一个有效值
+    fields = {}
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition("=")
+        if value and value != "N/A":
+            fields.setdefault(key, value)
+    
+    if "codec_name" not in fields:
+        raise Exception("No video stream found")
+    
+    return {
+        "width": int(fields.get("width", 0)),
+        "height": int(fields.get("height", 0)),
+        "fps": _parse_frac(fields.get("r_frame_rate", "0/1")),
+        "duration": float(fields.get("duration", 0)),
+        "codec": fields.get("codec_name", ""),
+        "bitrate": fields.get("bit_rate"),
+        "pix_fmt": fields.get("pix_fmt", "")
+    }
+
 @dataclass
 class CodecConfig:
     """编解码器配置"""
@@ -63,39 +110,10 @@ class VideoCodecOptimizer:
         }
     
     def analyze_video_properties(self, input_file: str) -> Dict:
-        """分析视频属性"""
+        """分析视频属性（按文件路径、修改时间和大小缓存，文件变化后自动重新探测）"""
         try:
-            cmd = [
-                "ffprobe", "-v", "quiet", "-print_format", "json",
-                "-show_format", "-show_streams", input_file
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise Exception(f"ffprobe failed: {result.stderr}")
-            
-            data = json.loads(result.stdout)
-            
-            # 提取视频流信息
-            video_stream = None
-            for stream in data.get("streams", []):
-                if stream.get("codec_type") == "video":
-                    video_stream = stream
-                    break
-            
-            if not video_stream:
-                raise Exception("No video stream found")
-            
-            return {
-                "width": int(video_stream.get("width", 0)),
-                "height": int(video_stream.get("height", 0)),
-                "fps": eval(video_stream.get("r_frame_rate", "0/1")),
-                "duration": float(video_stream.get("duration", 0)),
-                "codec": video_stream.get("codec_name", ""),
-                "bitrate": video_stream.get("bit_rate"),
-                "pix_fmt": video_stream.get("pix_fmt", "")
-            }
-            
+            stat = Path(input_file).stat()
+            return dict(_probe_video(input_file, stat.st_mtime_ns, stat.st_size))
         except Exception as e:
             logging.error(f"视频分析失败: {e}")
             return {}
@@ -157,28 +175,51 @@ class VideoCodecOptimizer:
         
         return adjusted
     
+    @functools.cached_property
+    def hw_optimizer(self) -> "HardwareAccelerationOptimizer":
+        return HardwareAccelerationOptimizer()
+    
+    @functools.cached_property
+    def detected_hw_backend(self) -> Optional[str]:
+        """首个可用的硬件编码后端（只探测一次）"""
+        detected = self.hw_optimizer.detect_hardware()
+        for hw_type in ("nvidia", "intel"):
+            if detected.get(hw_type):
+                return hw_type
+        return None
+    
     def build_ffmpeg_command(self, 
                            input_file: str,
                            output_file: str,
-                           config: CodecConfig) -> List[str]:
-        """构建FFmpeg命令"""
-        
-        cmd = [
-            "ffmpeg",
-            "-i", input_file,
-            "-c:v", config.codec,
-            "-preset", config.preset,
-            "-crf", str(config.crf),
-            "-profile:v", config.profile,
-            "-level", config.level
-        ]
+                           config: CodecConfig,
+                           hw_backend: Optional[str] = None) -> List[str]:
+        """构建FFmpeg命令
+        
+        hw_backend为"nvidia"/"intel"/"amd"时使用对应硬件编码器，"auto"时按检测结果选择，
+        解码同样走硬件，帧全程留在显存
+        """
+        if hw_backend == "auto":
+            hw_backend = self.detected_hw_backend
+        
+        if hw_backend:
+            cmd = self.hw_optimizer.build_hw_video_args(input_file, config, hw_backend)
+        else:
+            cmd = [
+                "ffmpeg",
+                "-i", input_file,
+                "-c:v", config.codec,
+                "-preset", config.preset,
+                "-crf", str(config.crf),
+                "-profile:v", config.profile,
+                "-level", config.level
+            ]
+            
+            if config.tune:
+                cmd.extend(["-tune", config.tune])
         
         if config.bitrate:
             cmd.extend(["-b:v", config.bitrate])
         
-        if config.tune:
-            cmd.extend(["-tune", config.tune])
-        
         # 添加额外参数
         if config.additional_params:
             for key, value in config.additional_params.items():
@@ -194,18 +235,25 @@ class VideoCodecOptimizer:
     def encode_with_benchmark(self, 
                             input_file: str,
                             output_file: str,
-                            config: CodecConfig) -> Dict:
-        """编码并基准测试"""
+                            config: CodecConfig,
+                            hw_backend: Optional[str] = None,
+                            progress_callback: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """编码并基准测试
+        
+        进度通过-progress pipe:1逐块读取，每块(frame、out_time_ms等)回调一次；
+        stderr只保留末尾若干行用于错误报告，内存占用与编码时长无关
+        """
         
-        cmd = self.build_ffmpeg_command(input_file, output_file, config)
+        cmd = self.build_ffmpeg_command(input_file, output_file, config, hw_backend)
+        cmd[1:1] = ["-progress", "pipe:1", "-nostats", "-loglevel", "error"]
         
         start_time = time.time()
         
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            returncode, stderr_tail = self._run_with_progress(cmd, progress_callback)
             
-            if result.returncode != 0:
-                raise Exception(f"编码失败: {result.stderr}")
+            if returncode != 0:
+                raise Exception(f"编码失败: {stderr_tail}")
             
             encoding_time = time.time() - start_time
             
@@ -234,35 +282,102 @@ class VideoCodecOptimizer:
                 "command": " ".join(cmd)
             }
     
+    @staticmethod
+    def _run_with_progress(cmd: List[str],
+                           progress_callback: Optional[Callable[[Dict], None]] = None,
+                           stderr_lines: int = 256) -> Tuple[int, str]:
+        """运行ffmpeg并解析key=value进度输出，返回(退出码, stderr末尾)"""
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+        
+        # stderr在独立线程中排空，避免管道写满阻塞ffmpeg
+        stderr_tail = deque(maxlen=stderr_lines)
+        stderr_thread = threading.Thread(
+            target=lambda: stderr_tail.extend(line.rstrip() for line in proc.stderr),
+            daemon=True
+        )
+        stderr_thread.start()
+        
+        progress = {}
+        with proc.stdout:
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                progress[key] = value
+                # 每个进度块以progress=continue/end结尾
+                if key == "progress":
+                    if progress_callback:
+                        progress_callback(dict(progress))
+                    progress.clear()
+        
+        returncode = proc.wait()
+        stderr_thread.join()
+        proc.stderr.close()
+        return returncode, "\n".join(stderr_tail)
+    
     def compare_codecs(self, 
                       input_file: str,
                       output_dir: str,
-                      use_case: str = "streaming") -> List[Dict]:
-        """比较不同编解码器"""
+                      use_case: str = "streaming",
+                      hw_backend: Optional[str] = None,
+                      hw_codecs: Tuple[str, ...] = ("h264",)) -> List[Dict]:
+        """比较不同编解码器
+        
+        各编码并行执行，总耗时约为最慢的一路而非三路之和。
+        指定hw_backend时hw_codecs走硬件编码器（不占CPU），
+        其余软件编码按路数平分CPU核数，通过-threads限制避免相互争抢
+        """
         
         Path(output_dir).mkdir(parents=True, exist_ok=True)
         
         codecs = ["h264", "h265", "av1"]
-        results = []
-        
-        for codec in codecs:
-            try:
-                config = self.optimize_codec_config(input_file, codec, use_case)
-                output_file = Path(output_dir) / f"output_{codec}.mp4"
-                
-                result = self.encode_with_benchmark(input_file, str(output_file), config)
-                results.append({
-                    "codec": codec,
-                    "result": result
-                })
-                
-            except Exception as e:
-                results.append({
-                    "codec": codec,
-                    "error": str(e)
-                })
-        
-        return results
+        if hw_backend == "auto":
+            hw_backend = self.detected_hw_backend
+        
+        backends = {codec: hw_backend if codec in hw_codecs else None for codec in codecs}
+        software_jobs = sum(1 for backend in backends.values() if backend is None)
+        threads = max(1, (os.cpu_count() or 1) // max(1, software_jobs))
+        
+        # 先在主线程探测一次输入，各编码线程直接命中缓存
+        self.analyze_video_properties(input_file)
+        
+        with ThreadPoolExecutor(max_workers=len(codecs)) as executor:
+            futures = [
+                executor.submit(self._encode_one, input_file, codec, use_case,
+                                output_dir, backends[codec], threads)
+                for codec in codecs
+            ]
+            return [future.result() for future in futures]
+    
+    def _encode_one(self,
+                    input_file: str,
+                    codec: str,
+                    use_case: str,
+                    output_dir: str,
+                    hw_backend: Optional[str],
+                    threads: int) -> Dict:
+        """比较中的单路编码，异常转为error条目"""
+        try:
+            config = self.optimize_codec_config(input_file, codec, use_case)
+            if hw_backend is None:
+                config.additional_params["-threads"] = str(threads)
+            output_file = Path(output_dir) / f"output_{codec}.mp4"
+            
+            result = self.encode_with_benchmark(input_file, str(output_file), config, hw_backend)
+            return {
+                "codec": codec,
+                "result": result
+            }
+            
+        except Exception as e:
+            return {
+                "codec": codec,
+                "error": str(e)
+            }
 
 class HardwareAccelerationOptimizer:
     """硬件加速优化器"""
@@ -273,19 +388,43 @@ class HardwareAccelerationOptimizer:
                 "encoder": "h264_nvenc",
                 "decoder": "h264_cuvid",
                 "presets": ["default", "slow", "medium", "fast", "hp", "hq", "bd", "ll", "llhq", "llhp"],
-                "devices": ["cuda", "cuvid", "nvenc", "opencl"]
+                "devices": ["cuda", "cuvid", "nvenc", "opencl"],
+                "encoders": {"h264": "h264_nvenc", "h265": "hevc_nvenc", "av1": "av1_nvenc"},
+                "hwaccel": ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"],
+                # 软件预设 -> NVENC p1(最快)~p7(最慢)
+                "preset_map": {
+                    "ultrafast": "p1", "superfast": "p1", "veryfast": "p2", "faster": "p3",
+                    "fast": "p3", "medium": "p4", "slow": "p5", "slower": "p6", "veryslow": "p7",
+                    "realtime": "p1", "good": "p4", "allintra": "p7"
+                }
             },
             "intel": {
                 "encoder": "h264_qsv",
                 "decoder": "h264_qsv",
                 "presets": ["veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"],
-                "devices": ["qsv", "vaapi", "opencl"]
+                "devices": ["qsv", "vaapi", "opencl"],
+                "encoders": {"h264": "h264_qsv", "h265": "hevc_qsv", "av1": "av1_qsv"},
+                "hwaccel": ["-hwaccel", "qsv", "-hwaccel_output_format", "qsv"],
+                "preset_map": {
+                    "ultrafast": "veryfast", "superfast": "veryfast", "veryfast": "veryfast",
+                    "faster": "faster", "fast": "fast", "medium": "medium", "slow": "slow",
+                    "slower": "slower", "veryslow": "veryslow",
+                    "realtime": "veryfast", "good": "medium", "allintra": "veryslow"
+                }
             },
             "amd": {
                 "encoder": "h264_amf",
                 "decoder": "h264_amf",
                 "presets": ["balanced", "speed", "quality"],
-                "devices": ["amf", "opencl"]
+                "devices": ["amf", "opencl"],
+                "encoders": {"h264": "h264_amf", "h265": "hevc_amf", "av1": "av1_amf"},
+                "hwaccel": [],
+                "preset_map": {
+                    "ultrafast": "speed", "superfast": "speed", "veryfast": "speed",
+                    "faster": "speed", "fast": "balanced", "medium": "balanced",
+                    "slow": "quality", "slower": "quality", "veryslow": "quality",
+                    "realtime": "speed", "good": "balanced", "allintra": "quality"
+                }
             }
         }
     
@@ -328,6 +467,26 @@ class HardwareAccelerationOptimizer:
                 "-preset": "medium"
             }
         }
+    
+    def build_hw_video_args(self, input_file: str, config: CodecConfig, hw_type: str) -> List[str]:
+        """构建硬件解码+硬件编码的视频部分参数，CRF映射为各编码器的恒定质量参数"""
+        if hw_type not in self.hw_accelerators:
+            raise ValueError(f"不支持的硬件类型: {hw_type}")
+        
+        hw_config = self.hw_accelerators[hw_type]
+        encoder = hw_config["encoders"][config.codec]
+        preset = hw_config["preset_map"].get(config.preset, hw_config["preset_map"]["medium"])
+        quality = str(config.crf)
+        
+        cmd = ["ffmpeg", *hw_config["hwaccel"], "-i", input_file, "-c:v", encoder]
+        if hw_type == "nvidia":
+            cmd.extend(["-preset", preset, "-tune", "hq", "-rc", "vbr", "-cq", quality])
+        elif hw_type == "intel":
+            cmd.extend(["-preset", preset, "-global_quality", quality])
+        else:
+            cmd.extend(["-quality", preset, "-rc", "cqp", "-qp_i", quality, "-qp_p", quality])
+        
+        return cmd
 
 # 使用示例
 if __name__ == "__main__":
@@ -5,15 +5,31 @@
 """
 
 import subprocess
+import functools
 import json
 import logging
+import os
+import mmap
+import shelve
+import tempfile
+import threading
+import time
 from typing import Dict, List, Tuple, Optional
 from pathlib import Path
+from collections import deque
+from queue import Queue
+import hashlib
 import numpy as np
 from dataclasses import dataclass
 import concurrent.futures
 from datetime import datetime
 
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
 @dataclass
 class QualityMetrics:
     """质量指标"""
@@ -26,81 +42,218 @@ class QualityMetrics:
     processing_time: float
     file_size_mb: float
     bitrate_kbps: float
+    vmaf_p5: float = 0.0  # 逐帧VMAF的第5百分位，反映最差片段质量
+
+# 批量评估时每个ffmpeg进程使用的线程数
+THREADS_PER_FFMPEG = 2
+
+# 批量统计用的结构化数组类型
+RESULT_DTYPE = np.dtype([("psnr", "f8"), ("ssim", "f8"), ("vmaf", "f8"), ("size", "f8"), ("br", "f8")])
+
+def _positive_mean(values: np.ndarray) -> float:
+    """只对大于0（计算成功）的值求均值，全部失败时返回0"""
+    valid = values > 0
+    return float(values.mean(where=valid)) if valid.any() else 0
+
+def mmap_hash(path: str, chunk_size: int = 16 << 20) -> Tuple[int, str]:
+    """mmap顺序读取文件计算xxh3_64摘要（未安装xxhash时退回64位blake2b），返回(文件大小, 摘要)
+    
+    MADV_SEQUENTIAL让内核积极预读，哈希完成后文件页已在page cache中，
+    随后ffmpeg解码大文件时直接命中内存而不是冷读磁盘
+    """
+    hasher = xxhash.xxh3_64() if XXHASH_AVAILABLE else hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0, hasher.hexdigest()
+        
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            
+            size = mm.size()
+            with memoryview(mm) as view:
+                for start in range(0, size, chunk_size):
+                    hasher.update(view[start:start + chunk_size])
+    
+    return size, hasher.hexdigest()
+
+def _file_digest(path: str) -> str:
+    """文件内容摘要，同一进程内按路径、修改时间和大小缓存"""
+    stat = Path(path).stat()
+    return _cached_digest(path, stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=4096)
+def _cached_digest(path: str, mtime_ns: int, size: int) -> str:
+    return mmap_hash(path)[1]
+
+@functools.lru_cache(maxsize=4096)
+def _probe(video_path: str, mtime_ns: int, size: int) -> Dict:
+    """一次ffprobe同时取得容器和流信息，按文件路径、修改时间和大小缓存；失败时抛出异常，不会被缓存"""
+    cmd = ["ffprobe", "-v", "quiet", "-print_format", "json",
+           "-show_format", "-show_streams", video_path]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"ffprobe failed: {video_path}")
+    return json.loads(result.stdout)
 
 class VideoQualityAssessor:
     """视频质量评估器"""
     
-    def __init__(self):
+    def __init__(self, 
+                 subsample: int = 1, 
+                 threads: Optional[int] = None,
+                 cache_path: Optional[str] = None):
+        """subsample>1时libvmaf每隔subsample帧计算一次，仅用于快速迭代预览，正式评分应保持1；
+        threads限制每个ffmpeg的解码和libvmaf线程数，None时使用全部核心；
+        cache_path为持久化结果缓存（按文件内容哈希，如".vmaf_cache.db"），默认None不缓存；
+        启用缓存时用完应调用close()，或使用with语句
+        """
+        self.cache = shelve.open(cache_path) if cache_path else None
         self.supported_metrics = ["psnr", "ssim", "vmaf", "ms_ssim", "niqe", "brisque"]
+        self.subsample = max(1, subsample)
+        self.threads = threads
         self.vmaf_models = {
             "vmaf_v0.6.1": "/usr/share/model/vmaf_v0.6.1.json",
             "vmaf_4k_v0.6.1": "/usr/share/model/vmaf_4k_v0.6.1.json",
             "vmaf_phone_v0.6.1": "/usr/share/model/vmaf_phone_v0.6.1.json"
         }
+        # (参考, 失真, 模型, 参考mtime/大小, 失真mtime/大小, 抽帧间隔) -> libvmaf指标，只缓存成功的结果
+        self._metrics_cache: Dict[tuple, Dict[str, float]] = {}
+    
+    def close(self) -> None:
+        """关闭持久化结果缓存"""
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+    
+    def __enter__(self) -> "VideoQualityAssessor":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+    
+    def _cache_key(self, reference: str, distorted: str, model: str = "vmaf_v0.6.1") -> str:
+        """结果缓存键：参考和失真文件的内容哈希 + VMAF模型 + 抽帧间隔"""
+        return f"{_file_digest(reference)}:{_file_digest(distorted)}:{model}:{self.subsample}"
     
     def calculate_psnr(self, reference: str, distorted: str) -> float:
-        """计算PSNR"""
-        cmd = [
-            "ffmpeg", "-i", distorted, "-i", reference,
-            "-lavfi", "psnr", "-f", "null", "-"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            return 0.0
-        
-        # 解析PSNR值
-        for line in result.stderr.split('\n'):
-            if "average:" in line and "psnr" in line:
+        """计算PSNR：单独运行ffmpeg psnr滤镜，不经过libvmaf"""
+        for line in self._run_filter(reference, distorted, "psnr"):
+            if "average:" in line and "psnr" in line.lower():
                 try:
                     return float(line.split("average:")[1].split()[0])
-                except:
+                except (IndexError, ValueError):
                     pass
         return 0.0
     
     def calculate_ssim(self, reference: str, distorted: str) -> float:
-        """计算SSIM"""
-        cmd = [
-            "ffmpeg", "-i", distorted, "-i", reference,
-            "-lavfi", "ssim", "-f", "null", "-"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            return 0.0
-        
-        # 解析SSIM值
-        for line in result.stderr.split('\n'):
+        """计算SSIM：单独运行ffmpeg ssim滤镜，不经过libvmaf"""
+        for line in self._run_filter(reference, distorted, "ssim"):
             if "All:" in line:
                 try:
                     return float(line.split("All:")[1].split()[0])
-                except:
+                except (IndexError, ValueError):
                     pass
         return 0.0
     
+    def _run_filter(self, reference: str, distorted: str, lavfi: str) -> List[str]:
+        """运行单个对比滤镜，返回ffmpeg stderr末尾若干行（汇总结果在最后输出），失败时返回空列表"""
+        decode_threads = str(self.threads or 0)
+        cmd = [
+            "ffmpeg", "-threads", decode_threads, "-i", distorted,
+            "-threads", decode_threads, "-i", reference,
+            "-lavfi", lavfi, "-f", "null", "-"
+        ]
+        
+        with subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                              text=True, bufsize=1) as proc:
+            stderr_tail = deque(proc.stderr, maxlen=20)
+        
+        if proc.returncode != 0:
+            logging.error(f"{lavfi}计算失败: {''.join(stderr_tail)}")
+            return []
+        return list(stderr_tail)
+    
     def calculate_vmaf(self, reference: str, distorted: str, model: str = "vmaf_v0.6.1") -> float:
         """计算VMAF"""
+        return self._run_libvmaf_combined(reference, distorted, model).get("vmaf", 0.0)
+    
+    def _run_libvmaf_combined(self, 
+                              reference: str, 
+                              distorted: str,
+                              model: str = "vmaf_v0.6.1") -> Dict[str, float]:
+        """一次解码同时计算PSNR/SSIM/VMAF，结果按文件路径、修改时间和大小缓存在实例上；
+        计算失败时返回空字典且不缓存，下次调用会重新计算
+        """
         if model not in self.vmaf_models:
             model = "vmaf_v0.6.1"
         
-        cmd = [
-            "ffmpeg", "-i", distorted, "-i", reference,
-            "-lavfi", f"libvmaf=model_path={self.vmaf_models[model]}:log_fmt=json",
-            "-f", "null", "-"
-        ]
+        ref_stat = Path(reference).stat()
+        dist_stat = Path(distorted).stat()
+        key = (reference, distorted, model,
+               ref_stat.st_mtime_ns, ref_stat.st_size,
+               dist_stat.st_mtime_ns, dist_stat.st_size,
+               self.subsample)
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            return 0.0
+        metrics = self._metrics_cache.get(key)
+        if metrics is None:
+            try:
+                metrics = self._combined_metrics(reference, distorted, model, self.subsample)
+            except RuntimeError as e:
+                logging.error(str(e))
+                return {}
+            self._metrics_cache[key] = metrics
+        return dict(metrics)
+    
+    def _combined_metrics(self, 
+                          reference: str, 
+                          distorted: str,
+                          model: str,
+                          subsample: int) -> Dict[str, float]:
+        """libvmaf附带psnr和float_ssim特征，从JSON日志的pooled_metrics读取均值，
+        逐帧VMAF取第5百分位；ffmpeg失败时抛出RuntimeError
         
-        # 解析VMAF值
-        for line in result.stderr.split('\n'):
-            if '"VMAF score"' in line:
-                try:
-                    return float(line.split(':')[1].strip().replace(',', ''))
-                except:
-                    pass
-        return 0.0
+        libvmaf按帧多线程提取特征，ffmpeg解码器同样自动多线程
+        """
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as log_file:
+            log_path = log_file.name
+        
+        decode_threads = str(self.threads or 0)
+        vmaf_threads = self.threads or os.cpu_count() or 1
+        
+        try:
+            cmd = [
+                "ffmpeg", "-threads", decode_threads, "-i", distorted,
+                "-threads", decode_threads, "-i", reference,
+                "-lavfi",
+                f"[0:v][1:v]libvmaf=model=path={self.vmaf_models[model]}"
+                f":feature=name=psnr|name=float_ssim"
+                f":log_fmt=json:log_path={log_path}:n_threads={vmaf_threads}"
+                f":n_subsample={subsample}",
+                "-f", "null", "-"
+            ]
+            
+            # 指标从JSON日志读取，stderr逐行读取只保留末尾用于报错
+            with subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                  text=True, bufsize=1) as proc:
+                stderr_tail = deque(proc.stderr, maxlen=20)
+            
+            if proc.returncode != 0:
+                raise RuntimeError(f"libvmaf计算失败: {''.join(stderr_tail)}")
+            
+            with open(log_path) as f:
+                log = json.load(f)
+            pooled = log.get("pooled_metrics", {})
+            frame_vmaf = np.array([frame["metrics"].get("vmaf", 0.0) for frame in log.get("frames", [])])
+        finally:
+            Path(log_path).unlink(missing_ok=True)
+        
+        return {
+            "psnr": pooled.get("psnr_y", {}).get("mean", 0.0),
+            "ssim": pooled.get("float_ssim", {}).get("mean", 0.0),
+            "vmaf": pooled.get("vmaf", {}).get("mean", 0.0),
+            "vmaf_p5": float(np.percentile(frame_vmaf, 5)) if frame_vmaf.size else 0.0
+        }
     
     def calculate_no_reference_metrics(self, video_path: str) -> Dict:
         """计算无参考指标"""
@@ -111,33 +264,35 @@ class VideoQualityAssessor:
     def assess_video_quality(self, 
                            reference: str, 
                            distorted: str,
-                           metrics: List[str] = None) -> QualityMetrics:
-        """全面评估视频质量"""
+                           metrics: List[str] = None,
+                           force: bool = False) -> QualityMetrics:
+        """全面评估视频质量
+        
+        评估全部指标时先查持久化缓存，文件内容未变则直接返回；force=True时忽略缓存重新计算
+        """
         
+        cache_key = None
         if metrics is None:
             metrics = self.supported_metrics
+            if self.cache is not None:
+                cache_key = self._cache_key(reference, distorted)
+                if not force and cache_key in self.cache:
+                    return self.cache[cache_key]
         
         start_time = time.time()
         
         results = {}
         
-        # 并行计算指标
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {}
-            
+        # 需要VMAF时全参考指标共用一次libvmaf解码，否则只跑轻量的psnr/ssim滤镜
+        if "vmaf" in metrics:
+            combined = self._run_libvmaf_combined(reference, distorted)
+            results.update({metric: value for metric, value in combined.items() if metric in metrics})
+            results["vmaf_p5"] = combined.get("vmaf_p5", 0.0)
+        else:
             if "psnr" in metrics:
-                futures["psnr"] = executor.submit(self.calculate_psnr, reference, distorted)
+                results["psnr"] = self.calculate_psnr(reference, distorted)
             if "ssim" in metrics:
-                futures["ssim"] = executor.submit(self.calculate_ssim, reference, distorted)
-            if "vmaf" in metrics:
-                futures["vmaf"] = executor.submit(self.calculate_vmaf, reference, distorted)
-            
-            # 获取结果
-            for metric, future in futures.items():
-                try:
-                    results[metric] = future.result(timeout=300)
-                except:
-                    results[metric] = 0.0
+                results["ssim"] = self.calculate_ssim(reference, distorted)
         
         # 无参考指标
         if any(metric in metrics for metric in ["niqe", "brisque"]):
@@ -145,15 +300,17 @@ class VideoQualityAssessor:
             results.update(nr_metrics)
         
         # 获取文件信息
-        file_size_mb = Path(distorted).stat().st_size / (1024 * 1024)
-        bitrate_kbps = self._get_bitrate(distorted)
+        dist_stat = Path(distorted).stat()
+        file_size_mb = dist_stat.st_size / (1024 * 1024)
+        bitrate_kbps = self._get_bitrate(distorted, dist_stat)
         
         processing_time = time.time() - start_time
         
-        return QualityMetrics(
+        quality = QualityMetrics(
             psnr=results.get("psnr", 0.0),
             ssim=results.get("ssim", 0.0),
             vmaf=results.get("vmaf", 0.0),
+            vmaf_p5=results.get("vmaf_p5", 0.0),
             ms_ssim=results.get("ms_ssim", 0.0),
             niqe=results.get("niqe", 0.0),
             brisque=results.get("brisque", 0.0),
@@ -161,97 +318,176 @@ class VideoQualityAssessor:
             file_size_mb=file_size_mb,
             bitrate_kbps=bitrate_kbps
         )
+        
+        if cache_key is not None:
+            self.cache[cache_key] = quality
+            self.cache.sync()
+        
+        return quality
     
-    def _get_bitrate(self, video_path: str) -> float:
+    def _get_bitrate(self, video_path: str, stat: Optional[os.stat_result] = None) -> float:
         """获取视频码率"""
         try:
-            cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", 
-                   "-show_streams", video_path]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            stat = stat or Path(video_path).stat()
+            data = _probe(video_path, stat.st_mtime_ns, stat.st_size)
             
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                for stream in data.get("streams", []):
-                    if stream.get("codec_type") == "video":
-                        bitrate = stream.get("bit_rate")
-                        if bitrate:
-                            return float(bitrate) / 1000  # kbps
+            for stream in data.get("streams", []):
+                if stream.get("codec_type") == "video":
+                    bitrate = stream.get("bit_rate")
+                    if bitrate:
+                        return float(bitrate) / 1000  # kbps
             
             # 计算平均码率
-            file_size = Path(video_path).stat().st_size
-            duration = self._get_duration(video_path)
+            duration = self._get_duration(video_path, stat)
             if duration > 0:
-                return (file_size * 8) / (duration * 1000)  # kbps
+                return (stat.st_size * 8) / (duration * 1000)  # kbps
             
         except:
             pass
         return 0.0
     
-    def _get_duration(self, video_path: str) -> float:
+    def _get_duration(self, video_path: str, stat: Optional[os.stat_result] = None) -> float:
         """获取视频时长"""
         try:
-            cmd = ["ffprobe", "-v", "error", "-show_entries", 
-                   "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", 
-                   video_path]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return float(result.stdout.strip())
+            stat = stat or Path(video_path).stat()
+            data = _probe(video_path, stat.st_mtime_ns, stat.st_size)
+            return float(data.get("format", {}).get("duration", 0.0))
         except:
             return 0.0
     
     def batch_assess_quality(self, 
                            reference_dir: str,
                            distorted_dir: str,
-                           output_file: str) -> Dict:
-        """批量评估质量"""
+                           output_file: str,
+                           prefetch: int = 16,
+                           force: bool = False) -> Dict:
+        """批量评估质量
+        
+        读取线程枚举文件对并计算内容哈希，主线程命中持久化缓存的直接输出，
+        其余分发到进程池（最多prefetch个在途）；force=True时忽略缓存全部重新计算。
+        写入线程把每个完成的结果作为一行JSON追加到output_file同名的.jsonl文件，
+        中途崩溃时已完成的结果不会丢失；全部完成后output_file写入完整结果列表
+        """
         
         reference_path = Path(reference_dir)
         distorted_path = Path(distorted_dir)
+        stream_path = Path(output_file).with_suffix(".jsonl")
         
+        task_queue = Queue(maxsize=prefetch)
+        write_queue = Queue(maxsize=prefetch)
         results = []
         
-        for ref_file in reference_path.glob("*.mp4"):
-            dist_file = distorted_path / ref_file.name
-            
-            if dist_file.exists():
-                try:
-                    metrics = self.assess_video_quality(str(ref_file), str(dist_file))
-                    
-                    results.append({
-                        "filename": ref_file.name,
-                        "psnr": metrics.psnr,
-                        "ssim": metrics.ssim,
-                        "vmaf": metrics.vmaf,
-                        "file_size_mb": metrics.file_size_mb,
-                        "bitrate_kbps": metrics.bitrate_kbps,
-                        "processing_time": metrics.processing_time
-                    })
+        def read_tasks():
+            try:
+                for ref_file in reference_path.glob("*.mp4"):
+                    dist_file = distorted_path / ref_file.name
+                    if not dist_file.exists():
+                        continue
+                    task = (str(ref_file), str(dist_file), self.subsample)
+                    cache_key = self._cache_key(*task[:2]) if self.cache is not None else None
+                    task_queue.put((task, cache_key))
+            finally:
+                task_queue.put(None)
+        
+        def write_results():
+            with open(stream_path, 'w') as f:
+                while (result := write_queue.get()) is not None:
+                    f.write(json.dumps(result) + "\n")
+                    f.flush()
+                    results.append(result)
+        
+        def drain(done):
+            for future in done:
+                filename, cache_key = futures.pop(future)
+                quality = future.result()
+                if quality is None:
+                    continue
+                if cache_key is not None:
+                    self.cache[cache_key] = quality
+                write_queue.put(_result_entry(filename, quality))
+        
+        reader = threading.Thread(target=read_tasks, daemon=True)
+        writer = threading.Thread(target=write_results, daemon=True)
+        reader.start()
+        writer.start()
+        
+        # 每个ffmpeg限定THREADS_PER_FFMPEG个线程，按核数开进程避免超额订阅
+        max_workers = max(1, (os.cpu_count() or 1) // THREADS_PER_FFMPEG)
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {}
+                while (item := task_queue.get()) is not None:
+                    task, cache_key = item
+                    filename = Path(task[0]).name
+                    if cache_key is not None and not force and cache_key in self.cache:
+                        write_queue.put(_result_entry(filename, self.cache[cache_key]))
+                        continue
                     
-                except Exception as e:
-                    logging.error(f"评估失败 {ref_file.name}: {e}")
+                    if len(futures) >= prefetch:
+                        done, _ = concurrent.futures.wait(
+                            futures, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        drain(done)
+                    futures[executor.submit(_assess_one, task)] = (filename, cache_key)
+                
+                drain(list(concurrent.futures.as_completed(futures)))
+        finally:
+            write_queue.put(None)
+            writer.join()
+            if self.cache is not None:
+                self.cache.sync()
         
         # 保存结果
         with open(output_file, 'w') as f:
             json.dump(results, f, indent=2)
         
-        # 计算统计信息
+        # 计算统计信息：结果一次性转为结构化数组，各列做掩码归约
         if results:
-            psnr_values = [r["psnr"] for r in results if r["psnr"] > 0]
-            ssim_values = [r["ssim"] for r in results if r["ssim"] > 0]
-            vmaf_values = [r["vmaf"] for r in results if r["vmaf"] > 0]
+            table = np.fromiter(
+                ((r["psnr"], r["ssim"], r["vmaf"], r["file_size_mb"], r["bitrate_kbps"]) for r in results),
+                dtype=RESULT_DTYPE,
+                count=len(results)
+            )
             
             stats = {
                 "total_files": len(results),
-                "average_psnr": np.mean(psnr_values) if psnr_values else 0,
-                "average_ssim": np.mean(ssim_values) if ssim_values else 0,
-                "average_vmaf": np.mean(vmaf_values) if vmaf_values else 0,
-                "min_file_size": min(r["file_size_mb"] for r in results),
-                "max_file_size": max(r["file_size_mb"] for r in results)
+                "average_psnr": _positive_mean(table["psnr"]),
+                "average_ssim": _positive_mean(table["ssim"]),
+                "average_vmaf": _positive_mean(table["vmaf"]),
+                "min_file_size": float(table["size"].min()),
+                "max_file_size": float(table["size"].max())
             }
             
             return {"results": results, "statistics": stats}
         
         return {"results": results, "statistics": {}}
 
+def _assess_one(task: Tuple[str, str, int]) -> Optional[QualityMetrics]:
+    """批量评估的进程池任务：评估一对(参考, 失真)文件，失败时返回None"""
+    reference, distorted, subsample = task
+    try:
+        assessor = VideoQualityAssessor(
+            subsample=subsample, threads=THREADS_PER_FFMPEG, cache_path=None
+        )
+        return assessor.assess_video_quality(reference, distorted)
+        
+    except Exception as e:
+        logging.error(f"评估失败 {Path(reference).name}: {e}")
+        return None
+
+def _result_entry(filename: str, metrics: QualityMetrics) -> Dict:
+    """批量评估结果条目"""
+    return {
+        "filename": filename,
+        "psnr": metrics.psnr,
+        "ssim": metrics.ssim,
+        "vmaf": metrics.vmaf,
+        "vmaf_p5": metrics.vmaf_p5,
+        "file_size_mb": metrics.file_size_mb,
+        "bitrate_kbps": metrics.bitrate_kbps,
+        "processing_time": metrics.processing_time
+    }
+
 class AudioQualityAssessor:
     """音频质量评估器"""
     
@@ -311,13 +547,12 @@ class QualityReportGenerator:
 
 # 使用示例
 if __name__ == "__main__":
-    assessor = VideoQualityAssessor()
-    
-    # 单个文件评估
-    metrics = assessor.assess_video_quality(
-        "reference.mp4",
-        "encoded.mp4"
-    )
+    # 单个文件评估，结果写入持久化缓存
+    with VideoQualityAssessor(cache_path=".vmaf_cache.db") as assessor:
+        metrics = assessor.assess_video_quality(
+            "reference.mp4",
+            "encoded.mp4"
+        )
     
     print("质量评估结果:")
     print(f"PSNR: {metrics.psnr:.2f} dB")
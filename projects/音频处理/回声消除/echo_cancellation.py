@@ -6,12 +6,15 @@
 
 import numpy as np
 import scipy.signal as signal
+from scipy.fft import rfft, irfft, next_fast_len
 import soundfile as sf
 from typing import List, Tuple, Optional, Dict
 from dataclasses import dataclass
 import matplotlib.pyplot as plt
 import logging
 import json
+import time
+from numba import njit
 
 @dataclass
 class EchoParameters:
@@ -20,90 +23,263 @@ class EchoParameters:
     attenuation: float
     delay_time_ms: float
 
+@njit(cache=True, fastmath=True, boundscheck=False)
+def _nlms_kernel(far: np.ndarray,
+                 near: np.ndarray,
+                 weights: np.ndarray,
+                 buf: np.ndarray,
+                 idx: int,
+                 mu: float,
+                 error: np.ndarray) -> int:
+    """逐样本NLMS，原地更新weights/buf并写入error，返回新的环形缓冲区索引
+    
+    buf为环形缓冲区，buf[(idx + i) % L]是i个样本之前的参考信号；
+    按回绕点拆成两段连续循环，避免内层取模
+    """
+    L = weights.shape[0]
+    for n in range(near.shape[0]):
+        idx = (idx - 1) % L
+        buf[idx] = far[n]
+        head = L - idx
+        
+        predicted = np.float32(0.0)
+        energy = np.float32(0.0)
+        for i in range(head):
+            predicted += weights[i] * buf[idx + i]
+            energy += buf[idx + i] * buf[idx + i]
+        for i in range(head, L):
+            predicted += weights[i] * buf[idx + i - L]
+            energy += buf[idx + i - L] * buf[idx + i - L]
+        
+        e = near[n] - predicted
+        error[n] = e
+        
+        step = np.float32(mu * e / (energy + 1e-10))
+        for i in range(head):
+            weights[i] += step * buf[idx + i]
+        for i in range(head, L):
+            weights[i] += step * buf[idx + i - L]
+    
+    return idx
+
 class AdaptiveEchoCanceler:
     """自适应回声消除器"""
     
-    def __init__(self, sample_rate: int = 16000, filter_length: int = 1024):
+    def __init__(self, 
+                 sample_rate: int = 16000, 
+                 filter_length: int = 1024,
+                 record_weights: bool = False,
+                 weight_snapshot_interval: int = 1000):
+        """record_weights=True时每weight_snapshot_interval个样本保存一次权重快照到weight_history，
+        仅用于调试：每个快照占filter_length*4字节，逐样本保存时2秒16kHz音频、1024抽头约需128MB
+        """
         self.sample_rate = sample_rate
         self.filter_length = filter_length
         self.mu = 0.001  # LMS步长
+        self.record_weights = record_weights
+        self.weight_snapshot_interval = max(1, weight_snapshot_interval)
         
+        # 滤波器状态统一使用FP32，NLMS在单精度下数值稳定
         # 自适应滤波器权重
-        self.weights = np.zeros(filter_length)
+        self.weights = np.zeros(filter_length, dtype=np.float32)
         
-        # 参考信号缓冲区
-        self.reference_buffer = np.zeros(filter_length)
+        # 参考信号环形缓冲区，reference_buffer[_buf_idx]为最新样本
+        self.reference_buffer = np.zeros(filter_length, dtype=np.float32)
+        self._buf_idx = 0
         
-        # 状态变量
-        self.error_history = []
-        self.weight_history = []
+        # 分块频域NLMS的上一块远端信号
+        self._block_history = np.zeros(filter_length, dtype=np.float32)
         
-    def lms_update(self, far_end: np.ndarray, near_end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        """LMS算法更新"""
-        output = np.zeros(len(near_end))
-        error = np.zeros(len(near_end))
+        # 状态变量：误差历史写入按需倍增的预分配数组
+        self._error_buf = np.empty(0, dtype=np.float32)
+        self._error_len = 0
+        self.weight_history = []
+    
+    @property
+    def error_history(self) -> np.ndarray:
+        """已记录的误差历史（内部缓冲区视图）"""
+        return self._error_buf[:self._error_len]
+    
+    def _error_slots(self, n: int, record: bool) -> np.ndarray:
+        """返回长度n的误差写入区，record=True时直接位于error_history缓冲区尾部"""
+        if not record:
+            return np.empty(n, dtype=np.float32)
+        
+        start = self._error_len
+        needed = start + n
+        if needed > len(self._error_buf):
+            grown = np.empty(max(needed, 2 * len(self._error_buf)), dtype=np.float32)
+            grown[:start] = self._error_buf[:start]
+            self._error_buf = grown
+        
+        self._error_len = needed
+        return self._error_buf[start:needed]
+        
+    def lms_update(self, 
+                   far_end: np.ndarray, 
+                   near_end: np.ndarray,
+                   record: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """LMS算法更新（NumPy逐样本实现）
+        
+        参考信号使用环形缓冲区，按回绕点拆成两段切片计算，循环内不分配新数组；
+        record=True时误差直接写入error_history缓冲区
+        """
+        L = self.filter_length
+        buf = self.reference_buffer
+        weights = self.weights
+        idx = self._buf_idx
+        far_end = np.ascontiguousarray(far_end, dtype=np.float32)
+        near_end = np.ascontiguousarray(near_end, dtype=np.float32)
+        
+        output = np.zeros(len(near_end), dtype=np.float32)
+        error = self._error_slots(len(near_end), record)
         
         for n in range(len(near_end)):
-            # 更新参考信号缓冲区
-            self.reference_buffer = np.roll(self.reference_buffer, 1)
-            self.reference_buffer[0] = far_end[n] if n < len(far_end) else 0
+            # 更新参考信号缓冲区，buf[idx:]和buf[:idx]依次对应weights[:head]和weights[head:]
+            idx = (idx - 1) % L
+            buf[idx] = far_end[n] if n < len(far_end) else 0
+            head = L - idx
             
             # 计算预测的回声
-            predicted_echo = np.dot(self.weights, self.reference_buffer)
+            predicted_echo = np.dot(weights[:head], buf[idx:]) + np.dot(weights[head:], buf[:idx])
             
             # 计算误差
             error[n] = near_end[n] - predicted_echo
             
             # LMS权重更新
-            norm = np.dot(self.reference_buffer, self.reference_buffer) + 1e-10
-            self.weights += self.mu * error[n] * self.reference_buffer / norm
+            norm = np.dot(buf, buf) + 1e-10
+            step = self.mu * error[n] / norm
+            weights[:head] += step * buf[idx:]
+            weights[head:] += step * buf[:idx]
             
             output[n] = error[n]
             
-            # 记录历史
-            self.error_history.append(error[n])
-            self.weight_history.append(self.weights.copy())
+            if self.record_weights and n % self.weight_snapshot_interval == 0:
+                self.weight_history.append(weights.copy())
+        
+        self._buf_idx = idx
         
         return output, error
     
-    def nlms_update(self, far_end: np.ndarray, near_end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        """归一化LMS算法更新"""
-        output = np.zeros(len(near_end))
-        error = np.zeros(len(near_end))
+    def nlms_update(self, 
+                    far_end: np.ndarray, 
+                    near_end: np.ndarray,
+                    block: bool = True,
+                    record: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """归一化LMS算法更新
+        
+        block=True时按滤波器长度分块在频域滤波和更新（分块频域NLMS），
+        block=False时逐样本更新；record=True时误差写入error_history
+        """
+        error = self._error_slots(len(near_end), record)
+        
+        if block:
+            self._block_nlms_update(far_end, near_end, error)
+            return error.copy(), error
+        
+        far = np.zeros(len(near_end), dtype=np.float32)
+        far[:min(len(near_end), len(far_end))] = far_end[:len(near_end)]
+        near = np.ascontiguousarray(near_end, dtype=np.float32)
+        
+        # 记录权重时按快照间隔分段调用内核
+        step = self.weight_snapshot_interval if self.record_weights else max(1, len(near))
+        for start in range(0, len(near), step):
+            stop = start + step
+            self._buf_idx = _nlms_kernel(
+                far[start:stop], near[start:stop], self.weights, self.reference_buffer,
+                self._buf_idx, self.mu, error[start:stop]
+            )
+            if self.record_weights:
+                self.weight_history.append(self.weights.copy())
         
-        for n in range(len(near_end)):
-            # 更新参考信号缓冲区
-            self.reference_buffer = np.roll(self.reference_buffer, 1)
-            self.reference_buffer[0] = far_end[n] if n < len(far_end) else 0
+        return error.copy(), error
+    
+    def _block_nlms_update(self, far_end: np.ndarray, near_end: np.ndarray, error: np.ndarray):
+        """分块频域NLMS（overlap-save，块长=滤波器长度L）
+        
+        每块用2L点FFT完成L个样本的滤波和梯度相关运算，权重保持在时域（梯度约束），
+        块内权重不变，收敛行为与逐样本NLMS近似
+        """
+        L = self.filter_length
+        N = len(near_end)
+        num_blocks = -(-N // L)
+        
+        # 远端不足近端长度时补零，与逐样本版本一致
+        far = np.zeros(num_blocks * L, dtype=np.float32)
+        far[:min(N, len(far_end))] = far_end[:N]
+        near = np.zeros(num_blocks * L, dtype=np.float32)
+        near[:N] = near_end
+        
+        # scipy.fft对float32输入保持单精度（numpy.fft会升为双精度）
+        padded_error = np.empty(num_blocks * L, dtype=np.float32)
+        zeros = np.zeros(L, dtype=np.float32)
+        prev = self._block_history
+        
+        for k in range(num_blocks):
+            x_blk = far[k * L:(k + 1) * L]
+            X = rfft(np.concatenate((prev, x_blk)))
+            W = rfft(np.concatenate((self.weights, zeros)))
             
-            # 计算预测的回声
-            predicted_echo = np.dot(self.weights, self.reference_buffer)
+            # overlap-save：后L点为线性卷积结果
+            y_blk = irfft(X * W, 2 * L)[L:]
+            e_blk = near[k * L:(k + 1) * L] - y_blk
+            padded_error[k * L:(k + 1) * L] = e_blk
             
-            # 计算误差
-            error[n] = near_end[n] - predicted_echo
+            # 梯度为误差与参考信号的互相关，前L点对应各抽头
+            E = rfft(np.concatenate((zeros, e_blk)))
+            grad = irfft(np.conj(X) * E, 2 * L)[:L]
             
-            # NLMS权重更新
-            norm = np.dot(self.reference_buffer, self.reference_buffer) + 1e-10
-            self.weights += (self.mu / norm) * error[n] * self.reference_buffer
+            # 2L点频谱的平均功率约为2倍的窗口能量||x||²
+            norm = np.mean(np.abs(X) ** 2) / 2 + 1e-10
+            self.weights += (self.mu / norm) * grad
             
-            output[n] = error[n]
+            # 块边界跨过快照间隔时保存一次
+            interval = self.weight_snapshot_interval
+            if self.record_weights and (k + 1) * L // interval > k * L // interval:
+                self.weight_history.append(self.weights.copy())
+            
+            prev = x_blk
         
-        return output, error
+        self._block_history = prev.copy()
+        error[:] = padded_error[:N]
+    
+    def apply(self, far_end: np.ndarray, workers: int = -1) -> np.ndarray:
+        """用当前（冻结的）权重估计整段回声
+        
+        分块overlap-save：信号切成hop为L、长2L的帧后整批FFT，各块互不依赖，
+        由scipy.fft按workers个线程并行处理（-1为全部核心）
+        """
+        L = self.filter_length
+        N = len(far_end)
+        num_blocks = -(-N // L)
+        if num_blocks == 0:
+            return np.zeros(0, dtype=np.float32)
+        
+        padded = np.zeros((num_blocks + 1) * L, dtype=np.float32)
+        padded[L:L + N] = far_end
+        frames = np.lib.stride_tricks.sliding_window_view(padded, 2 * L)[::L]
+        
+        W = rfft(self.weights, 2 * L)
+        spectra = rfft(frames, axis=1, workers=workers) * W
+        echo = irfft(spectra, 2 * L, axis=1, workers=workers)[:, L:]
+        return echo.reshape(-1)[:N]
     
     def get_convergence_metrics(self) -> Dict:
         """获取收敛指标"""
-        if not self.error_history:
+        error_array = self.error_history
+        if len(error_array) == 0:
             return {}
         
-        error_array = np.array(self.error_history)
-        
         # 计算MSE
         mse = np.mean(error_array**2)
         
         # 计算收敛时间（简单估计）
         window_size = 100
         if len(error_array) > window_size:
-            rolling_mse = np.convolve(error_array**2, np.ones(window_size)/window_size, mode='valid')
+            # 前缀和求滑动均值，与mode='valid'卷积等长；双精度累加避免长序列误差
+            cumulative = np.zeros(len(error_array) + 1)
+            np.cumsum(np.square(error_array, dtype=np.float64), out=cumulative[1:])
+            rolling_mse = (cumulative[window_size:] - cumulative[:-window_size]) / window_size
             
             # 找到稳定点（MSE变化小于阈值）
             threshold = 0.01 * np.max(rolling_mse)
@@ -129,21 +305,28 @@ class DelayEstimator:
         self.sample_rate = sample_rate
         self.max_delay = max_delay
         
+    def _bounded_correlation(self, far_end: np.ndarray, near_end: np.ndarray) -> np.ndarray:
+        """只计算0~max_delay范围内的互相关：corr[k] = sum(near[n+k] * far[n])
+        
+        FFT长度补零到N+max_delay以上，负延迟的循环混叠落在max_delay之外
+        """
+        n_fft = next_fast_len(max(len(far_end), len(near_end)) + self.max_delay)
+        X = rfft(far_end, n_fft)
+        Y = rfft(near_end, n_fft)
+        return irfft(Y * np.conj(X), n_fft)[:self.max_delay]
+    
     def estimate_delay(self, far_end: np.ndarray, near_end: np.ndarray) -> EchoParameters:
-        """估计回声延迟"""
+        """估计回声延迟（搜索范围0~max_delay样本）"""
         # 计算互相关
-        correlation = signal.correlate(near_end, far_end, mode='full')
-        
-        # 找到最大相关峰
-        max_index = np.argmax(np.abs(correlation))
+        correlation = self._bounded_correlation(far_end, near_end)
         
-        # 计算延迟
-        delay_samples = max_index - len(far_end) + 1
+        # 找到最大相关峰，下标即延迟
+        delay_samples = int(np.argmax(np.abs(correlation)))
         
         # 计算衰减
         if delay_samples > 0 and delay_samples < len(far_end):
-            attenuation = np.abs(correlation[max_index]) / np.sqrt(
-                np.sum(far_end**2) * np.sum(near_end**2)
+            attenuation = np.abs(correlation[delay_samples]) / np.sqrt(
+                np.dot(far_end, far_end) * np.dot(near_end, near_end)
             )
         else:
             attenuation = 0.0
@@ -158,8 +341,8 @@ class DelayEstimator:
     
     def visualize_delay_estimation(self, far_end: np.ndarray, near_end: np.ndarray):
         """可视化延迟估计"""
-        correlation = signal.correlate(near_end, far_end, mode='full')
-        delays = np.arange(-len(far_end) + 1, len(near_end))
+        correlation = self._bounded_correlation(far_end, near_end)
+        delays = np.arange(len(correlation))
         
         plt.figure(figsize=(12, 6))
         plt.subplot(2, 1, 1)
@@ -192,17 +375,24 @@ class EchoCancellationPipeline:
         """模拟回声信号"""
         delay_samples = int(delay_ms * self.sample_rate / 1000)
         
-        # 创建延迟信号
-        delayed = np.zeros(len(far_end) + delay_samples)
-        delayed[delay_samples:] = far_end * attenuation
-        
-        # 截取到原始长度
-        echo = delayed[:len(far_end)]
+        # 直接写入输出数组，延迟前的部分置零
+        far_end = np.asarray(far_end, dtype=np.float32)
+        delay_samples = min(delay_samples, len(far_end))
+        echo = np.empty_like(far_end)
+        echo[:delay_samples] = 0
+        np.multiply(far_end[:len(far_end) - delay_samples], attenuation, out=echo[delay_samples:])
         
         return echo
     
-    def cancel_echo(self, far_end: np.ndarray, near_end: np.ndarray) -> Dict:
-        """执行回声消除"""
+    def cancel_echo(self, 
+                    far_end: np.ndarray, 
+                    near_end: np.ndarray,
+                    learning_samples: Optional[int] = None) -> Dict:
+        """执行回声消除
+        
+        前learning_samples个样本（默认2倍滤波器长度）用NLMS自适应学习权重，
+        之后冻结权重，剩余部分直接用FIR卷积估计并减去回声
+        """
         
         # 估计延迟
         echo_params = self.delay_estimator.estimate_delay(far_end, near_end)
@@ -210,8 +400,18 @@ class EchoCancellationPipeline:
         # 执行回声消除
         start_time = time.time()
         
-        # 使用NLMS算法
-        output, error = self.canceler.nlms_update(far_end, near_end)
+        # 使用NLMS算法学习权重
+        if learning_samples is None:
+            learning_samples = 2 * self.canceler.filter_length
+        prefix = min(learning_samples, len(near_end))
+        output, error = self.canceler.nlms_update(far_end[:prefix], near_end[:prefix])
+        
+        # 冻结权重处理剩余部分，远端按近端长度截断或补零（与nlms_update一致）
+        if prefix < len(near_end):
+            far = np.zeros(len(near_end), dtype=np.float32)
+            far[:min(len(near_end), len(far_end))] = far_end[:len(near_end)]
+            echo_estimate = self.canceler.apply(far)[prefix:]
+            output = np.concatenate((output, near_end[prefix:] - echo_estimate))
         
         processing_time = time.time() - start_time
         
@@ -265,7 +465,7 @@ class EchoCancellationPipeline:
         residual_power = np.mean(output**2)
         
         # 计算收敛速度
-        error_history = np.array(self.canceler.error_history)
+        error_history = self.canceler.error_history
         if len(error_history) > 100:
             initial_error = np.mean(error_history[:100])
             final_error = np.mean(error_history[-100:])
@@ -309,8 +509,8 @@ class EchoCancellationPipeline:
         axes[1].grid(True)
         
         # 误差收敛
-        if self.canceler.error_history:
-            error_history = np.array(self.canceler.error_history)
+        error_history = self.canceler.error_history
+        if len(error_history) > 0:
             axes[2].plot(error_history**2)
             axes[2].set_title('误差收敛曲线')
             axes[2].set_ylabel('误差平方')
@@ -6,14 +6,19 @@
 
 import numpy as np
 import scipy.signal as signal
+import scipy.fft
 import soundfile as sf
 import logging
+import math
 from typing import List, Tuple, Optional, Dict
 from dataclasses import dataclass
 import threading
-import queue
 import time
 import json
+import os
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from numba import njit
 
 @dataclass
 class AudioConfig:
@@ -23,15 +28,80 @@ class AudioConfig:
     channels: int = 2
     dtype: str = 'float32'
     buffer_size: int = 10
+    cpu_affinity: Optional[List[int]] = None  # 处理线程绑定的CPU核
+    realtime_priority: Optional[int] = None   # SCHED_FIFO优先级，需要相应权限
+
+class SPSCRing:
+    """单生产者单消费者无锁环形缓冲区
+    
+    所有块缓冲区在构造时预分配，push/peek均不阻塞、不分配内存。
+    head只由生产者推进，tail只由消费者推进，先写槽位再发布索引，
+    单个int属性赋值在GIL下是原子的，因此无需互斥锁
+    """
+    
+    def __init__(self, capacity: int, chunk_size: int, dtype: str = 'float32'):
+        # 保留一个空槽区分满和空
+        self.capacity = capacity + 1
+        self.buf = np.zeros((self.capacity, chunk_size), dtype=dtype)
+        self.lengths = np.zeros(self.capacity, dtype=np.intp)
+        self.head = 0
+        self.tail = 0
+    
+    def push(self, chunk: np.ndarray) -> bool:
+        """写入一个块，缓冲区已满时返回False
+        
+        槽位是长chunk_size的一维数组，多维块或超过chunk_size的块抛出ValueError，
+        不会截断后静默丢弃多出的样本
+        """
+        if np.ndim(chunk) != 1 or len(chunk) > self.buf.shape[1]:
+            raise ValueError(
+                f"块形状{np.shape(chunk)}不符合槽位，需为长度不超过{self.buf.shape[1]}的一维数组"
+            )
+        
+        head = self.head
+        next_head = (head + 1) % self.capacity
+        if next_head == self.tail:
+            return False
+        
+        n = len(chunk)
+        self.buf[head, :n] = chunk
+        self.lengths[head] = n
+        self.head = next_head
+        return True
+    
+    def peek(self) -> Optional[np.ndarray]:
+        """返回最早写入块的视图，缓冲区为空时返回None；读完后调用advance释放"""
+        tail = self.tail
+        if tail == self.head:
+            return None
+        return self.buf[tail, :self.lengths[tail]]
+    
+    def advance(self):
+        """释放peek返回的块"""
+        self.tail = (self.tail + 1) % self.capacity
+    
+    def pop(self, out: np.ndarray) -> int:
+        """把最早写入的块拷贝到out，返回样本数，缓冲区为空时返回0"""
+        chunk = self.peek()
+        if chunk is None:
+            return 0
+        n = min(len(chunk), len(out))
+        out[:n] = chunk[:n]
+        self.advance()
+        return n
+    
+    def __len__(self) -> int:
+        return (self.head - self.tail) % self.capacity
 
 class RealTimeAudioProcessor:
     """实时音频处理器"""
     
     def __init__(self, config: AudioConfig):
         self.config = config
+        self.dtype = np.dtype(config.dtype)
         self.is_running = False
-        self.input_queue = queue.Queue(maxsize=config.buffer_size)
-        self.output_queue = queue.Queue(maxsize=config.buffer_size)
+        self.input_ring = SPSCRing(config.buffer_size, config.chunk_size, config.dtype)
+        self.output_ring = SPSCRing(config.buffer_size, config.chunk_size, config.dtype)
         self.processing_thread = None
         
         # 滤波器状态
@@ -42,7 +112,9 @@ class RealTimeAudioProcessor:
             'frames_processed': 0,
             'total_processing_time': 0.0,
             'average_latency': 0.0,
-            'peak_cpu_usage': 0.0
+            'peak_cpu_usage': 0.0,
+            'input_overruns': 0,   # 由生产者计数
+            'output_overruns': 0   # 由处理线程计数
         }
     
     def start_processing(self):
@@ -58,12 +130,47 @@ class RealTimeAudioProcessor:
         if self.processing_thread:
             self.processing_thread.join()
     
+    def push_audio(self, audio_data: np.ndarray) -> bool:
+        """生产者(音频回调)写入输入块，不阻塞，缓冲区满时丢弃并返回False
+        
+        audio_data须为长度不超过chunk_size的一维（单声道）块，否则抛出ValueError
+        """
+        if self.input_ring.push(audio_data):
+            return True
+        self.stats['input_overruns'] += 1
+        return False
+    
+    def pull_audio(self, out: np.ndarray) -> int:
+        """消费者(音频回调)取出处理结果到out，不阻塞，返回样本数"""
+        return self.output_ring.pop(out)
+    
+    def _configure_realtime_thread(self):
+        """按配置绑定CPU核并提升调度优先级，平台或权限不支持时仅记录日志"""
+        if self.config.cpu_affinity is not None:
+            try:
+                os.sched_setaffinity(0, self.config.cpu_affinity)
+            except (AttributeError, OSError) as e:
+                logging.warning(f"无法设置CPU亲和性: {e}")
+        
+        if self.config.realtime_priority is not None:
+            try:
+                os.sched_setscheduler(
+                    0, os.SCHED_FIFO, os.sched_param(self.config.realtime_priority)
+                )
+            except (AttributeError, OSError) as e:
+                logging.warning(f"无法设置实时调度优先级: {e}")
+    
     def _processing_loop(self):
         """处理循环"""
+        self._configure_realtime_thread()
+        
         while self.is_running:
             try:
                 # 获取输入数据
-                audio_data = self.input_queue.get(timeout=0.1)
+                audio_data = self.input_ring.peek()
+                if audio_data is None:
+                    time.sleep(0.001)
+                    continue
                 
                 start_time = time.time()
                 
@@ -81,12 +188,13 @@ class RealTimeAudioProcessor:
                         self.stats['total_processing_time'] / self.stats['frames_processed']
                     )
                 
-                # 输出结果
-                self.output_queue.put(processed_data)
+                # 输出结果，必须在释放输入槽位之前拷贝，处理结果可能是输入视图
+                if not self.output_ring.push(processed_data):
+                    self.stats['output_overruns'] += 1
+                self.input_ring.advance()
                 
-            except queue.Empty:
-                continue
             except Exception as e:
+                self.input_ring.advance()
                 logging.error(f"处理错误: {e}")
     
     def process_audio(self, audio_data: np.ndarray) -> np.ndarray:
@@ -104,9 +212,20 @@ class NoiseReductionProcessor(RealTimeAudioProcessor):
         super().__init__(config)
         self.noise_threshold = noise_threshold
         
+        # 离线并行处理时每块的长度(帧长的倍数)
+        self.parallel_chunk_frames = 64
+        
         # 设计降噪滤波器
         self.noise_gate = self._design_noise_gate()
         
+        # 持久化STFT参数，与signal.stft默认参数一致(256点周期Hann窗，50%重叠)，
+        # 窗函数、缩放系数和OLA归一化只计算一次
+        self.frame_size = 256
+        self.hop_size = 128
+        self.window = signal.windows.hann(self.frame_size, sym=False).astype(self.dtype)
+        self.window_scale = self.dtype.type(1.0 / self.window.sum())
+        self._ola_norm = {}
+        
         # 噪声频谱估计
         self.noise_profile = None
         self.noise_frames = 0
@@ -116,22 +235,60 @@ class NoiseReductionProcessor(RealTimeAudioProcessor):
         # 低通滤波器用于噪声检测
         nyquist = self.config.sample_rate / 2
         low_cutoff = 1000 / nyquist
-        b, a = signal.butter(4, low_cutoff, btype='low')
+        sos = signal.butter(4, low_cutoff, btype='low', output='sos').astype(self.dtype)
+        
+        return {'sos': sos, 'zi': signal.sosfilt_zi(sos).astype(self.dtype)}
+    
+    def _stft(self, audio_data: np.ndarray) -> np.ndarray:
+        """两端补半帧零后分帧做rfft，返回(频点, 帧)复数谱"""
+        pad = self.frame_size // 2
+        extended = len(audio_data) + 2 * pad
+        num_frames = max(1, -(-(extended - self.frame_size) // self.hop_size) + 1)
         
-        return {'b': b, 'a': a, 'zi': signal.lfilter_zi(b, a)}
+        buf = np.zeros((num_frames - 1) * self.hop_size + self.frame_size, dtype=self.dtype)
+        buf[pad:pad + len(audio_data)] = audio_data
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.frame_size)[::self.hop_size]
+        
+        spectrum = scipy.fft.rfft(frames * self.window, axis=1)
+        spectrum *= self.window_scale
+        return spectrum.T
+    
+    def _overlap_add(self, frames: np.ndarray) -> np.ndarray:
+        """帧长是hop的整数倍，按hop分段整块累加"""
+        num_frames = frames.shape[0]
+        segments = self.frame_size // self.hop_size
+        out = np.zeros((num_frames + segments - 1, self.hop_size), dtype=self.dtype)
+        parts = frames.reshape(num_frames, segments, self.hop_size)
+        for r in range(segments):
+            out[r:r + num_frames] += parts[:, r]
+        return out.ravel()
+    
+    def _istft(self, spectrum: np.ndarray, length: int) -> np.ndarray:
+        """加权重叠相加重构，返回长度为length的信号"""
+        num_frames = spectrum.shape[1]
+        frames = scipy.fft.irfft(spectrum.T, n=self.frame_size, axis=1)
+        frames *= self.window / self.window_scale
+        
+        norm = self._ola_norm.get(num_frames)
+        if norm is None:
+            squared = np.broadcast_to(self.window ** 2, frames.shape)
+            norm = self._ola_norm[num_frames] = self._overlap_add(squared)
+        
+        pad = self.frame_size // 2
+        ola = self._overlap_add(frames)[pad:pad + length]
+        norm = norm[pad:pad + length]
+        processed = np.zeros(length, dtype=self.dtype)
+        np.divide(ola, norm, out=processed[:len(ola)], where=norm > 1e-10)
+        return processed
     
     def estimate_noise_profile(self, noise_sample: np.ndarray):
         """估计噪声频谱"""
         # 使用STFT分析噪声频谱
-        f, t, Zxx = signal.stft(
-            noise_sample, 
-            fs=self.config.sample_rate, 
-            nperseg=256
-        )
+        Zxx = self._stft(noise_sample)
         
         # 计算平均噪声频谱
-        self.noise_profile = np.mean(np.abs(Zxx), axis=1)
-        self.noise_frames = len(t)
+        self.noise_profile = np.mean(np.abs(Zxx), axis=1).astype(self.dtype)
+        self.noise_frames = Zxx.shape[1]
     
     def process_audio(self, audio_data: np.ndarray) -> np.ndarray:
         """降噪处理"""
@@ -139,60 +296,239 @@ class NoiseReductionProcessor(RealTimeAudioProcessor):
             return audio_data
         
         # 应用频谱减法
-        f, t, Zxx = signal.stft(
-            audio_data, 
-            fs=self.config.sample_rate, 
-            nperseg=256
-        )
+        Zxx = self._stft(audio_data)
         
-        # 计算增益因子
+        # 频谱减法，折算成实数增益原地作用于复数谱，相位自然保留
         magnitude = np.abs(Zxx)
-        phase = np.angle(Zxx)
-        
-        # 频谱减法
-        gain = np.maximum(0, magnitude - self.noise_profile[:, np.newaxis])
+        magnitude += 1e-12
+        gain = self.noise_profile[:, np.newaxis] / magnitude
+        np.subtract(1, gain, out=gain)
+        np.maximum(gain, 0, out=gain)
+        Zxx *= gain
         
         # 重构信号
-        enhanced_Zxx = gain * np.exp(1j * phase)
-        _, processed = signal.istft(enhanced_Zxx, fs=self.config.sample_rate)
+        return self._istft(Zxx, len(audio_data))
+    
+    def process_parallel(self, audio_data: np.ndarray, executor: ThreadPoolExecutor) -> np.ndarray:
+        """离线整段降噪，按块并行
         
-        return processed
+        每块两侧各多带一帧重叠，块起点对齐hop，块内部的帧与整段STFT完全一致，
+        只保留中间部分拼接。降噪没有跨块状态，rfft/irfft释放GIL，线程可以并行
+        """
+        if self.noise_profile is None:
+            return audio_data
+        
+        chunk = self.frame_size * self.parallel_chunk_frames
+        overlap = self.frame_size
+        if len(audio_data) <= chunk:
+            return self.process_audio(audio_data)
+        
+        def process_chunk(start):
+            lo = max(0, start - overlap)
+            hi = min(len(audio_data), start + chunk + overlap)
+            processed = self.process_audio(audio_data[lo:hi])
+            return processed[start - lo:start - lo + chunk]
+        
+        return np.concatenate(list(executor.map(process_chunk, range(0, len(audio_data), chunk))))
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _nlms_kernel(x: np.ndarray,
+                 w: np.ndarray,
+                 ref: np.ndarray,
+                 idx: int,
+                 mu: float,
+                 out: np.ndarray) -> int:
+    """逐样本NLMS回声消除，原地更新w/ref并写入out，返回新的环形缓冲区索引
+    
+    ref为长度2L的镜像环形缓冲区，每个样本同时写入idx和idx+L，
+    ref[idx:idx + L]始终连续，ref[idx + k]是k个样本之前的输入
+    """
+    L = w.shape[0]
+    for n in range(x.shape[0]):
+        idx = (idx - 1) % L
+        ref[idx] = x[n]
+        ref[idx + L] = x[n]
+        view = ref[idx:idx + L]
+        
+        # 计算预测的回声和参考信号能量
+        y = 0.0
+        norm = 0.0
+        for k in range(L):
+            r = view[k]
+            y += w[k] * r
+            norm += r * r
+        
+        # 消除回声
+        e = x[n] - y
+        out[n] = e
+        
+        # 更新自适应滤波器 (NLMS算法)
+        if norm > 0:
+            step = mu * e / norm
+            for k in range(L):
+                w[k] += step * view[k]
+    
+    return idx
+
+@njit(cache=True, fastmath=True, nogil=True, boundscheck=False)
+def _block_nlms_kernel(x: np.ndarray,
+                       w: np.ndarray,
+                       ref: np.ndarray,
+                       idx: int,
+                       mu: float,
+                       block: int,
+                       gradient: np.ndarray,
+                       out: np.ndarray) -> int:
+    """块NLMS回声消除，缓冲区约定与_nlms_kernel相同
+    
+    块内权重保持不变(延迟更新)，点积之间没有写后读依赖，可以向量化；
+    块结束时按累计梯度和块内总能量更新一次，步长与逐样本NLMS的累计步长相当
+    """
+    L = w.shape[0]
+    for start in range(0, x.shape[0], block):
+        stop = min(start + block, x.shape[0])
+        gradient[:] = 0.0
+        norm = 0.0
+        
+        for n in range(start, stop):
+            idx = (idx - 1) % L
+            ref[idx] = x[n]
+            ref[idx + L] = x[n]
+            view = ref[idx:idx + L]
+            
+            # 计算预测的回声和参考信号能量
+            y = 0.0
+            for k in range(L):
+                r = view[k]
+                y += w[k] * r
+                norm += r * r
+            
+            # 消除回声并累计梯度
+            e = x[n] - y
+            out[n] = e
+            for k in range(L):
+                gradient[k] += e * view[k]
+        
+        # 块末统一更新自适应滤波器
+        if norm > 0:
+            step = mu * (stop - start) / norm
+            for k in range(L):
+                w[k] += step * gradient[k]
+    
+    return idx
 
 class EchoCancellationProcessor(RealTimeAudioProcessor):
     """回声消除处理器"""
     
-    def __init__(self, config: AudioConfig, filter_length: int = 256):
+    # 频域分块自适应滤波的频点功率平滑系数
+    FDAF_POWER_SMOOTHING = 0.9
+    
+    def __init__(self, config: AudioConfig, filter_length: int = 256, block_size: int = 1,
+                 method: str = 'auto'):
         super().__init__(config)
         self.filter_length = filter_length
-        self.adaptive_filter = np.zeros(filter_length)
+        self.adaptive_filter = np.zeros(filter_length, dtype=self.dtype)
         self.step_size = 0.01
         
-        # 参考信号缓冲区
-        self.reference_buffer = np.zeros(filter_length)
+        # 'fdaf'为频域分块自适应滤波，'nlms'为时域逐样本/块NLMS内核；
+        # 'auto'在长滤波器(>=512抽头)时选fdaf，短滤波器时JIT内核更快
+        if method == 'auto':
+            method = 'fdaf' if filter_length >= 512 else 'nlms'
+        self.method = method
+        self._history = np.zeros(filter_length, dtype=self.dtype)
+        self._power = np.zeros(filter_length + 1)
+        # 当前未满的块：已到达的样本、对应误差和样本数，凑满L个样本才自适应
+        self._block = np.zeros(filter_length, dtype=self.dtype)
+        self._block_error = np.zeros(filter_length, dtype=self.dtype)
+        self._block_fill = 0
+        
+        # block_size > 1时使用块NLMS(延迟更新)，收敛稍慢但内层循环可以向量化
+        self.block_size = block_size
+        self._gradient = np.zeros(filter_length, dtype=self.dtype)
+        
+        # 参考信号镜像环形缓冲区，reference_buffer[buffer_index]为最新样本
+        self.reference_buffer = np.zeros(2 * filter_length, dtype=self.dtype)
         self.buffer_index = 0
+        
+        # 预热JIT，避免实时回调中首次调用触发编译
+        empty = np.zeros(0, dtype=self.dtype)
+        _nlms_kernel(empty, self.adaptive_filter, self.reference_buffer, 0, self.step_size, empty)
+        if block_size > 1:
+            _block_nlms_kernel(empty, self.adaptive_filter, self.reference_buffer, 0,
+                               self.step_size, block_size, self._gradient, empty)
     
-    def process_audio(self, audio_data: np.ndarray) -> np.ndarray:
-        """回声消除处理"""
-        processed = np.zeros_like(audio_data)
+    def _process_fdaf(self, samples: np.ndarray, processed: np.ndarray):
+        """频域分块自适应滤波(overlap-save，块长=滤波器长度L)
+        
+        每块用2L点rfft完成L个样本的滤波和梯度互相关，权重保持在时域(梯度约束)。
+        步长按频点归一化：_power为各频点|X_k|²的指数平滑，更新量为step_size*conj(X)E/P_k，
+        有色输入下各频点收敛速度一致且不会发散。
+        块边界按累计样本数划分、与回调长度无关：不足一块的样本先用当前权重滤波输出，
+        暂存在_block中，凑满L个样本后才更新权重，因此任意分块调用与整段处理结果一致
+        (仅有浮点舍入差异)。_history保存上一个完整块
+        """
+        L = self.filter_length
+        zeros = np.zeros(L, dtype=self.dtype)
+        W = scipy.fft.rfft(np.concatenate((self.adaptive_filter, zeros)))
+        block = self._block
+        fill = self._block_fill
         
-        for i, sample in enumerate(audio_data):
-            # 更新参考信号缓冲区
-            self.reference_buffer = np.roll(self.reference_buffer, 1)
-            self.reference_buffer[0] = sample
+        pos = 0
+        while pos < len(samples):
+            n = min(L - fill, len(samples) - pos)
+            block[fill:fill + n] = samples[pos:pos + n]
+            block[fill + n:] = 0
+            X = scipy.fft.rfft(np.concatenate((self._history, block)))
             
-            # 计算预测的回声
-            predicted_echo = np.dot(self.reference_buffer, self.adaptive_filter)
+            # overlap-save：后L点为线性卷积结果，块内尚未到达的样本为零不影响已到达部分
+            y = scipy.fft.irfft(X * W, 2 * L)[L + fill:L + fill + n]
+            e = samples[pos:pos + n] - y
+            processed[pos:pos + n] = e
+            self._block_error[fill:fill + n] = e
+            fill += n
+            pos += n
+            if fill < L:
+                break
             
-            # 消除回声
-            error = sample - predicted_echo
-            processed[i] = error
+            # 平滑各频点功率(首块直接取当前功率，避免从零起步时步长过大)，
+            # 加上平均功率的小比例作正则，避免空频点除零
+            block_power = np.abs(X) ** 2
+            if self._power.any():
+                self._power *= self.FDAF_POWER_SMOOTHING
+                self._power += (1 - self.FDAF_POWER_SMOOTHING) * block_power
+            else:
+                self._power[:] = block_power
+            power = self._power + 1e-3 * np.mean(self._power) + 1e-12
             
-            # 更新自适应滤波器 (NLMS算法)
-            norm = np.dot(self.reference_buffer, self.reference_buffer)
-            if norm > 0:
-                self.adaptive_filter += (
-                    self.step_size * error * self.reference_buffer / norm
-                )
+            # 归一化梯度为误差与参考信号的互相关，只保留前L点(梯度约束)
+            E = scipy.fft.rfft(np.concatenate((zeros, self._block_error)))
+            gradient = scipy.fft.irfft(np.conj(X) * E / power, 2 * L)[:L]
+            self.adaptive_filter += self.step_size * gradient
+            W = scipy.fft.rfft(np.concatenate((self.adaptive_filter, zeros)))
+            
+            self._history[:] = block
+            fill = 0
+        
+        self._block_fill = fill
+    
+    def process_audio(self, audio_data: np.ndarray) -> np.ndarray:
+        """回声消除处理"""
+        samples = np.ascontiguousarray(audio_data, dtype=self.dtype)
+        processed = np.empty_like(samples)
+        
+        if self.method == 'fdaf':
+            self._process_fdaf(samples, processed)
+        elif self.block_size > 1:
+            self.buffer_index = _block_nlms_kernel(
+                samples, self.adaptive_filter, self.reference_buffer,
+                self.buffer_index, self.step_size, self.block_size,
+                self._gradient, processed
+            )
+        else:
+            self.buffer_index = _nlms_kernel(
+                samples, self.adaptive_filter, self.reference_buffer,
+                self.buffer_index, self.step_size, processed
+            )
         
         return processed
 
@@ -219,78 +555,79 @@ class AudioEnhancementProcessor(RealTimeAudioProcessor):
             'release': 100.0,    # ms
             'makeup_gain': 0.0   # dB
         }
+        self._update_compressor()
         
-        # 设计均衡器滤波器
-        self.eq_filters = self._design_eq_filters()
+        # 设计均衡器滤波器，各频段合并为二阶节矩阵，状态跨块保留
+        self.eq_sos = self._design_eq_filters()
+        self.eq_zi = None
     
-    def _design_eq_filters(self) -> List[Dict]:
-        """设计均衡器滤波器"""
-        filters = []
-        nyquist = self.config.sample_rate / 2
+    def _design_eq_filters(self, bands: Optional[List[Dict]] = None) -> np.ndarray:
+        """设计均衡器滤波器，返回(频段数, 6)的二阶节矩阵，所有频段一次向量化计算"""
+        if bands is None:
+            bands = self.eq_bands
+        freqs = np.array([band['freq'] for band in bands], dtype=np.float64)
+        gains = np.array([band['gain'] for band in bands], dtype=np.float64)
         
-        for band in self.eq_bands:
-            # 使用二阶峰值滤波器
-            w0 = 2 * np.pi * band['freq'] / self.config.sample_rate
-            alpha = np.sin(w0) / (2 * 1.0)  # Q=1
-            
-            # 计算滤波器系数
-            A = 10**(band['gain'] / 40)
-            b0 = 1 + alpha * A
-            b1 = -2 * np.cos(w0)
-            b2 = 1 - alpha * A
-            a0 = 1 + alpha / A
-            a1 = -2 * np.cos(w0)
-            a2 = 1 - alpha / A
-            
-            # 归一化
-            b = [b0 / a0, b1 / a0, b2 / a0]
-            a = [1, a1 / a0, a2 / a0]
-            
-            filters.append({
-                'b': b,
-                'a': a,
-                'zi': signal.lfilter_zi(b, a)
-            })
+        # 使用二阶峰值滤波器
+        w0 = 2 * np.pi * freqs / self.config.sample_rate
+        alpha = np.sin(w0) / (2 * 1.0)  # Q=1
+        cos_w0 = np.cos(w0)
+        
+        # 计算滤波器系数
+        A = 10**(gains / 40)
+        a0 = 1 + alpha / A
         
-        return filters
+        # 归一化
+        sections = np.empty((len(bands), 6), dtype=self.dtype)
+        sections[:, 0] = (1 + alpha * A) / a0
+        sections[:, 1] = -2 * cos_w0 / a0
+        sections[:, 2] = (1 - alpha * A) / a0
+        sections[:, 3] = 1
+        sections[:, 4] = -2 * cos_w0 / a0
+        sections[:, 5] = (1 - alpha / A) / a0
+        return sections
     
     def set_eq_gain(self, band_index: int, gain: float):
-        """设置EQ增益"""
+        """设置EQ增益，只重算对应频段的二阶节，滤波器状态保留"""
         if 0 <= band_index < len(self.eq_bands):
-            self.eq_bands[band_index]['gain'] = gain
-            self.eq_filters = self._design_eq_filters()
+            band = self.eq_bands[band_index]
+            band['gain'] = gain
+            self.eq_sos[band_index] = self._design_eq_filters([band])[0]
+    
+    def _update_compressor(self):
+        """把压缩器参数换算到线性域，热路径中不再做log10/10**运算"""
+        self._threshold_linear = 10**(self.compressor['threshold'] / 20)
+        self._slope = 1.0 / self.compressor['ratio'] - 1.0
+        self._makeup_linear = 10**(self.compressor['makeup_gain'] / 20)
+    
+    def set_compressor(self, **params):
+        """设置压缩器参数"""
+        self.compressor.update(params)
+        self._update_compressor()
     
     def apply_compression(self, audio_data: np.ndarray) -> np.ndarray:
-        """应用动态压缩"""
+        """应用动态压缩，原地修改audio_data"""
         # 计算RMS电平
-        rms_level = np.sqrt(np.mean(audio_data**2))
-        rms_db = 20 * np.log10(rms_level + 1e-10)
+        rms_level = np.sqrt(np.dot(audio_data, audio_data) / max(len(audio_data), 1))
         
-        # 计算增益衰减
-        if rms_db > self.compressor['threshold']:
-            excess = rms_db - self.compressor['threshold']
-            gain_reduction = excess * (1 - 1/self.compressor['ratio'])
-            
-            # 应用平滑的增益控制
-            gain = 10**((-gain_reduction + self.compressor['makeup_gain']) / 20)
+        # 超过阈值时按线性域增益衰减：(rms/阈值)^(1/ratio - 1)，等价于dB域的
+        # -(rms_db - threshold) * (1 - 1/ratio)
+        if rms_level > self._threshold_linear:
+            gain = (rms_level / self._threshold_linear) ** self._slope * self._makeup_linear
             audio_data *= gain
         
-        return np.clip(audio_data, -1.0, 1.0)
+        return np.clip(audio_data, -1.0, 1.0, out=audio_data)
     
     def process_audio(self, audio_data: np.ndarray) -> np.ndarray:
         """音频增强处理"""
-        processed = audio_data.copy()
-        
-        # 应用均衡器
-        for filter_info in self.eq_filters:
-            processed, _ = signal.lfilter(
-                filter_info['b'], 
-                filter_info['a'], 
-                processed, 
-                zi=filter_info['zi'] * processed[0]
-            )
+        processed = np.asarray(audio_data, dtype=self.dtype)
+        
+        # 应用均衡器，首块按首样本稳态初始化，之后沿用上一块的滤波器状态
+        if self.eq_zi is None:
+            self.eq_zi = (signal.sosfilt_zi(self.eq_sos) * processed[0]).astype(self.dtype)
+        processed, self.eq_zi = signal.sosfilt(self.eq_sos, processed, zi=self.eq_zi)
         
-        # 应用压缩器
+        # 应用压缩器，sosfilt的输出是新数组，可以原地压缩
         processed = self.apply_compression(processed)
         
         return processed
@@ -318,18 +655,32 @@ class AudioProcessorPipeline:
         """处理音频文件"""
         try:
             # 读取音频文件
-            audio_data, sample_rate = sf.read(input_file)
+            audio_data, sample_rate = sf.read(input_file, dtype=self.config.dtype)
             
-            # 确保采样率匹配
+            # 确保采样率匹配，多相FIR重采样，按列同时处理各声道
             if sample_rate != self.config.sample_rate:
-                from scipy.signal import resample
-                new_length = int(len(audio_data) * self.config.sample_rate / sample_rate)
-                audio_data = resample(audio_data, new_length)
+                g = math.gcd(sample_rate, self.config.sample_rate)
+                audio_data = signal.resample_poly(
+                    audio_data, self.config.sample_rate // g, sample_rate // g, axis=0
+                ).astype(self.config.dtype, copy=False)
             
-            # 处理音频
-            processed = audio_data
-            for processor in self.processors:
-                processed = processor.process_audio(processed)
+            # 处理音频，各声道独立的处理链并行运行
+            if audio_data.ndim == 1:
+                channels = [audio_data]
+            else:
+                channels = list(audio_data.T)
+            chains = [self.processors] + [
+                copy.deepcopy(self.processors) for _ in channels[1:]
+            ]
+            
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as chunk_executor, \
+                    ThreadPoolExecutor(max_workers=len(channels)) as channel_executor:
+                results = list(channel_executor.map(
+                    lambda args: self._process_channel(*args, chunk_executor),
+                    zip(channels, chains)
+                ))
+            
+            processed = results[0] if audio_data.ndim == 1 else np.stack(results, axis=1)
             
             # 保存处理后的音频
             sf.write(output_file, processed, self.config.sample_rate)
@@ -348,6 +699,15 @@ class AudioProcessorPipeline:
                 'error': str(e)
             }
     
+    def _process_channel(self, samples: np.ndarray, chain: List[RealTimeAudioProcessor],
+                         executor: ThreadPoolExecutor) -> np.ndarray:
+        """单声道整段处理：降噪按块并行，回声消除和均衡器带跨样本状态，顺序执行"""
+        noise_reduction, *stateful = chain
+        processed = noise_reduction.process_parallel(np.ascontiguousarray(samples), executor)
+        for processor in stateful:
+            processed = processor.process_audio(processed)
+        return processed
+    
     def process_real_time(self, input_device: int = None, output_device: int = None):
         """实时处理"""
         import sounddevice as sd
@@ -6,12 +6,80 @@
 
 import numpy as np
 import scipy.signal as signal
+import scipy.fft
 import soundfile as sf
 import matplotlib.pyplot as plt
 from typing import List, Tuple, Optional, Dict
 from dataclasses import dataclass
 import logging
+import math
+import atexit
 import json
+import os
+import time
+import pickle
+from collections import OrderedDict
+from numba import njit
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+try:
+    import cupy as cp
+    import cupyx.scipy.signal as cp_signal
+except ImportError:
+    cp = None
+
+# FFTW_MEASURE规划结果的磁盘缓存，避免每次启动重新测量
+FFTW_WISDOM_PATH = os.path.expanduser('~/.cache/fftw_wisdom.pkl')
+
+# 每个分帧器保留的FFTW计划数（按帧数LRU淘汰）
+FFTW_PLAN_CACHE_SIZE = 4
+
+# 同一帧数第几次stft起改用FFTW_MEASURE，之前用FFTW_ESTIMATE避免一次性长度付出测量开销
+FFTW_MEASURE_AFTER = 2
+
+# 本进程是否产生过新的MEASURE wisdom，退出时才需要写盘
+_fftw_wisdom_dirty = False
+
+def _load_fftw_wisdom():
+    try:
+        with open(FFTW_WISDOM_PATH, 'rb') as f:
+            pyfftw.import_wisdom(pickle.load(f))
+    except (OSError, pickle.PickleError, EOFError):
+        pass
+
+def _save_fftw_wisdom():
+    if not _fftw_wisdom_dirty:
+        return
+    try:
+        os.makedirs(os.path.dirname(FFTW_WISDOM_PATH), exist_ok=True)
+        with open(FFTW_WISDOM_PATH, 'wb') as f:
+            pickle.dump(pyfftw.export_wisdom(), f)
+    except OSError as e:
+        logging.warning(f"保存FFTW wisdom失败: {e}")
+
+if pyfftw is not None:
+    _load_fftw_wisdom()
+    atexit.register(_save_fftw_wisdom)
+
+def _aligned_empty(shape, dtype, alignment: int = 32) -> np.ndarray:
+    """按alignment字节对齐分配数组，供FFT输入输出使用(AVX2需要32字节对齐)"""
+    if pyfftw is not None:
+        return pyfftw.empty_aligned(shape, dtype=dtype, n=alignment)
+    
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = -raw.ctypes.data % alignment
+    return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+def _aligned_zeros(shape, dtype, alignment: int = 32) -> np.ndarray:
+    buf = _aligned_empty(shape, dtype, alignment)
+    buf[...] = 0
+    return buf
 
 @dataclass
 class NoiseProfile:
@@ -22,14 +90,175 @@ class NoiseProfile:
     zero_crossing_rate: float
     spectral_bandwidth: float
 
+def _overlap_add(frames: np.ndarray, hop: int, out: np.ndarray):
+    """把(帧数, 帧长)的帧按hop重叠累加到out
+    
+    帧长是hop整数倍时按hop分段整块累加，否则逐帧累加
+    """
+    num_frames, frame_size = frames.shape
+    
+    if frame_size % hop == 0:
+        segments = frame_size // hop
+        blocks = out[:(num_frames + segments - 1) * hop].reshape(-1, hop)
+        parts = frames.reshape(num_frames, segments, hop)
+        for r in range(segments):
+            blocks[r:r + num_frames] += parts[:, r]
+    else:
+        for i in range(num_frames):
+            out[i * hop:i * hop + frame_size] += frames[i]
+
+class STFTFramer:
+    """持久化STFT/ISTFT分帧器
+    
+    Hann窗和缩放系数只计算一次，补零缓冲区跨调用复用，帧矩阵是缓冲区的跨步视图，
+    正反变换整批交给scipy.fft并行计算。边界补零和幅度缩放与scipy.signal.stft一致，
+    istft使用与stft相同的hop做加权重叠相加。默认float32，rfft直接产出complex64。
+    安装了pyfftw时按帧数建立批量计划并LRU缓存：新帧数先用FFTW_ESTIMATE，
+    同一帧数重复出现后再用FFTW_MEASURE重新规划；未安装时使用pocketfft
+    """
+    
+    def __init__(self, frame_size: int, hop_size: int, dtype=np.float32):
+        self.frame_size = frame_size
+        self.hop_size = hop_size
+        self.dtype = np.dtype(dtype)
+        self.window = signal.windows.hann(frame_size, sym=False).astype(self.dtype)
+        self.scale = self.dtype.type(1.0 / self.window.sum())
+        
+        self._padded = _aligned_zeros(0, self.dtype)
+        self._windowed = _aligned_zeros((0, frame_size), self.dtype)
+        self._ola = _aligned_zeros(0, self.dtype)
+        self._norm = _aligned_zeros(0, self.dtype)
+        self._norm_frames = -1
+        
+        # 帧数 -> (正变换计划, 逆变换计划, 是否MEASURE)，最近使用的在末尾
+        self._fftw_plans = OrderedDict()
+        # 帧数 -> stft请求次数，只保留最近的若干个帧数
+        self._fftw_requests = OrderedDict()
+    
+    def _get_fftw_plans(self, num_frames: int, count_request: bool = False):
+        """取帧数对应的计划；count_request=True（stft调用）时记一次请求，
+        达到FFTW_MEASURE_AFTER次且当前是ESTIMATE计划时用MEASURE重新规划"""
+        global _fftw_wisdom_dirty
+        
+        requests = self._fftw_requests.pop(num_frames, 0) + count_request
+        self._fftw_requests[num_frames] = requests
+        if len(self._fftw_requests) > 16 * FFTW_PLAN_CACHE_SIZE:
+            self._fftw_requests.popitem(last=False)
+        
+        measure = requests >= FFTW_MEASURE_AFTER
+        plans = self._fftw_plans.get(num_frames)
+        if plans is not None and (plans[2] or not measure):
+            self._fftw_plans.move_to_end(num_frames)
+            return plans[:2]
+        
+        complex_dtype = np.result_type(self.dtype, np.complex64)
+        shape = (num_frames, self.frame_size)
+        spectrum_shape = (num_frames, self.frame_size // 2 + 1)
+        threads = os.cpu_count() or 1
+        flag = 'FFTW_MEASURE' if measure else 'FFTW_ESTIMATE'
+        
+        forward = pyfftw.FFTW(
+            pyfftw.empty_aligned(shape, dtype=self.dtype),
+            pyfftw.empty_aligned(spectrum_shape, dtype=complex_dtype),
+            axes=(1,), direction='FFTW_FORWARD',
+            flags=(flag,), threads=threads
+        )
+        inverse = pyfftw.FFTW(
+            pyfftw.empty_aligned(spectrum_shape, dtype=complex_dtype),
+            pyfftw.empty_aligned(shape, dtype=self.dtype),
+            axes=(1,), direction='FFTW_BACKWARD',
+            flags=(flag, 'FFTW_DESTROY_INPUT'), threads=threads
+        )
+        self._fftw_plans.pop(num_frames, None)
+        self._fftw_plans[num_frames] = (forward, inverse, measure)
+        if len(self._fftw_plans) > FFTW_PLAN_CACHE_SIZE:
+            self._fftw_plans.popitem(last=False)
+        _fftw_wisdom_dirty |= measure
+        return forward, inverse
+    
+    def _num_frames(self, length: int) -> int:
+        extended = length + 2 * (self.frame_size // 2)
+        return max(1, -(-(extended - self.frame_size) // self.hop_size) + 1)
+    
+    def _buffer_length(self, num_frames: int) -> int:
+        return (num_frames - 1) * self.hop_size + self.frame_size
+    
+    def stft(self, audio_data: np.ndarray) -> np.ndarray:
+        """返回(频点, 帧)复数谱，布局与scipy.signal.stft的Zxx相同"""
+        pad = self.frame_size // 2
+        num_frames = self._num_frames(len(audio_data))
+        total = self._buffer_length(num_frames)
+        
+        if len(self._padded) < total:
+            self._padded = _aligned_zeros(total, self.dtype)
+        buf = self._padded[:total]
+        buf[:pad] = 0
+        buf[pad:pad + len(audio_data)] = audio_data
+        buf[pad + len(audio_data):] = 0
+        
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.frame_size)[::self.hop_size]
+        if pyfftw is not None:
+            forward, _ = self._get_fftw_plans(num_frames, count_request=True)
+            np.multiply(frames, self.window, out=forward.input_array)
+            spectrum = forward() * self.scale
+        else:
+            if len(self._windowed) < num_frames:
+                self._windowed = _aligned_empty((num_frames, self.frame_size), self.dtype)
+            windowed = self._windowed[:num_frames]
+            np.multiply(frames, self.window, out=windowed)
+            spectrum = scipy.fft.rfft(windowed, axis=1, workers=-1, overwrite_x=True)
+            spectrum *= self.scale
+        return spectrum.T
+    
+    def istft(self, spectrum: np.ndarray, length: int) -> np.ndarray:
+        """加权重叠相加重构，返回长度为length的信号"""
+        num_frames = spectrum.shape[1]
+        total = self._buffer_length(num_frames)
+        
+        if pyfftw is not None:
+            _, inverse = self._get_fftw_plans(num_frames)
+            inverse.input_array[:] = spectrum.T
+            frames = inverse()
+        else:
+            frames = scipy.fft.irfft(spectrum.T, n=self.frame_size, axis=1, workers=-1)
+        frames *= self.window / self.scale
+        
+        if len(self._ola) < total:
+            self._ola = _aligned_zeros(total, self.dtype)
+        ola = self._ola[:total]
+        ola[:] = 0
+        _overlap_add(frames, self.hop_size, ola)
+        
+        # 窗平方和只与帧数有关，帧数不变时复用
+        if self._norm_frames != num_frames:
+            squared = np.broadcast_to(self.window ** 2, frames.shape)
+            self._norm = _aligned_zeros(total, self.dtype)
+            _overlap_add(squared, self.hop_size, self._norm)
+            self._norm_frames = num_frames
+        
+        pad = self.frame_size // 2
+        end = min(pad + length, total)
+        processed = _aligned_zeros(length, self.dtype)
+        norm = self._norm[pad:end]
+        np.divide(ola[pad:end], norm, out=processed[:end - pad], where=norm > 1e-10)
+        return processed
+
 class SpectralSubtraction:
     """频谱减法降噪"""
     
-    def __init__(self, sample_rate: int = 44100, frame_size: int = 2048, overlap: int = 0.75):
+    def __init__(self, sample_rate: int = 44100, frame_size: int = 2048, overlap: int = 0.75,
+                 use_gpu: bool = False):
         self.sample_rate = sample_rate
         self.frame_size = frame_size
         self.hop_size = int(frame_size * (1 - overlap))
         self.overlap = overlap
+        self.framer = STFTFramer(frame_size, self.hop_size)
+        
+        # GPU后端(离线批处理)，需要CuPy
+        self.use_gpu = use_gpu and cp is not None
+        if use_gpu and cp is None:
+            logging.warning("未安装CuPy，频谱减法使用CPU")
+        self._stream = cp.cuda.Stream(non_blocking=True) if self.use_gpu else None
         
         # 噪声估计参数
         self.noise_profile = None
@@ -37,15 +266,13 @@ class SpectralSubtraction:
         self.alpha = 1.0  # 过减因子
         self.beta = 0.002  # 频谱下限
         
+        # 噪声幅度谱(列向量)，在estimate_noise中计算一次；alpha/beta在process中即时应用
+        self._noise_sqrt = None
+        
     def estimate_noise(self, noise_sample: np.ndarray) -> NoiseProfile:
         """估计噪声频谱特征"""
         # 计算STFT
-        f, t, Zxx = signal.stft(
-            noise_sample, 
-            fs=self.sample_rate, 
-            nperseg=self.frame_size,
-            noverlap=int(self.frame_size * self.overlap)
-        )
+        Zxx = self.framer.stft(noise_sample)
         
         # 计算噪声功率谱密度
         noise_power = np.mean(np.abs(Zxx)**2, axis=1)
@@ -78,6 +305,7 @@ class SpectralSubtraction:
         )
         
         self.noise_profile = noise_profile
+        self._noise_sqrt = np.sqrt(noise_power).astype(self.framer.dtype)[:, np.newaxis]
         return noise_profile
     
     def process(self, audio_data: np.ndarray) -> np.ndarray:
@@ -86,30 +314,52 @@ class SpectralSubtraction:
             logging.warning("未设置噪声配置文件，跳过降噪")
             return audio_data
         
+        if self.use_gpu:
+            return self._process_gpu(audio_data)
+        
         # 计算STFT
-        f, t, Zxx = signal.stft(
-            audio_data,
-            fs=self.sample_rate,
-            nperseg=self.frame_size,
-            noverlap=int(self.frame_size * self.overlap)
-        )
+        Zxx = self.framer.stft(audio_data)
         
-        # 获取幅度和相位
+        # 频谱减法，折算成每个频点的实数增益直接乘在复数谱上，相位自然保留
         magnitude = np.abs(Zxx)
-        phase = np.angle(Zxx)
-        
-        # 频谱减法
-        noise_floor = np.sqrt(self.noise_profile.noise_floor[:, np.newaxis])
-        subtracted = magnitude - self.alpha * noise_floor
+        gain = magnitude - self.alpha * self._noise_sqrt
         
         # 应用频谱下限
-        subtracted = np.maximum(subtracted, self.beta * noise_floor)
+        np.maximum(gain, self.beta * self._noise_sqrt, out=gain)
+        
+        magnitude += 1e-12
+        gain /= magnitude
+        Zxx *= gain
         
         # 重构信号
-        enhanced_Zxx = subtracted * np.exp(1j * phase)
-        _, processed = signal.istft(enhanced_Zxx, fs=self.sample_rate)
+        return self.framer.istft(Zxx, len(audio_data))
+    
+    def _process_gpu(self, audio_data: np.ndarray) -> np.ndarray:
+        """在GPU上完成STFT、频谱减法和ISTFT，音频只上传和下载各一次
+        
+        计算提交到独立的非阻塞流，调用方可以在等待期间准备下一段数据
+        """
+        noverlap = self.frame_size - self.hop_size
+        
+        with self._stream:
+            data = cp.asarray(audio_data, dtype=cp.float32)
+            _, _, Zxx = cp_signal.stft(
+                data, fs=self.sample_rate, nperseg=self.frame_size, noverlap=noverlap
+            )
+            
+            magnitude = cp.abs(Zxx)
+            noise_floor = cp.asarray(self._noise_sqrt)
+            gain = cp.maximum(magnitude - self.alpha * noise_floor, self.beta * noise_floor)
+            gain /= magnitude + 1e-12
+            Zxx *= gain
+            
+            _, processed = cp_signal.istft(
+                Zxx, fs=self.sample_rate, nperseg=self.frame_size, noverlap=noverlap
+            )
+            result = cp.asnumpy(processed[:len(audio_data)], stream=self._stream)
         
-        return processed
+        self._stream.synchronize()
+        return result
 
 class WienerFilter:
     """维纳滤波器降噪"""
@@ -134,19 +384,67 @@ class WienerFilter:
         h_wiener = clean_psd / (clean_psd + noise_psd)
         return h_wiener
     
+    def _gain_for(self, wiener_filter: np.ndarray, num_bins: int) -> np.ndarray:
+        """把滤波器(均匀覆盖0~奈奎斯特频率)线性插值到num_bins个rfft频点
+        
+        每次调用都重新插值（相对rfft开销可忽略），调用方原地更新滤波器数组也能生效
+        """
+        wiener_filter = np.asarray(wiener_filter)
+        if len(wiener_filter) == num_bins:
+            return wiener_filter.astype(np.float32)
+        return np.interp(
+            np.linspace(0, 1, num_bins),
+            np.linspace(0, 1, len(wiener_filter)),
+            wiener_filter
+        ).astype(np.float32)
+    
     def apply_filter(self, audio_data: np.ndarray, wiener_filter: np.ndarray) -> np.ndarray:
         """应用维纳滤波器"""
-        # 计算FFT
-        fft_data = np.fft.rfft(audio_data)
+        # 计算FFT，float32输入得到complex64频谱
+        audio_data = np.asarray(audio_data, dtype=np.float32)
+        filtered_fft = scipy.fft.rfft(audio_data, workers=-1)
         
-        # 应用滤波器
-        filtered_fft = fft_data * wiener_filter
+        # 应用滤波器，实数增益原地相乘
+        filtered_fft *= self._gain_for(wiener_filter, len(filtered_fft))
         
         # 反变换回时域
-        filtered = np.fft.irfft(filtered_fft, n=len(audio_data))
+        filtered = scipy.fft.irfft(filtered_fft, n=len(audio_data), workers=-1)
         
         return filtered
 
+@njit(cache=True, fastmath=True)
+def _lms_kernel(input_signal: np.ndarray,
+                desired: np.ndarray,
+                weights: np.ndarray,
+                mu: float,
+                normalize: bool,
+                output: np.ndarray):
+    """逐样本(N)LMS自适应滤波，原地更新weights并写入output
+    
+    输入向量为input_signal[n-L:n]，权重每个样本都会变化，只能串行计算
+    """
+    L = weights.shape[0]
+    for n in range(L, desired.shape[0]):
+        base = n - L
+        
+        # 计算输出和输入能量
+        y = 0.0
+        norm = 0.0
+        for k in range(L):
+            x = input_signal[base + k]
+            y += weights[k] * x
+            norm += x * x
+        
+        # 计算误差并更新权重
+        e = desired[n] - y
+        step = mu * e
+        if normalize:
+            step /= norm + 1e-10
+        for k in range(L):
+            weights[k] += step * input_signal[base + k]
+        
+        output[n] = y
+
 class AdaptiveNoiseReduction:
     """自适应降噪算法"""
     
@@ -158,46 +456,24 @@ class AdaptiveNoiseReduction:
         # LMS滤波器权重
         self.weights = np.zeros(filter_order)
         
-    def lms_update(self, input_signal: np.ndarray, desired: np.ndarray) -> np.ndarray:
-        """LMS算法更新"""
+        # 预热JIT，避免首次调用时触发编译
+        dummy = np.zeros(1)
+        _lms_kernel(dummy, dummy, np.zeros(filter_order), self.mu, False, dummy)
+    
+    def _run(self, input_signal: np.ndarray, desired: np.ndarray, normalize: bool) -> np.ndarray:
+        input_signal = np.ascontiguousarray(input_signal, dtype=np.float64)
+        desired = np.ascontiguousarray(desired, dtype=np.float64)
         output = np.zeros(len(desired))
-        
-        for n in range(self.filter_order, len(desired)):
-            # 获取输入向量
-            x = input_signal[n-self.filter_order:n]
-            
-            # 计算输出
-            y = np.dot(self.weights, x)
-            
-            # 计算误差
-            e = desired[n] - y
-            
-            # 更新权重
-            self.weights += self.mu * e * x
-            
-            output[n] = y
-        
+        _lms_kernel(input_signal, desired, self.weights, self.mu, normalize, output)
         return output
+        
+    def lms_update(self, input_signal: np.ndarray, desired: np.ndarray) -> np.ndarray:
+        """LMS算法更新"""
+        return self._run(input_signal, desired, False)
     
     def nlms_update(self, input_signal: np.ndarray, desired: np.ndarray) -> np.ndarray:
         """归一化LMS算法更新"""
-        output = np.zeros(len(desired))
-        
-        for n in range(self.filter_order, len(desired)):
-            x = input_signal[n-self.filter_order:n]
-            
-            # 归一化因子
-            norm = np.dot(x, x) + 1e-10
-            
-            y = np.dot(self.weights, x)
-            e = desired[n] - y
-            
-            # 归一化更新
-            self.weights += (self.mu / norm) * e * x
-            
-            output[n] = y
-        
-        return output
+        return self._run(input_signal, desired, True)
 
 class DeepLearningNoiseReduction:
     """深度学习降噪算法（简化实现）"""
@@ -221,12 +497,10 @@ class DeepLearningNoiseReduction:
         frame_size = 1024
         hop_size = 512
         
-        frames = []
-        for i in range(0, len(audio_data) - frame_size + 1, hop_size):
-            frame = audio_data[i:i+frame_size]
-            frames.append(frame)
+        if len(audio_data) < frame_size:
+            return np.empty((0, frame_size), dtype=audio_data.dtype)
         
-        return np.array(frames)
+        return np.lib.stride_tricks.sliding_window_view(audio_data, frame_size)[::hop_size].copy()
     
     def postprocess(self, frames: np.ndarray) -> np.ndarray:
         """后处理重构音频"""
@@ -235,12 +509,8 @@ class DeepLearningNoiseReduction:
         hop_size = frame_size // 2
         
         signal_length = (len(frames) - 1) * hop_size + frame_size
-        reconstructed = np.zeros(signal_length)
-        
-        for i, frame in enumerate(frames):
-            start = i * hop_size
-            end = start + frame_size
-            reconstructed[start:end] += frame
+        reconstructed = _aligned_zeros(signal_length, frames.dtype)
+        _overlap_add(frames, hop_size, reconstructed)
         
         return reconstructed
     
@@ -258,17 +528,18 @@ class DeepLearningNoiseReduction:
 class NoiseReductionPipeline:
     """降噪算法管道"""
     
-    def __init__(self, sample_rate: int = 44100):
+    def __init__(self, sample_rate: int = 44100, use_gpu: bool = False):
         self.sample_rate = sample_rate
         
         # 初始化各种降噪算法
-        self.spectral_subtraction = SpectralSubtraction(sample_rate)
+        self.spectral_subtraction = SpectralSubtraction(sample_rate, use_gpu=use_gpu)
         self.wiener_filter = WienerFilter(sample_rate)
         self.adaptive_filter = AdaptiveNoiseReduction(sample_rate)
         self.dl_reduction = DeepLearningNoiseReduction()
         
-        # 结果存储
+        # 结果存储，处理结果和功率谱一并缓存供visualize_results直接绘图
         self.results = {}
+        self.input_analysis = {}
     
     def compare_algorithms(self, audio_file: str, noise_file: str) -> Dict:
         """比较不同降噪算法"""
@@ -278,9 +549,11 @@ class NoiseReductionPipeline:
         noise_data, _ = sf.read(noise_file)
         
         if sr != self.sample_rate:
-            from scipy.signal import resample
-            audio_data = resample(audio_data, int(len(audio_data) * self.sample_rate / sr))
-            noise_data = resample(noise_data, int(len(noise_data) * self.sample_rate / sr))
+            # 多相FIR重采样
+            g = math.gcd(sr, self.sample_rate)
+            up, down = self.sample_rate // g, sr // g
+            audio_data = signal.resample_poly(audio_data, up, down, axis=0)
+            noise_data = signal.resample_poly(noise_data, up, down, axis=0)
         
         # 估计噪声
         self.spectral_subtraction.estimate_noise(noise_data)
@@ -296,6 +569,12 @@ class NoiseReductionPipeline:
         }
         
         results = {}
+        snr_before = self._calculate_snr(audio_data, noise_data)
+        self.input_analysis = {
+            'audio_file': audio_file,
+            'audio': audio_data,
+            'psd': signal.welch(audio_data, fs=self.sample_rate)
+        }
         
         for name, algorithm in algorithms.items():
             try:
@@ -304,14 +583,15 @@ class NoiseReductionPipeline:
                 processing_time = time.time() - start_time
                 
                 # 计算SNR
-                snr_before = self._calculate_snr(audio_data, noise_data)
                 snr_after = self._calculate_snr(processed, noise_data)
                 
                 results[name] = {
                     'processing_time': processing_time,
                     'snr_before': snr_before,
                     'snr_after': snr_after,
-                    'snr_improvement': snr_after - snr_before
+                    'snr_improvement': snr_after - snr_before,
+                    'processed': processed,
+                    'psd': signal.welch(processed, fs=self.sample_rate)
                 }
                 
                 # 保存处理结果
@@ -335,9 +615,19 @@ class NoiseReductionPipeline:
             return float('inf')
     
     def visualize_results(self, audio_file: str, noise_file: str):
-        """可视化降噪结果"""
-        
-        audio_data, _ = sf.read(audio_file)
+        """可视化降噪结果，优先使用compare_algorithms缓存的处理结果和功率谱"""
+        
+        cached = self.results.get('spectral_subtraction', {})
+        if self.input_analysis.get('audio_file') == audio_file and 'psd' in cached:
+            audio_data = self.input_analysis['audio']
+            freqs, psd = self.input_analysis['psd']
+            processed = cached['processed']
+            freqs_proc, psd_proc = cached['psd']
+        else:
+            audio_data, _ = sf.read(audio_file)
+            freqs, psd = signal.welch(audio_data, fs=self.sample_rate)
+            processed = self.spectral_subtraction.process(audio_data)
+            freqs_proc, psd_proc = signal.welch(processed, fs=self.sample_rate)
         
         # 创建子图
         fig, axes = plt.subplots(3, 2, figsize=(15, 12))
@@ -348,19 +638,16 @@ class NoiseReductionPipeline:
         axes[0, 0].set_ylabel('幅度')
         
         # 频谱
-        freqs, psd = signal.welch(audio_data, fs=self.sample_rate)
         axes[0, 1].semilogy(freqs, psd)
         axes[0, 1].set_title('原始频谱')
         axes[0, 1].set_ylabel('功率谱密度')
         
         # 处理后的信号
-        processed = self.spectral_subtraction.process(audio_data)
         axes[1, 0].plot(processed[:1000])
         axes[1, 0].set_title('降噪后信号')
         axes[1, 0].set_ylabel('幅度')
         
         # 降噪后频谱
-        freqs_proc, psd_proc = signal.welch(processed, fs=self.sample_rate)
         axes[1, 1].semilogy(freqs_proc, psd_proc)
         axes[1, 1].set_title('降噪后频谱')
         axes[1, 1].set_ylabel('功率谱密度')
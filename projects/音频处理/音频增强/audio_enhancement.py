@@ -6,12 +6,62 @@
 
 import numpy as np
 import scipy.signal as signal
+from scipy.fft import rfft, rfftfreq, next_fast_len
 import soundfile as sf
 from typing import List, Tuple, Dict, Optional
 from dataclasses import dataclass
 import matplotlib.pyplot as plt
 import logging
 import json
+import math
+import os
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# 没有numba时内核按纯Python运行，结果相同但慢得多，便于在无JIT环境中部署
+try:
+    from numba import njit, prange, set_num_threads
+except ImportError:
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+    
+    prange = range
+    
+    def set_num_threads(n):
+        pass
+
+class _ParameterView(MutableMapping):
+    """处理器参数的字典视图，读写直接映射到处理器的同名属性（写入经set_parameters）"""
+    
+    __slots__ = ('_owner',)
+    
+    def __init__(self, owner):
+        self._owner = owner
+    
+    def __getitem__(self, key):
+        if key not in self._owner._PARAMETERS:
+            raise KeyError(key)
+        return getattr(self._owner, key)
+    
+    def __setitem__(self, key, value):
+        if key not in self._owner._PARAMETERS:
+            raise KeyError(key)
+        self._owner.set_parameters(**{key: value})
+    
+    def __delitem__(self, key):
+        raise TypeError("处理器参数不能删除")
+    
+    def __iter__(self):
+        return iter(self._owner._PARAMETERS)
+    
+    def __len__(self):
+        return len(self._owner._PARAMETERS)
+    
+    def __repr__(self):
+        return repr(dict(self))
 
 @dataclass
 class EnhancementParams:
@@ -23,10 +73,17 @@ class EnhancementParams:
     stereo_width: float  # 立体声宽度
 
 class Equalizer:
-    """参数均衡器"""
+    """参数均衡器
     
-    def __init__(self, sample_rate: int = 44100, bands: List[Dict] = None):
+    realtime=False时，不少于FFT_MIN_LENGTH个样本的长缓冲改用截断冲激响应的FFT卷积，
+    截断处冲激响应剩余能量低于-100dB；实时/分块流式处理始终走sosfilt递推
+    """
+    
+    FFT_MIN_LENGTH = 1 << 20
+    
+    def __init__(self, sample_rate: int = 44100, bands: List[Dict] = None, realtime: bool = True):
         self.sample_rate = sample_rate
+        self.realtime = realtime
         
         # 默认频段
         if bands is None:
@@ -45,80 +102,200 @@ class Equalizer:
         else:
             self.bands = bands
             
-        self.filters = self._design_filters()
+        # 中心频率和Q不随增益变化，w0相关的三角函数只在构造时计算一次
+        two_pi_over_fs = 2 * np.pi / self.sample_rate
+        w0 = two_pi_over_fs * np.array([band['freq'] for band in self.bands], dtype=np.float64)
+        q = np.array([band['q'] for band in self.bands], dtype=np.float64)
+        self.cos_w0 = np.cos(w0)
+        self.alpha = np.sin(w0) / (2 * q)
+        
+        # (频段数, 6)的二阶节矩阵，每行为一个峰值滤波器的[b0, b1, b2, 1, a1, a2]
+        # 系数与递推状态保持float64：32Hz频段的极点贴近单位圆，float32递推的信噪比只有约74dB
+        self.sos = np.empty((len(self.bands), 6), dtype=np.float64)
+        for i in range(len(self.bands)):
+            self._design_band(i)
+        
+        # 各声道的滤波器状态，形状为(频段数, 声道, 2)，分块处理时在块间延续
+        self.zi = np.zeros((len(self.bands), 1, 2))
+        
+        # 离线FFT卷积用的截断冲激响应，系数变化时作废
+        self._fir = None
     
-    def _design_filters(self) -> List[Dict]:
-        """设计带通滤波器"""
-        filters = []
-        nyquist = self.sample_rate / 2
-        
-        for band in self.bands:
-            # 计算滤波器系数
-            w0 = 2 * np.pi * band['freq'] / self.sample_rate
-            alpha = np.sin(w0) / (2 * band['q'])
-            
-            # 峰值滤波器系数
-            A = 10**(band['gain'] / 40)
-            
-            b0 = 1 + alpha * A
-            b1 = -2 * np.cos(w0)
-            b2 = 1 - alpha * A
-            a0 = 1 + alpha / A
-            a1 = -2 * np.cos(w0)
-            a2 = 1 - alpha / A
-            
-            # 归一化
-            b = [b0 / a0, b1 / a0, b2 / a0]
-            a = [1, a1 / a0, a2 / a0]
-            
-            filters.append({
-                'b': b,
-                'a': a,
-                'freq': band['freq'],
-                'q': band['q'],
-                'gain': band['gain']
-            })
-        
-        return filters
+    def _design_band(self, i: int):
+        """只重新设计第i个频段的峰值滤波器，结果写入self.sos[i]"""
+        A = 10**(self.bands[i]['gain'] / 40)
+        alpha = self.alpha[i]
+        a0 = 1 + alpha / A
+        b1 = -2 * self.cos_w0[i] / a0
+        
+        # 归一化
+        self.sos[i] = ((1 + alpha * A) / a0, b1, (1 - alpha * A) / a0,
+                       1.0, b1, (1 - alpha / A) / a0)
+        self._fir = None
+    
+    def _impulse_response(self, max_length: int = 1 << 16) -> np.ndarray:
+        """级联滤波器的冲激响应，截断到剩余能量低于总能量-100dB处"""
+        if self._fir is None:
+            impulse = np.zeros(max_length)
+            impulse[0] = 1.0
+            h = signal.sosfilt(self.sos, impulse)
+            tail_energy = np.cumsum(h[::-1]**2)[::-1]
+            self._fir = h[:max(1, np.count_nonzero(tail_energy > 1e-10 * tail_energy[0]))]
+        return self._fir
+    
+    def _process_fir(self, channels: np.ndarray) -> np.ndarray:
+        """离线长缓冲的FFT卷积路径，结果与sosfilt一致到截断精度，并同样维护self.zi"""
+        num_channels, n = channels.shape
+        h = self._impulse_response().astype(channels.dtype)
+        zi = self.zi[:, :num_channels]
+        
+        # 因果卷积取full的前n个样本，再叠加起始状态的零输入响应
+        processed = signal.oaconvolve(channels, h[None], mode='full', axes=-1)[:, :n]
+        head = min(len(h), n)
+        zero_input, _ = signal.sosfilt(self.sos, np.zeros((num_channels, head)), axis=-1, zi=zi)
+        processed[:, :head] += zero_input
+        
+        # 末尾状态只取决于最后len(h)个输入，更早输入的贡献已低于截断门限
+        tail = channels[:, -len(h):]
+        _, self.zi[:, :num_channels] = signal.sosfilt(
+            self.sos, tail, axis=-1, zi=np.zeros_like(zi)
+        )
+        return processed
+    
+    def reset(self, initial: Optional[np.ndarray] = None):
+        """重置滤波器状态
+        
+        initial为各声道的起始电平时，用sosfilt_zi设为该电平下的稳态，避免起始瞬态；
+        默认清零。set_gain不动状态，系数变化时递推平滑过渡而不是从零重启
+        """
+        if initial is None:
+            self.zi = np.zeros((len(self.sos), 1, 2))
+        else:
+            initial = np.atleast_1d(np.asarray(initial, dtype=np.float64))
+            self.zi = signal.sosfilt_zi(self.sos)[:, None, :] * initial[None, :, None]
     
     def set_gain(self, band_index: int, gain: float):
-        """设置频段增益"""
+        """设置频段增益，只更新对应频段的系数"""
         if 0 <= band_index < len(self.bands):
             self.bands[band_index]['gain'] = gain
-            self.filters = self._design_filters()
+            self._design_band(band_index)
     
     def process(self, audio_data: np.ndarray) -> np.ndarray:
-        """应用均衡器"""
-        processed = audio_data.copy()
-        
-        for filter_info in self.filters:
-            processed = signal.lfilter(filter_info['b'], filter_info['a'], processed)
+        """应用均衡器，所有频段在一次sosfilt调用中级联，输入为单声道或(声道, 样本)数组"""
+        channels = audio_data.reshape(-1, audio_data.shape[-1])
+        num_channels = len(channels)
+        if self.zi.shape[1] < num_channels:
+            extra = np.zeros((len(self.sos), num_channels - self.zi.shape[1], 2))
+            self.zi = np.concatenate((self.zi, extra), axis=1)
+        
+        if not self.realtime and channels.shape[1] >= self.FFT_MIN_LENGTH:
+            processed = self._process_fir(channels)
+        else:
+            processed, self.zi[:, :num_channels] = signal.sosfilt(
+                self.sos, channels, axis=-1, zi=self.zi[:, :num_channels]
+            )
+        return processed.astype(audio_data.dtype, copy=False).reshape(audio_data.shape)
+
+@njit(cache=True, fastmath=True, nogil=True, parallel=True)
+def _compress_kernel(x: np.ndarray,
+                     out: np.ndarray,
+                     envelopes: np.ndarray,
+                     gain_lut: np.ndarray,
+                     attack_coeff: float,
+                     release_coeff: float,
+                     threshold: float,
+                     ratio: float,
+                     knee_width: float,
+                     makeup_linear: float):
+    """逐样本包络跟踪+软拐点增益计算
+    
+    x/out形状为(声道, 样本)，各声道独立并行；envelopes保存各声道包络，原地更新保证块间连续。
+    gain_lut为包络在[0, 1]上均匀采样的线性增益表，包络超过1时才回退到log10/pow精确计算
+    """
+    for c in prange(x.shape[0]):
+        envelopes[c] = _compress_channel(
+            x[c], out[c], envelopes[c], gain_lut, attack_coeff, release_coeff,
+            threshold, ratio, knee_width, makeup_linear
+        )
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _envelope_gain(envelope, gain_lut, threshold, ratio, knee_width):
+    """由包络得到线性增益：查表并在相邻两项间线性插值，包络超过1时精确计算"""
+    last = gain_lut.shape[0] - 1
+    pos = envelope * last
+    idx = int(pos)
+    if idx < last:
+        return gain_lut[idx] + (pos - idx) * (gain_lut[idx + 1] - gain_lut[idx])
+    
+    input_db = 20 * math.log10(envelope + 1e-10)
+    gain_db = 0.0
+    if input_db > threshold:
+        excess = input_db - threshold
+        if excess <= knee_width / 2:
+            gain_db = -excess**2 / (2 * knee_width)
+        else:
+            gain_db = -(excess * (1 - 1 / ratio) + knee_width / 4)
+    return 10**(gain_db / 20)
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _compress_channel(x, out, envelope, gain_lut, attack_coeff, release_coeff,
+                      threshold, ratio, knee_width, makeup_linear):
+    for i in range(x.shape[0]):
+        # 计算信号包络
+        abs_sample = abs(x[i])
+        if abs_sample > envelope:
+            envelope = attack_coeff * envelope + (1 - attack_coeff) * abs_sample
+        else:
+            envelope = release_coeff * envelope + (1 - release_coeff) * abs_sample
         
-        return processed
+        gain = _envelope_gain(envelope, gain_lut, threshold, ratio, knee_width)
+        out[i] = x[i] * gain * makeup_linear
+    
+    return envelope
 
 class DynamicRangeCompressor:
     """动态范围压缩器"""
     
+    _PARAMETERS = ('threshold', 'ratio', 'attack_time', 'release_time', 'knee_width', 'makeup_gain')
+    __slots__ = ('sample_rate',) + _PARAMETERS + ('envelope', 'gain_reduction', '_gain_lut', '_lut_key')
+    
     def __init__(self, sample_rate: int = 44100):
         self.sample_rate = sample_rate
-        self.parameters = {
-            'threshold': -20.0,      # 阈值 (dB)
-            'ratio': 4.0,            # 压缩比
-            'attack_time': 10.0,     # 启动时间 (ms)
-            'release_time': 100.0,   # 释放时间 (ms)
-            'knee_width': 3.0,       # 拐点宽度 (dB)
-            'makeup_gain': 0.0       # 补偿增益 (dB)
-        }
-        
-        # 状态变量
-        self.envelope = 0.0
+        self.threshold = -20.0       # 阈值 (dB)
+        self.ratio = 4.0             # 压缩比
+        self.attack_time = 10.0      # 启动时间 (ms)
+        self.release_time = 100.0    # 释放时间 (ms)
+        self.knee_width = 3.0        # 拐点宽度 (dB)
+        self.makeup_gain = 0.0       # 补偿增益 (dB)
+        
+        # 状态变量，包络按声道保存
+        self.envelope = np.zeros(1)
         self.gain_reduction = 0.0
+        self._build_gain_lut()
+    
+    @property
+    def parameters(self) -> MutableMapping:
+        """参数的字典视图，修改会同步到处理器"""
+        return _ParameterView(self)
+    
+    def reset(self):
+        """清空各声道包络"""
+        self.envelope = np.zeros(1)
     
     def set_parameters(self, **kwargs):
         """设置压缩器参数"""
         for key, value in kwargs.items():
-            if key in self.parameters:
-                self.parameters[key] = value
+            if key in self._PARAMETERS:
+                setattr(self, key, value)
+    
+    def _build_gain_lut(self, size: int = 4096):
+        """把增益曲线在包络[0, 1]上制成线性增益表，替代逐样本的log10和pow
+        
+        表对应的(threshold, ratio, knee_width)记在_lut_key中，参数变化后在_kernel_args里重建
+        """
+        env_grid = np.linspace(0.0, 1.0, size)
+        self._gain_lut = self._db_to_linear(self._calculate_gain(env_grid)).astype(np.float32)
+        self._lut_key = (self.threshold, self.ratio, self.knee_width)
     
     def _db_to_linear(self, db: float) -> float:
         """dB转线性"""
@@ -128,67 +305,170 @@ class DynamicRangeCompressor:
         """线性转dB"""
         return 20 * np.log10(np.abs(linear) + 1e-10)
     
-    def _calculate_gain(self, input_level: float) -> float:
-        """计算增益衰减"""
+    def _calculate_gain(self, input_level: np.ndarray) -> np.ndarray:
+        """计算增益衰减(dB)，支持标量或数组输入"""
         # 转换到dB域
         input_db = self._linear_to_db(input_level)
         
-        # 计算超过阈值的部分
-        if input_db > self.parameters['threshold']:
-            # 软拐点压缩
-            excess = input_db - self.parameters['threshold']
-            
-            if excess <= self.parameters['knee_width'] / 2:
-                # 软拐点区域
-                gain_reduction = excess**2 / (2 * self.parameters['knee_width'])
-            else:
-                # 压缩区域
-                gain_reduction = excess * (1 - 1/self.parameters['ratio']) + \
-                               self.parameters['knee_width'] / 4
-                
-            return -gain_reduction
+        # 计算超过阈值的部分，未超过阈值时为0
+        excess = np.maximum(input_db - self.threshold, 0.0)
         
-        return 0.0
+        # 软拐点区域为二次曲线，压缩区域为直线
+        gain_reduction = np.where(
+            excess <= self.knee_width / 2,
+            excess**2 / (2 * self.knee_width),
+            excess * (1 - 1/self.ratio) + self.knee_width / 4
+        )
+        
+        return -gain_reduction
+    
+    def _kernel_args(self, num_channels: int) -> tuple:
+        """按需扩展各声道包络，返回压缩内核在输入/输出数组之后的参数"""
+        # 直接给属性赋值也会生效：增益曲线参数变化时重建查找表
+        if self._lut_key != (self.threshold, self.ratio, self.knee_width):
+            self._build_gain_lut()
+        
+        if len(self.envelope) < num_channels:
+            self.envelope = np.concatenate(
+                (self.envelope, np.zeros(num_channels - len(self.envelope))))
+        
+        # 包络平滑系数
+        attack_coeff = np.exp(-1 / (self.attack_time * self.sample_rate / 1000))
+        release_coeff = np.exp(-1 / (self.release_time * self.sample_rate / 1000))
+        
+        return (self.envelope, self._gain_lut, attack_coeff, release_coeff,
+                float(self.threshold), float(self.ratio),
+                float(self.knee_width),
+                self._db_to_linear(self.makeup_gain))
     
     def process(self, audio_data: np.ndarray) -> np.ndarray:
-        """应用动态压缩"""
-        processed = np.zeros_like(audio_data)
-        
-        # 计算包络
-        attack_coeff = np.exp(-1 / (self.parameters['attack_time'] * self.sample_rate / 1000))
-        release_coeff = np.exp(-1 / (self.parameters['release_time'] * self.sample_rate / 1000))
-        
-        for i, sample in enumerate(audio_data):
-            # 计算信号包络
-            abs_sample = np.abs(sample)
-            if abs_sample > self.envelope:
-                self.envelope = attack_coeff * self.envelope + (1 - attack_coeff) * abs_sample
-            else:
-                self.envelope = release_coeff * self.envelope + (1 - release_coeff) * abs_sample
-            
-            # 计算增益
-            gain_db = self._calculate_gain(self.envelope)
-            gain_linear = self._db_to_linear(gain_db + self.parameters['makeup_gain'])
+        """应用动态压缩，输入为单声道或(声道, 样本)数组"""
+        audio_data = np.ascontiguousarray(audio_data)
+        channels = audio_data.reshape(-1, audio_data.shape[-1])
+        processed = np.empty_like(channels)
+        
+        _compress_kernel(channels, processed, *self._kernel_args(len(channels)))
+        
+        np.clip(processed, -1.0, 1.0, out=processed)
+        return processed.reshape(audio_data.shape)
+
+@njit(cache=True, fastmath=True, nogil=True, parallel=True)
+def _reverb_kernel(x: np.ndarray,
+                   out: np.ndarray,
+                   buffers: np.ndarray,
+                   delays: np.ndarray,
+                   write_indices: np.ndarray,
+                   damping: float,
+                   room_size: float,
+                   dry_level: float,
+                   wet_scale: float):
+    """Schroeder梳状滤波器组
+    
+    x/out形状为(声道, 样本)，buffers为(声道, 梳数, 2的幂)，各声道独立并行，
+    write_indices保存各声道写指针并原地更新
+    """
+    for c in prange(x.shape[0]):
+        write_indices[c] = _reverb_channel(
+            x[c], out[c], buffers[c], delays, write_indices[c],
+            damping, room_size, dry_level, wet_scale
+        )
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _reverb_channel(x, out, buffers, delays, write_index,
+                    damping, room_size, dry_level, wet_scale):
+    """单声道梳状滤波器组，返回新的写指针
+    
+    buffers为(梳数, 2的幂)的延迟线，所有梳共用写指针，第j条从写指针之前delays[j]处读取，
+    下标用& mask回绕，每个样本对各梳的读写是同一位置上的一组等宽操作
+    """
+    num_combs = buffers.shape[0]
+    mask = buffers.shape[1] - 1
+    feedback_gain = (1 - damping) * room_size
+    
+    for i in range(x.shape[0]):
+        sample = x[i]
+        wet = 0.0
+        
+        for j in range(num_combs):
+            # 获取延迟样本并更新延迟缓冲区
+            delayed_sample = buffers[j, (write_index - delays[j]) & mask]
+            buffers[j, write_index] = sample + delayed_sample * feedback_gain
             
-            processed[i] = sample * gain_linear
+            # 累加湿信号
+            wet += delayed_sample
         
-        return np.clip(processed, -1.0, 1.0)
+        write_index = (write_index + 1) & mask
+        out[i] = sample * dry_level + wet * wet_scale
+    
+    return write_index
+
+@njit(cache=True, fastmath=True, nogil=True, parallel=True)
+def _comp_reverb_kernel(x, out,
+                        envelopes, gain_lut, attack_coeff, release_coeff,
+                        threshold, ratio, knee_width, makeup_linear,
+                        buffers, delays, write_indices,
+                        damping, room_size, dry_level, wet_scale):
+    """压缩器与混响融合的内核，x只读一次、out只写一次，中间结果不落地
+    
+    参数依次为输入/输出、_compress_kernel的状态与参数、_reverb_kernel的状态与参数，
+    与分别调用两个内核(压缩后限幅到[-1, 1]再进混响)的结果一致
+    """
+    for c in prange(x.shape[0]):
+        envelopes[c], write_indices[c] = _comp_reverb_channel(
+            x[c], out[c], envelopes[c], gain_lut, attack_coeff, release_coeff,
+            threshold, ratio, knee_width, makeup_linear,
+            buffers[c], delays, write_indices[c],
+            damping, room_size, dry_level, wet_scale
+        )
+
+@njit(cache=True, fastmath=True, nogil=True)
+def _comp_reverb_channel(x, out, envelope, gain_lut, attack_coeff, release_coeff,
+                         threshold, ratio, knee_width, makeup_linear,
+                         buffers, delays, write_index,
+                         damping, room_size, dry_level, wet_scale):
+    num_combs = buffers.shape[0]
+    mask = buffers.shape[1] - 1
+    feedback_gain = (1 - damping) * room_size
+    
+    for i in range(x.shape[0]):
+        # 压缩：包络跟踪、查表增益、限幅
+        abs_sample = abs(x[i])
+        if abs_sample > envelope:
+            envelope = attack_coeff * envelope + (1 - attack_coeff) * abs_sample
+        else:
+            envelope = release_coeff * envelope + (1 - release_coeff) * abs_sample
+        
+        gain = _envelope_gain(envelope, gain_lut, threshold, ratio, knee_width)
+        sample = min(max(x[i] * gain * makeup_linear, -1.0), 1.0)
+        
+        # 混响：梳状滤波器组
+        wet = 0.0
+        for j in range(num_combs):
+            delayed_sample = buffers[j, (write_index - delays[j]) & mask]
+            buffers[j, write_index] = sample + delayed_sample * feedback_gain
+            wet += delayed_sample
+        
+        write_index = (write_index + 1) & mask
+        out[i] = min(max(sample * dry_level + wet * wet_scale, -1.0), 1.0)
+    
+    return envelope, write_index
 
 class ReverbGenerator:
     """混响生成器"""
     
+    _PARAMETERS = ('room_size', 'damping', 'wet_level', 'dry_level', 'width')
+    __slots__ = ('sample_rate',) + _PARAMETERS + (
+        'delay_times', 'buffers', 'delay_lengths', 'write_indices')
+    
     def __init__(self, sample_rate: int = 44100):
         self.sample_rate = sample_rate
-        self.parameters = {
-            'room_size': 0.5,      # 房间大小 (0-1)
-            'damping': 0.5,        # 阻尼 (0-1)
-            'wet_level': 0.3,      # 湿信号电平
-            'dry_level': 0.7,      # 干信号电平
-            'width': 1.0           # 立体声宽度
-        }
+        self.room_size = 0.5         # 房间大小 (0-1)
+        self.damping = 0.5           # 阻尼 (0-1)
+        self.wet_level = 0.3         # 湿信号电平
+        self.dry_level = 0.7         # 干信号电平
+        self.width = 1.0             # 立体声宽度
         
         # 延迟线
-        self.delay_buffers = []
         self.delay_times = []
         
         # 初始化梳状滤波器
@@ -200,87 +480,114 @@ class ReverbGenerator:
         delay_times_ms = [29.7, 37.1, 41.1, 43.7, 47.3, 53.3, 59.5, 67.1]
         
         self.delay_times = [int(ms * self.sample_rate / 1000) for ms in delay_times_ms]
-        self.delay_buffers = [np.zeros(dt) for dt in self.delay_times]
-        self.buffer_indices = [0] * len(self.delay_times)
+        
+        # 每个声道的延迟线放在一个(梳数, 2的幂)数组中，共用写指针，读位置按各自延迟回退
+        length = 1 << (max(self.delay_times) - 1).bit_length()
+        self.buffers = np.zeros((1, len(self.delay_times), length), dtype=np.float32)
+        self.delay_lengths = np.array(self.delay_times, dtype=np.int64)
+        self.write_indices = np.zeros(1, dtype=np.int64)
+    
+    def _kernel_args(self, num_channels: int) -> tuple:
+        """按需为新增声道分配独立的延迟线，返回混响内核在输入/输出数组之后的参数"""
+        extra = num_channels - len(self.buffers)
+        if extra > 0:
+            self.buffers = np.concatenate(
+                (self.buffers, np.zeros((extra,) + self.buffers.shape[1:], dtype=np.float32)))
+            self.write_indices = np.concatenate(
+                (self.write_indices, np.zeros(extra, dtype=np.int64)))
+        
+        return (self.buffers, self.delay_lengths, self.write_indices,
+                float(self.damping), float(self.room_size),
+                float(self.dry_level),
+                self.wet_level / len(self.delay_times))
+    
+    @property
+    def parameters(self) -> MutableMapping:
+        """参数的字典视图，修改会同步到处理器"""
+        return _ParameterView(self)
+    
+    def reset(self):
+        """清空各声道延迟线"""
+        self._init_comb_filters()
     
     def set_parameters(self, **kwargs):
         """设置混响参数"""
         for key, value in kwargs.items():
-            if key in self.parameters:
-                self.parameters[key] = value
+            if key in self._PARAMETERS:
+                setattr(self, key, value)
     
     def process(self, audio_data: np.ndarray) -> np.ndarray:
-        """应用混响效果"""
-        processed = np.zeros_like(audio_data)
+        """应用混响效果，输入为单声道或(声道, 样本)数组"""
+        audio_data = np.ascontiguousarray(audio_data)
+        channels = audio_data.reshape(-1, audio_data.shape[-1])
+        processed = np.empty_like(channels)
         
-        for i, sample in enumerate(audio_data):
-            # 干信号
-            dry = sample * self.parameters['dry_level']
-            
-            # 湿信号
-            wet = 0.0
-            
-            # 梳状滤波器
-            for j, (buffer, delay_time, buffer_idx) in enumerate(
-                zip(self.delay_buffers, self.delay_times, self.buffer_indices)
-            ):
-                # 获取延迟样本
-                delayed_sample = buffer[buffer_idx]
-                
-                # 更新延迟缓冲区
-                feedback = delayed_sample * (1 - self.parameters['damping'])
-                buffer[buffer_idx] = sample + feedback * self.parameters['room_size']
-                
-                # 更新索引
-                self.buffer_indices[j] = (buffer_idx + 1) % delay_time
-                
-                # 累加湿信号
-                wet += delayed_sample
-            
-            # 应用湿信号电平
-            wet *= self.parameters['wet_level'] / len(self.delay_buffers)
-            
-            processed[i] = dry + wet
+        _reverb_kernel(channels, processed, *self._kernel_args(len(channels)))
         
-        return np.clip(processed, -1.0, 1.0)
+        np.clip(processed, -1.0, 1.0, out=processed)
+        return processed.reshape(audio_data.shape)
 
 class StereoEnhancer:
     """立体声增强器"""
     
+    _PARAMETERS = ('width', 'delay_ms', 'mid_gain', 'side_gain')
+    __slots__ = ('sample_rate',) + _PARAMETERS + (
+        '_mid_lin', '_side_lin', '_gains_key', '_mid_buf', '_side_buf')
+    
     def __init__(self, sample_rate: int = 44100):
         self.sample_rate = sample_rate
-        self.parameters = {
-            'width': 1.0,          # 立体声宽度
-            'delay_ms': 0.1,       # 延迟时间
-            'mid_gain': 0.0,       # 中置增益
-            'side_gain': 0.0       # 侧置增益
-        }
-        
+        self.width = 1.0             # 立体声宽度
+        self.delay_ms = 0.1          # 延迟时间
+        self.mid_gain = 0.0          # 中置增益
+        self.side_gain = 0.0         # 侧置增益
+        self._update_gains()
+        
+        # M/S暂存缓冲区，分块处理时跨调用复用
+        self._mid_buf = np.empty(0, dtype=np.float32)
+        self._side_buf = np.empty(0, dtype=np.float32)
+        
+    @property
+    def parameters(self) -> MutableMapping:
+        """参数的字典视图，修改会同步到处理器"""
+        return _ParameterView(self)
+    
     def set_parameters(self, **kwargs):
         """设置立体声参数"""
         for key, value in kwargs.items():
-            if key in self.parameters:
-                self.parameters[key] = value
+            if key in self._PARAMETERS:
+                setattr(self, key, value)
+    
+    def _update_gains(self):
+        """预先算好M/S两路的线性增益，含M/S变换的1/2和宽度系数
+        
+        对应的(width, mid_gain, side_gain)记在_gains_key中，参数变化后在process_stereo里重算
+        """
+        self._mid_lin = 0.5 * self._db_to_linear(self.mid_gain)
+        self._side_lin = 0.5 * self._db_to_linear(self.side_gain) * self.width
+        self._gains_key = (self.width, self.mid_gain, self.side_gain)
     
     def process_stereo(self, left: np.ndarray, right: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """处理立体声信号"""
-        # 转换为M-S格式
-        mid = (left + right) / 2
-        side = (left - right) / 2
-        
-        # 应用增益
-        mid *= self._db_to_linear(self.parameters['mid_gain'])
-        side *= self._db_to_linear(self.parameters['side_gain'])
-        
-        # 立体声宽度控制
-        side *= self.parameters['width']
-        
-        # 添加延迟增强
-        delay_samples = int(self.parameters['delay_ms'] * self.sample_rate / 1000)
+        if self._gains_key != (self.width, self.mid_gain, self.side_gain):
+            self._update_gains()
+        
+        n = len(left)
+        dtype = np.result_type(left, right)
+        if len(self._mid_buf) < n or self._mid_buf.dtype != dtype:
+            self._mid_buf = np.empty(n, dtype=dtype)
+            self._side_buf = np.empty(n, dtype=dtype)
+        mid = self._mid_buf[:n]
+        side = self._side_buf[:n]
+        
+        # 转换为M-S格式并应用增益和宽度
+        np.add(left, right, out=mid)
+        mid *= self._mid_lin
+        np.subtract(left, right, out=side)
+        side *= self._side_lin
         
         # 转换回L-R格式
-        enhanced_left = mid + side
-        enhanced_right = mid - side
+        enhanced_left = np.add(mid, side)
+        enhanced_right = np.subtract(mid, side)
         
         return enhanced_left, enhanced_right
     
@@ -288,14 +595,74 @@ class StereoEnhancer:
         """dB转线性"""
         return 10**(db / 20)
 
+class StreamResampler:
+    """带状态的多相FIR重采样器，用于分块流式处理
+    
+    滤波器与scipy.signal.resample_poly的默认设计相同，各块输入首尾相接，
+    拼接后的输出与对整段信号调用resample_poly一致，块边界处没有补零造成的瞬态
+    """
+    
+    def __init__(self, up: int, down: int, num_channels: int = 1):
+        g = math.gcd(up, down)
+        self.up, self.down = up // g, down // g
+        
+        # 与resample_poly相同的Kaiser窗低通滤波器
+        max_rate = max(self.up, self.down)
+        self.half_len = 10 * max_rate
+        h = signal.firwin(2 * self.half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)) * self.up
+        
+        # 拆成多相形式：phases[p, j] = h[p + up * j]
+        self.num_taps = -(-len(h) // self.up)
+        padded = np.zeros(self.num_taps * self.up)
+        padded[:len(h)] = h
+        self.phases = padded.reshape(self.num_taps, self.up).T.copy()
+        
+        # 输入历史以num_taps个零开头，buffer_start为buffer第0列对应的输入样本序号
+        self.buffer = np.zeros((num_channels, self.num_taps), dtype=np.float32)
+        self.buffer_start = -self.num_taps
+        self.received = 0
+        self.next_output = 0
+    
+    def _emit(self, count: int) -> np.ndarray:
+        """计算从next_output开始的count个输出样本，并丢弃之后不再需要的输入历史"""
+        m = self.next_output + np.arange(count)
+        t = m * self.down + self.half_len
+        newest = t // self.up
+        idx = newest[:, None] - np.arange(self.num_taps) - self.buffer_start
+        output = np.einsum('cmj,mj->cm', self.buffer[:, idx], self.phases[t % self.up])
+        
+        self.next_output += count
+        oldest = (self.next_output * self.down + self.half_len) // self.up - self.num_taps + 1
+        drop = max(0, oldest - self.buffer_start)
+        self.buffer = self.buffer[:, drop:]
+        self.buffer_start += drop
+        return output.astype(np.float32)
+    
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """输入(声道, 样本)块，返回当前已能完整计算的输出样本"""
+        self.buffer = np.concatenate((self.buffer, block), axis=1)
+        self.received += block.shape[1]
+        
+        # 输出m所需的最新输入为(m * down + half_len) // up，必须已经到达
+        available = ((self.received - 1) * self.up - self.half_len) // self.down + 1
+        return self._emit(max(0, available - self.next_output))
+    
+    def flush(self) -> np.ndarray:
+        """输入结束后，以零补齐尾部并输出剩余样本"""
+        total = -(-self.received * self.up // self.down)
+        tail = self.half_len // self.up + self.num_taps
+        self.buffer = np.concatenate(
+            (self.buffer, np.zeros((len(self.buffer), tail), dtype=np.float32)), axis=1)
+        return self._emit(max(0, total - self.next_output))
+
 class AudioEnhancementPipeline:
-    """音频增强管道"""
+    """音频增强管道，realtime=False允许均衡器对长缓冲使用非流式的FFT卷积"""
     
-    def __init__(self, sample_rate: int = 44100):
+    def __init__(self, sample_rate: int = 44100, realtime: bool = True):
         self.sample_rate = sample_rate
         
         # 初始化各个模块
-        self.equalizer = Equalizer(sample_rate)
+        self.equalizer = Equalizer(sample_rate, realtime=realtime)
         self.compressor = DynamicRangeCompressor(sample_rate)
         self.reverb = ReverbGenerator(sample_rate)
         self.stereo_enhancer = StereoEnhancer(sample_rate)
@@ -308,6 +675,12 @@ class AudioEnhancementPipeline:
             self.stereo_enhancer
         ]
     
+    def reset(self):
+        """清空各级的块间状态，开始处理一段新的、与之前无关的音频"""
+        self.equalizer.reset()
+        self.compressor.reset()
+        self.reverb.reset()
+    
     def set_enhancement_parameters(self, params: EnhancementParams):
         """设置增强参数"""
         # 设置均衡器
@@ -327,25 +700,24 @@ class AudioEnhancementPipeline:
         self.stereo_enhancer.set_parameters(width=params.stereo_width)
     
     def process_mono(self, audio_data: np.ndarray) -> np.ndarray:
-        """处理单声道音频"""
-        processed = audio_data.copy()
-        
-        # 应用均衡器
-        processed = self.equalizer.process(processed)
-        
-        # 应用压缩器
-        processed = self.compressor.process(processed)
-        
-        # 应用混响
-        processed = self.reverb.process(processed)
+        """处理单声道音频，也接受(声道, 样本)数组，各声道状态独立"""
+        # 应用均衡器，输入只读不改，输出是本方法自有的新数组
+        processed = self.equalizer.process(audio_data)
+        
+        # 压缩器和混响在一个融合内核中逐样本完成，每个样本先读后写，直接原地写回均衡器输出
+        channels = processed.reshape(-1, processed.shape[-1])
+        _comp_reverb_kernel(
+            channels, channels,
+            *self.compressor._kernel_args(len(channels)),
+            *self.reverb._kernel_args(len(channels))
+        )
         
         return processed
     
     def process_stereo(self, left: np.ndarray, right: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """处理立体声音频"""
-        # 处理左右声道
-        left_processed = self.process_mono(left)
-        right_processed = self.process_mono(right)
+        # 左右声道作为(2, N)数组一起处理，各级内部按声道并行
+        left_processed, right_processed = self.process_mono(np.stack([left, right]))
         
         # 应用立体声增强
         left_final, right_final = self.stereo_enhancer.process_stereo(
@@ -354,33 +726,47 @@ class AudioEnhancementPipeline:
         
         return left_final, right_final
     
-    def process_file(self, input_file: str, output_file: str, params: EnhancementParams) -> Dict:
-        """处理音频文件"""
+    def _process_block(self, block: np.ndarray) -> np.ndarray:
+        """处理一个(声道, 样本)块，单声道返回(1, N)，多声道取前两个声道返回(2, N)"""
+        if len(block) == 1:
+            return self.process_mono(block)
+        
+        left, right = self.process_stereo(block[0], block[1])
+        return np.stack((left, right))
+    
+    def process_file(self, input_file: str, output_file: str, params: EnhancementParams,
+                     blocksize: int = 65536) -> Dict:
+        """处理音频文件
+        
+        按blocksize分块读取、处理并写出，各级的滤波器状态在块间延续，内存占用与文件长度无关
+        """
         try:
-            # 读取音频
-            audio_data, sr = sf.read(input_file)
-            
-            # 重采样
-            if sr != self.sample_rate:
-                from scipy.signal import resample
-                new_length = int(len(audio_data) * self.sample_rate / sr)
-                audio_data = resample(audio_data, new_length)
-            
             # 设置参数
             self.set_enhancement_parameters(params)
             
-            # 处理音频
-            if audio_data.ndim == 1:
-                # 单声道
-                processed = self.process_mono(audio_data)
-            else:
-                # 立体声
-                left, right = audio_data[:, 0], audio_data[:, 1]
-                left_processed, right_processed = self.process_stereo(left, right)
-                processed = np.column_stack((left_processed, right_processed))
+            # 块间延续各级状态，但不把上一个文件的尾音带进新文件
+            self.reset()
             
-            # 保存结果
-            sf.write(output_file, processed, self.sample_rate)
+            with sf.SoundFile(input_file) as fin, \
+                    sf.SoundFile(output_file, 'w', samplerate=self.sample_rate,
+                                 channels=min(fin.channels, 2), subtype='FLOAT') as fout:
+                # 采样率不同时逐块重采样
+                resampler = None
+                if fin.samplerate != self.sample_rate:
+                    resampler = StreamResampler(self.sample_rate, fin.samplerate, fin.channels)
+                
+                # 整条处理链按float32运行，块转置为连续的(声道, 样本)
+                for block in fin.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+                    block = np.ascontiguousarray(block.T)
+                    if resampler is not None:
+                        block = resampler.process(block)
+                    if block.shape[1]:
+                        fout.write(self._process_block(block).T)
+                
+                if resampler is not None:
+                    block = resampler.flush()
+                    if block.shape[1]:
+                        fout.write(self._process_block(block).T)
             
             return {
                 'success': True,
@@ -395,35 +781,38 @@ class AudioEnhancementPipeline:
                 'error': str(e)
             }
     
+    def process_files(self, input_files: List[str], output_files: List[str],
+                      params: EnhancementParams, max_workers: Optional[int] = None) -> List[Dict]:
+        """批量处理多个音频文件，每个文件在独立进程中用新建的管道流式处理
+        
+        文件之间没有状态依赖，按max_workers(默认CPU核数)个进程并行，结果顺序与输入一致
+        """
+        jobs = zip(input_files, output_files, repeat(params), repeat(self.sample_rate))
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            return list(executor.map(_process_one, jobs))
+    
     def analyze_enhancement(self, original: np.ndarray, enhanced: np.ndarray) -> Dict:
         """分析增强效果"""
         
-        # 计算频谱特征
-        def spectral_features(signal):
-            fft = np.fft.fft(signal)
-            magnitude = np.abs(fft)
-            
-            # 频谱质心
-            freqs = np.fft.fftfreq(len(signal), 1/self.sample_rate)
-            centroid = np.sum(freqs * magnitude) / np.sum(magnitude)
-            
-            # 频谱带宽
-            bandwidth = np.sqrt(np.sum(((freqs - centroid) ** 2) * magnitude) / np.sum(magnitude))
-            
-            # 频谱滚降
-            cumsum_magnitude = np.cumsum(magnitude)
-            rolloff_idx = np.where(cumsum_magnitude >= 0.85 * cumsum_magnitude[-1])[0][0]
-            rolloff = freqs[rolloff_idx]
-            
-            return {
-                'spectral_centroid': centroid,
-                'spectral_bandwidth': bandwidth,
-                'spectral_rolloff': rolloff
-            }
+        # 多声道(样本, 声道)先混为单声道，两段信号补零到同一快速长度后一次批量rfft
+        signals = [x.mean(axis=1) if x.ndim > 1 else x for x in (original, enhanced)]
+        n_fft = next_fast_len(max(len(x) for x in signals), real=True)
+        batch = np.zeros((2, n_fft))
+        for row, x in zip(batch, signals):
+            row[:len(x)] = x
+        magnitude = np.abs(rfft(batch, axis=-1))
+        freqs = rfftfreq(n_fft, 1/self.sample_rate)
+        total = magnitude.sum(axis=-1)
+        
+        # 频谱质心
+        centroid = (freqs * magnitude).sum(axis=-1) / total
         
-        # 计算特征
-        original_features = spectral_features(original)
-        enhanced_features = spectral_features(enhanced)
+        # 频谱带宽
+        bandwidth = np.sqrt((((freqs - centroid[:, None]) ** 2) * magnitude).sum(axis=-1) / total)
+        
+        # 频谱滚降
+        cumsum_magnitude = np.cumsum(magnitude, axis=-1)
+        rolloff = freqs[np.argmax(cumsum_magnitude >= 0.85 * cumsum_magnitude[:, -1:], axis=-1)]
         
         # 计算动态范围
         original_range = np.max(original) - np.min(original)
@@ -431,9 +820,9 @@ class AudioEnhancementPipeline:
         
         return {
             'spectral_changes': {
-                'centroid_shift': enhanced_features['spectral_centroid'] - original_features['spectral_centroid'],
-                'bandwidth_change': enhanced_features['spectral_bandwidth'] - original_features['spectral_bandwidth'],
-                'rolloff_shift': enhanced_features['spectral_rolloff'] - original_features['spectral_rolloff']
+                'centroid_shift': centroid[1] - centroid[0],
+                'bandwidth_change': bandwidth[1] - bandwidth[0],
+                'rolloff_shift': rolloff[1] - rolloff[0]
             },
             'dynamic_range': {
                 'original': original_range,
@@ -442,6 +831,14 @@ class AudioEnhancementPipeline:
             }
         }
 
+def _process_one(job: Tuple[str, str, EnhancementParams, int]) -> Dict:
+    """进程池工作函数：为单个文件新建管道，滤波器状态不在文件间共享"""
+    input_file, output_file, params, sample_rate = job
+    
+    # 并行度已由进程数提供，内核内部的按声道并行只会争抢核心
+    set_num_threads(1)
+    return AudioEnhancementPipeline(sample_rate).process_file(input_file, output_file, params)
+
 # 使用示例
 if __name__ == "__main__":
     # 创建增强管道
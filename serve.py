@@ -6,10 +6,10 @@ Default port: 8000
 """
 
 import http.server
-import socketserver
 import sys
 import os
 import webbrowser
+from functools import partial
 from threading import Timer
 
 # Default port
@@ -23,24 +23,27 @@ if len(sys.argv) > 1:
         print(f"Invalid port number: {sys.argv[1]}")
         sys.exit(1)
 
-# Change to the directory containing this script
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+# Serve the directory containing this script
+SERVE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    """Custom handler to serve index.html for all paths that don't exist."""
+    """Static file handler that adds CORS headers to every response.
+    
+    Directory requests such as '/' are answered with index.html by
+    SimpleHTTPRequestHandler itself.
+    """
+    
+    # CORS headers for local development, preformatted once
+    _CORS = (b'Access-Control-Allow-Origin: *\r\n'
+             b'Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n'
+             b'Access-Control-Allow-Headers: Content-Type\r\n')
     
     def end_headers(self):
-        # Add CORS headers for local development
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        # Append to the pending header buffer so the block goes out with the
+        # status line in the single flush done by end_headers (absent for HTTP/0.9)
+        if hasattr(self, '_headers_buffer'):
+            self._headers_buffer.append(self._CORS)
         super().end_headers()
-    
-    def do_GET(self):
-        # Serve index.html for root path
-        if self.path == '/':
-            self.path = '/index.html'
-        return super().do_GET()
 
 def open_browser():
     """Open the default web browser after a short delay."""
@@ -48,7 +51,10 @@ def open_browser():
 
 # Start the server
 try:
-    with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
+    handler = partial(MyHTTPRequestHandler, directory=SERVE_DIR)
+    with http.server.ThreadingHTTPServer(("", PORT), handler) as httpd:
+        # Handle concurrent asset requests on their own threads; don't wait for them on exit
+        httpd.daemon_threads = True
         print(f"🚀 Research Portfolio is running at:")
         print(f"   http://localhost:{PORT}")
         print(f"   http://127.0.0.1:{PORT}")